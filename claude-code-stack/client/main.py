@@ -1,11 +1,30 @@
 import os
 import json
 import re
+import hashlib
+import math
 import argparse
+import sys
+import queue
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 
 
-def build_prompt(user_instruction):
+def build_prompt(user_instruction, context=None):
+    context_text = ""
+    if context:
+        context_text = "项目中已有的相关文件如下（路径相对于项目根目录）:\n"
+        for path, content in context:
+            context_text += f"=== {path} ===\n{content}\n"
+        context_text += (
+            "请在这些文件的基础上修改，只返回需要新建或修改的文件，"
+            "没有改动的已有文件不要返回，修改的文件 path 与原路径保持一致。\n"
+        )
     template = (
         "你是一个代码助手。用户希望你根据需求生成一个或多个文件。\n"
         "你必须只返回一个 JSON 对象，不能包含任何额外文字、说明或注释。\n"
@@ -23,70 +42,998 @@ def build_prompt(user_instruction):
         "2. 不要使用绝对路径。\n"
         "3. 所有代码和文本都写在 content 字段中。\n"
         "4. 不要在 JSON 外多打一行文字。\n"
+        f"{context_text}"
         "用户指令如下:\n"
         f"{user_instruction}\n"
     )
     return template
 
 
-def call_ollama(model, prompt, base_url):
+TOKEN_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+|[\u4e00-\u9fff]")
+
+
+def tokenize(text):
+    # 按驼峰、下划线拆分标识符，中文按单字切分
+    return [t.lower() for t in TOKEN_RE.findall(text)]
+
+
+def estimate_tokens(text):
+    # 粗略估计：英文和代码约 4 个字符一个 token，中文约每字一个 token
+    non_ascii = len(text.encode("utf-8")) - len(text)
+    non_ascii_chars = non_ascii // 2
+    return (len(text) - non_ascii_chars) // 4 + non_ascii_chars + 1
+
+
+class ProjectIndex:
+    """项目文件的 BM25 索引，文件路径中的词按更高权重计入"""
+
+    SKIP_DIRS = {".git", "ai_generated", "node_modules", "__pycache__", ".venv", "venv", "dist", "build"}
+    PATH_WEIGHT = 3
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, root, max_file_bytes=200 * 1024):
+        self.docs = []
+        self.doc_freq = Counter()
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d not in self.SKIP_DIRS and not d.startswith(".")]
+            for name in filenames:
+                full_path = os.path.join(dirpath, name)
+                try:
+                    if os.path.getsize(full_path) > max_file_bytes:
+                        continue
+                    with open(full_path, "rb") as f:
+                        raw = f.read()
+                except OSError:
+                    continue
+                if b"\0" in raw[:1024]:
+                    continue
+                text = raw.decode("utf-8", errors="replace")
+                rel_path = os.path.relpath(full_path, root)
+                freqs = Counter(tokenize(text))
+                for token in tokenize(rel_path):
+                    freqs[token] += self.PATH_WEIGHT
+                self.docs.append((rel_path, text, freqs, sum(freqs.values())))
+                self.doc_freq.update(freqs.keys())
+        self.avg_len = sum(doc[3] for doc in self.docs) / len(self.docs) if self.docs else 0.0
+
+    def search(self, query):
+        terms = set(tokenize(query))
+        n = len(self.docs)
+        results = []
+        for rel_path, text, freqs, length in self.docs:
+            score = 0.0
+            for term in terms:
+                tf = freqs.get(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n - self.doc_freq[term] + 0.5) / (self.doc_freq[term] + 0.5))
+                score += idf * tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * length / self.avg_len))
+            if score > 0:
+                results.append((score, rel_path, text))
+        results.sort(key=lambda r: r[0], reverse=True)
+        return results
+
+
+def pack_context(index, query, budget_tokens):
+    """按相关度依次放入文件，超出预算的文件截断后结束"""
+    context = []
+    used = 0
+    for _, rel_path, text in index.search(query):
+        cost = estimate_tokens(rel_path) + estimate_tokens(text)
+        if used + cost > budget_tokens:
+            remaining = budget_tokens - used
+            if remaining > 200:
+                keep = int(len(text) * remaining / cost)
+                context.append((rel_path, text[:keep] + "\n...（已截断）"))
+                used = budget_tokens
+            break
+        context.append((rel_path, text))
+        used += cost
+    return context, used
+
+
+def build_messages(prompt):
+    return [
+        {
+            "role": "system",
+            "content": "You are a coding assistant. Always respond with pure JSON as instructed by the user.",
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        },
+    ]
+
+
+def make_session(pool_size=4):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def parse_keep_alive(value):
+    # Ollama 接受 "30m" 这样的时长字符串，纯数字按秒处理，-1 表示常驻
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def record_timings(data, meta):
+    # Ollama 返回的耗时单位为纳秒
+    if meta is not None:
+        meta["load_duration"] = data.get("load_duration", 0) / 1e9
+        meta["total_duration"] = data.get("total_duration", 0) / 1e9
+
+
+def call_ollama(model, prompt, base_url, session=None, keep_alive=None, meta=None):
     payload = {
         "model": model,
-        "messages": [
-            {
-                "role": "system",
-                "content": "You are a coding assistant. Always respond with pure JSON as instructed by the user.",
-            },
-            {
-                "role": "user",
-                "content": prompt,
-            },
-        ],
+        "messages": build_messages(prompt),
         "stream": False,
     }
-    resp = requests.post(base_url + "/api/chat", json=payload, timeout=600)
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    resp = (session or requests).post(base_url + "/api/chat", json=payload, timeout=600)
     resp.raise_for_status()
     data = resp.json()
+    record_timings(data, meta)
     message = data.get("message") or {}
     content = message.get("content") or ""
     return content
 
 
+def warm_up(model, base_url, session=None, keep_alive=None):
+    # 不带 prompt 的 /api/generate 请求只加载模型，不生成内容
+    payload = {"model": model}
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    start = time.time()
+    resp = (session or requests).post(base_url + "/api/generate", json=payload, timeout=600)
+    resp.raise_for_status()
+    return time.time() - start
+
+
+def start_keepalive_pinger(model, base_url, keep_alive, interval, session=None):
+    # 空闲时定期预热，模型被其他请求挤出（OLLAMA_MAX_LOADED_MODELS=1）后能提前重新加载；
+    # 复用交互模式的连接池，不为每次预热新建连接
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                warm_up(model, base_url, session, keep_alive)
+            except requests.RequestException:
+                pass
+
+    threading.Thread(target=loop, daemon=True).start()
+    return stop
+
+
+def stream_ollama(model, prompt, base_url, session=None, keep_alive=None, meta=None):
+    payload = {
+        "model": model,
+        "messages": build_messages(prompt),
+        "stream": True,
+    }
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    # 连接超时 10 秒；读超时针对相邻两个 chunk 之间的间隔
+    with (session or requests).post(base_url + "/api/chat", json=payload, stream=True, timeout=(10, 600)) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise RuntimeError(f"Ollama 返回错误: {data['error']}")
+            content = (data.get("message") or {}).get("content") or ""
+            if content:
+                yield content
+            if data.get("done"):
+                record_timings(data, meta)
+                break
+
+
+def openai_headers():
+    # LiteLLM 等网关需要的密钥
+    api_key = os.getenv("OPENAI_API_KEY")
+    return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+
+def call_openai(model, prompt, base_url, session=None):
+    payload = {
+        "model": model,
+        "messages": build_messages(prompt),
+        "stream": False,
+    }
+    resp = (session or requests).post(base_url + "/chat/completions", json=payload, headers=openai_headers(),
+                                      timeout=600)
+    resp.raise_for_status()
+    choices = resp.json().get("choices") or [{}]
+    return (choices[0].get("message") or {}).get("content") or ""
+
+
+def stream_openai(model, prompt, base_url, session=None):
+    payload = {
+        "model": model,
+        "messages": build_messages(prompt),
+        "stream": True,
+    }
+    with (session or requests).post(base_url + "/chat/completions", json=payload, headers=openai_headers(),
+                                    stream=True, timeout=(10, 600)) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            line = line.decode("utf-8").strip()
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            content = (choices[0].get("delta") or {}).get("content") or ""
+            if content:
+                yield content
+
+
+class Backend:
+    """一个推理后端：Ollama 原生接口或 OpenAI 兼容接口（vLLM、LiteLLM 等）"""
+
+    EWMA_ALPHA = 0.3
+    MIN_HEDGE_SAMPLES = 5
+
+    def __init__(self, kind, url, model):
+        self.kind = kind
+        self.url = url.rstrip("/")
+        self.model = model
+        self.name = f"{kind}:{self.url}"
+        self.healthy = True
+        self.latency_ewma = None
+        self.latencies = deque(maxlen=50)
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def chat(self, prompt, session=None, keep_alive=None, meta=None):
+        if self.kind == "ollama":
+            return call_ollama(self.model, prompt, self.url, session, keep_alive, meta)
+        return call_openai(self.model, prompt, self.url, session)
+
+    def stream(self, prompt, session=None, keep_alive=None, meta=None):
+        if self.kind == "ollama":
+            return stream_ollama(self.model, prompt, self.url, session, keep_alive, meta)
+        return stream_openai(self.model, prompt, self.url, session)
+
+    def check_health(self, session=None):
+        path = "/api/tags" if self.kind == "ollama" else "/models"
+        try:
+            resp = (session or requests).get(self.url + path, headers=openai_headers(), timeout=5)
+            self.healthy = resp.status_code == 200
+        except requests.RequestException:
+            self.healthy = False
+        return self.healthy
+
+    def record(self, elapsed):
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(elapsed)
+            if self.latency_ewma is None:
+                self.latency_ewma = elapsed
+            else:
+                self.latency_ewma += self.EWMA_ALPHA * (elapsed - self.latency_ewma)
+
+    def mark_failed(self):
+        with self.lock:
+            self.failures += 1
+            self.healthy = False
+
+    def hedge_delay(self, percentile):
+        # 样本太少时不发对冲请求
+        with self.lock:
+            samples = sorted(self.latencies)
+        if percentile <= 0 or len(samples) < self.MIN_HEDGE_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+
+def parse_backend(spec, default_model):
+    # 格式：类型,地址[,模型]，例如 openai,http://localhost:8000/v1,Qwen/Qwen2.5-7B-Instruct
+    parts = [p.strip() for p in spec.split(",")]
+    if len(parts) not in (2, 3) or parts[0] not in ("ollama", "openai"):
+        raise ValueError(f"后端格式错误: {spec}，应为 ollama|openai,地址[,模型]")
+    return Backend(parts[0], parts[1], parts[2] if len(parts) == 3 else default_model)
+
+
+class BackendRouter:
+    """按健康状态和延迟滑动平均选择后端，失败时切换，慢请求发送对冲请求"""
+
+    def __init__(self, backends, hedge_percentile=95, health_interval=30, session=None):
+        self.backends = backends
+        self.hedge_percentile = hedge_percentile
+        self.session = session or make_session()
+        for backend in backends:
+            backend.check_health(self.session)
+        if health_interval > 0 and len(backends) > 1:
+            threading.Thread(target=self._health_loop, args=(health_interval,), daemon=True).start()
+
+    def _health_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            for backend in self.backends:
+                backend.check_health(self.session)
+
+    def ranked(self):
+        # 健康的后端按平均延迟排序，尚无数据的优先尝试；不健康的排在最后兜底
+        def key(backend):
+            return (not backend.healthy, backend.latency_ewma or 0.0)
+        return sorted(self.backends, key=key)
+
+    def call(self, prompt, session=None, keep_alive=None, meta=None):
+        candidates = self.ranked()
+        results = queue.Queue()
+
+        def launch(backend):
+            def run():
+                backend_meta = {}
+                start = time.time()
+                try:
+                    content = backend.chat(prompt, session, keep_alive, backend_meta)
+                except (requests.RequestException, ValueError, RuntimeError) as e:
+                    backend.mark_failed()
+                    results.put((backend, None, e, backend_meta))
+                    return
+                backend.record(time.time() - start)
+                results.put((backend, content, None, backend_meta))
+
+            # 守护线程：被对冲请求赶超的慢请求不会阻止进程退出
+            threading.Thread(target=run, daemon=True).start()
+            return backend.hedge_delay(self.hedge_percentile)
+
+        hedge_delay = launch(candidates[0])
+        next_index = 1
+        pending = 1
+        hedged = False
+        last_error = None
+        while pending:
+            can_hedge = not hedged and hedge_delay is not None and next_index < len(candidates)
+            try:
+                backend, content, error, backend_meta = results.get(timeout=hedge_delay if can_hedge else None)
+            except queue.Empty:
+                print(f"{candidates[next_index - 1].name} 超过 p{self.hedge_percentile:g} 延迟 {hedge_delay:.1f}s，"
+                      f"向 {candidates[next_index].name} 发送对冲请求", file=sys.stderr)
+                launch(candidates[next_index])
+                next_index += 1
+                pending += 1
+                hedged = True
+                continue
+            pending -= 1
+            if error is None:
+                if meta is not None:
+                    meta.update(backend_meta)
+                    meta["backend"] = backend.name
+                    meta["model"] = backend.model
+                return content
+            last_error = error
+            print(f"后端 {backend.name} 请求失败: {error}", file=sys.stderr)
+            if pending == 0 and next_index < len(candidates):
+                hedge_delay = launch(candidates[next_index])
+                next_index += 1
+                pending += 1
+        raise last_error
+
+    def stream(self, prompt, session=None, keep_alive=None, meta=None):
+        # 流式请求不做对冲，只在收到第一个片段之前切换后端
+        last_error = None
+        for backend in self.ranked():
+            start = time.time()
+            received = False
+            try:
+                for chunk in backend.stream(prompt, session, keep_alive, meta):
+                    received = True
+                    yield chunk
+            except (requests.RequestException, ValueError, RuntimeError) as e:
+                backend.mark_failed()
+                if received:
+                    raise
+                last_error = e
+                print(f"后端 {backend.name} 请求失败: {e}", file=sys.stderr)
+                continue
+            backend.record(time.time() - start)
+            if meta is not None:
+                meta["backend"] = backend.name
+                meta["model"] = backend.model
+            return
+        raise last_error
+
+    def print_summary(self):
+        print(f"\n{'后端':<40}{'状态':<8}{'请求数':>8}{'失败数':>8}{'平均延迟':>10}")
+        for backend in self.backends:
+            status = "正常" if backend.healthy else "异常"
+            latency = f"{backend.latency_ewma:.1f}s" if backend.latency_ewma is not None else "-"
+            print(f"{backend.name:<40}{status:<8}{backend.requests:>8}{backend.failures:>8}{latency:>10}")
+
+
+class FilesStreamParser:
+    """
+    增量解析模型输出，顶层对象 files 数组中的每个元素闭合后立即返回
+
+    遇到已闭合但无法解析的元素（转义错误、字符串中的原始换行等）后不再返回任何元素，
+    failed 置为 True，last_end 停在最后一个完整元素之后，剩余部分交给 parse_files 修复
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string = None
+        self.pending_key = None
+        self.files_depth = None
+        self.item_start = None
+        self.last_end = 0
+        self.failed = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        if self.failed:
+            self.pos = len(self.text)
+            return completed
+        text = self.text
+        for i in range(self.pos, len(text)):
+            c = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start + 1:i]
+                continue
+            if c == '"':
+                self.in_string = True
+                self.string_start = i
+            elif c == ":":
+                self.pending_key = self.last_string if self.stack == ["{"] else None
+            elif c == ",":
+                self.pending_key = None
+            elif c in "{[":
+                if c == "[" and self.stack == ["{"] and self.pending_key == "files":
+                    self.files_depth = len(self.stack) + 1
+                elif c == "{" and self.files_depth and len(self.stack) == self.files_depth:
+                    self.item_start = i
+                self.stack.append(c)
+            elif c in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if c == "}" and self.item_start is not None and len(self.stack) == self.files_depth:
+                    try:
+                        completed.append(json.loads(text[self.item_start:i + 1]))
+                    except ValueError:
+                        self.failed = True
+                        break
+                    self.item_start = None
+                    self.last_end = i + 1
+                elif c == "]" and self.files_depth and len(self.stack) < self.files_depth:
+                    self.files_depth = None
+        self.pos = len(text)
+        return completed
+
+
+def clear_progress():
+    print("\r" + " " * 40 + "\r", end="", file=sys.stderr, flush=True)
+
+
+def generate_streaming(router, prompt, project_root, session=None, keep_alive=None, meta=None, repair_attempts=1):
+    start = time.time()
+    parser = FilesStreamParser()
+    streamed_paths = set()
+    written = []
+    summary = new_write_summary()
+    last_progress = 0.0
+    for chunk in router.stream(prompt, session, keep_alive, meta):
+        failed = parser.failed
+        for item in parser.feed(chunk):
+            streamed_paths.add(item.get("path"))
+            for path in write_files([item], project_root, summary=summary):
+                written.append(path)
+                clear_progress()
+                print(f"[{time.time() - start:6.1f}s] {path}", flush=True)
+        if parser.failed and not failed:
+            # 损坏的元素及之后的文件不在流中写入，接收完后由 parse_files 修复并补写
+            clear_progress()
+            print("输出中有无法解析的文件，其余文件将在接收完成后修复写入", file=sys.stderr)
+        now = time.time()
+        if now - last_progress > 0.5:
+            last_progress = now
+            print(f"\r已接收 {len(parser.text)} 字符...", end="", file=sys.stderr, flush=True)
+    clear_progress()
+
+    # 整体再解析一次：补写流中没能解析出的文件，输出损坏时只修复未完成的部分
+    files = parse_files(parser.text, router, session, keep_alive, repair_attempts)
+    remaining = [item for item in files if item.get("path") not in streamed_paths]
+    for path in write_files(remaining, project_root, summary=summary):
+        written.append(path)
+        print(path)
+    print_write_summary(summary)
+    print(f"共写入 {len(written)} 个文件，总耗时 {time.time() - start:.1f}s", file=sys.stderr)
+    return written, files
+
+
+def cache_key(model, prompt):
+    # 同时覆盖模型、提示词模板（含 system 消息）和用户指令；
+    # 多个后端使用不同模型时 model 为全部模型的列表，任一后端生成的结果都可能被命中
+    raw = json.dumps({"model": model, "messages": build_messages(prompt)}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def router_cache_model(router):
+    models = sorted({backend.model for backend in router.backends})
+    return models[0] if len(models) == 1 else models
+
+
+class ResponseCache:
+    """
+    磁盘缓存：每条记录一个 JSON 文件，超过容量上限时按最近使用时间淘汰
+
+    批量模式下多个线程同时读写缓存目录：统计和淘汰在同一把锁内进行，文件先写临时文件再替换
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats_path = os.path.join(cache_dir, "stats.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 更新访问时间，淘汰时按 mtime 近似 LRU；读取后可能已被其他线程淘汰
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            pass
+        return entry
+
+    @staticmethod
+    def _write_json(path, data):
+        # 临时文件名按线程区分，并发写同一个文件时不会互相覆盖临时文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def put(self, key, entry):
+        self._write_json(self._entry_path(key), entry)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json") or name == "stats.json":
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def load_stats(self):
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+    def record(self, hit, saved_seconds=0.0):
+        with self.lock:
+            stats = self.load_stats()
+            stats["hits" if hit else "misses"] += 1
+            stats["saved_seconds"] += saved_seconds
+            self._write_json(self.stats_path, stats)
+        return stats
+
+
+class JsonExtractError(ValueError):
+    """模型输出无法解析为 JSON，fragment 为损坏的片段"""
+
+    def __init__(self, message, fragment):
+        super().__init__(message)
+        self.fragment = fragment
+
+
+FENCE_RE = re.compile(r"```(?:json)?[ \t]*\n", re.IGNORECASE)
+
+
+def scan_json_object(text, start=0):
+    """从 start 开始查找第一个完整的顶层对象，返回 (起点, 终点)，对象未闭合时终点为 None"""
+    begin = text.find("{", start)
+    if begin < 0:
+        return None, None
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(begin, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return begin, i + 1
+    return begin, None
+
+
 def extract_json_block(text):
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if not match:
-        raise ValueError("模型输出中没有找到 JSON 对象")
-    return json.loads(match.group(0))
+    # 优先解析 ```json 代码块中的内容，其次整段输出
+    fence = FENCE_RE.search(text)
+    starts = [fence.end(), 0] if fence else [0]
+    error = None
+    fragment = None
+    for start in starts:
+        pos = start
+        while True:
+            begin, end = scan_json_object(text, pos)
+            if begin is None:
+                break
+            if end is None:
+                candidate = text[begin:]
+                if fragment is None or len(candidate) > len(fragment):
+                    fragment, error = candidate, "JSON 对象不完整，输出可能被截断"
+                break
+            candidate = text[begin:end]
+            try:
+                return json.loads(candidate)
+            except ValueError as e:
+                if fragment is None or len(candidate) > len(fragment):
+                    fragment, error = candidate, f"JSON 解析失败: {e}"
+            pos = end
+    if fragment is None:
+        raise JsonExtractError("模型输出中没有找到 JSON 对象", text)
+    raise JsonExtractError(error, fragment)
+
+
+def build_repair_prompt(fragment, error):
+    return (
+        "下面是从一个 {\"files\": [{\"path\": ..., \"content\": ...}]} 结构中截取的损坏片段。\n"
+        f"解析错误: {error}\n"
+        "请只修复这一段：补全被截断的文件内容，修正转义错误，"
+        "并按同样的结构返回一个 JSON 对象，只包含片段中涉及的文件，不要包含任何额外文字。\n"
+        "片段如下:\n"
+        f"{fragment}\n"
+    )
+
+
+def parse_files(text, router, session=None, keep_alive=None, repair_attempts=1):
+    try:
+        return extract_json_block(text).get("files", [])
+    except JsonExtractError as e:
+        error = e
+
+    # 已完整的文件直接保留，只把之后的部分交给模型修复
+    parser = FilesStreamParser()
+    salvaged = parser.feed(text)
+    fragment = text[parser.last_end:] if salvaged else error.fragment
+    if salvaged and "{" not in fragment:
+        return salvaged
+
+    for attempt in range(repair_attempts):
+        print(f"模型输出无法解析（{error}），请求修复损坏部分（第 {attempt + 1} 次，"
+              f"已保留 {len(salvaged)} 个完整文件）", file=sys.stderr)
+        repaired_text = router.call(build_repair_prompt(fragment, error), session, keep_alive)
+        try:
+            repaired = extract_json_block(repaired_text).get("files", [])
+        except JsonExtractError as e:
+            error = e
+            continue
+        merged = {item.get("path"): item for item in salvaged}
+        merged.update((item.get("path"), item) for item in repaired)
+        return list(merged.values())
+    raise error
 
 
-def safe_join_generated(base_dir, relative_path):
+def safe_join_generated(base_dir, relative_path, subdir=None):
     if os.path.isabs(relative_path):
         raise ValueError("不允许使用绝对路径")
     norm_path = os.path.normpath(relative_path)
     if norm_path.startswith(".."):
         raise ValueError("不允许访问项目根目录之外的路径")
-    full_path = os.path.join(base_dir, "ai_generated", "code", norm_path)
+    code_root = os.path.abspath(os.path.join(base_dir, "ai_generated", "code"))
+    if subdir:
+        # 子目录必须是 code 下的一级以下目录，不能是 code 本身或其上级
+        norm_subdir = os.path.normpath(subdir)
+        if os.path.isabs(norm_subdir) or norm_subdir == "." or norm_subdir.startswith(".."):
+            raise ValueError(f"输出子目录不合法: {subdir}")
+        subdir = norm_subdir
+    full_path = os.path.normpath(os.path.join(code_root, subdir or "", norm_path))
+    if full_path == code_root or os.path.commonpath([code_root, full_path]) != code_root:
+        raise ValueError("不允许写入 ai_generated/code 之外的路径")
     return full_path
 
 
-def write_files(files, base_dir):
+# 进程的 umask 只能通过设置来读取，在导入时（尚无其他线程）读取一次
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def file_status(full_path, data):
+    # 大小不同时无需读取旧文件，否则比较内容哈希
+    try:
+        if os.path.getsize(full_path) != len(data):
+            return "updated"
+        with open(full_path, "rb") as f:
+            old_digest = hashlib.sha256(f.read()).digest()
+    except FileNotFoundError:
+        return "created"
+    return "unchanged" if old_digest == hashlib.sha256(data).digest() else "updated"
+
+
+def new_write_summary():
+    return {"created": 0, "updated": 0, "unchanged": 0}
+
+
+def print_write_summary(summary):
+    print(f"新建 {summary['created']} 个，更新 {summary['updated']} 个，"
+          f"未变化 {summary['unchanged']} 个文件", file=sys.stderr)
+
+
+def write_files(files, base_dir, subdir=None, summary=None):
+    """只写入内容有变化的文件，返回实际写入的路径；summary 用于累计新建/更新/未变化的数量"""
     written_paths = []
     for item in files:
         rel_path = item.get("path")
         content = item.get("content", "")
         if not rel_path:
             continue
-        full_path = safe_join_generated(base_dir, rel_path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        full_path = safe_join_generated(base_dir, rel_path, subdir)
+        data = content.encode("utf-8")
+        status = file_status(full_path, data)
+        if summary is not None:
+            summary[status] += 1
+        if status == "unchanged":
+            continue
+        # 先写临时文件再替换，避免文件监听程序读到写了一半的内容
+        # 临时文件名唯一：不会与生成的 x.tmp 文件冲突，并发任务写入同一路径时也不会互相覆盖临时文件
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(full_path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # mkstemp 创建的文件权限为 0600，改为与直接新建文件相同的权限
+            os.chmod(tmp_path, 0o666 & ~UMASK)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
         written_paths.append(full_path)
     return written_paths
 
 
+def open_cache(args, project_root):
+    if args.no_cache:
+        return None
+    cache_dir = args.cache_dir or os.path.join(project_root, "ai_generated", ".cache")
+    return ResponseCache(cache_dir, int(args.cache_max_mb * 1024 * 1024))
+
+
+def run_instruction(args, instruction, project_root, router, session=None, subdir=None, index=None):
+    keep_alive = parse_keep_alive(args.keep_alive)
+    meta = {}
+    start = time.time()
+    context = None
+    if index is not None:
+        context, used = pack_context(index, instruction, args.context_tokens)
+        print(f"附加 {len(context)} 个相关文件作为上下文（约 {used} tokens）", file=sys.stderr)
+    prompt = build_prompt(instruction, context)
+
+    cache = open_cache(args, project_root)
+    key = cache_key(router_cache_model(router), prompt)
+    entry = cache.get(key) if cache else None
+    if entry is not None:
+        summary = new_write_summary()
+        written = write_files(entry["files"], project_root, subdir, summary)
+        for path in written:
+            print(path)
+        print_write_summary(summary)
+        stats = cache.record(True, entry.get("elapsed", 0.0))
+        hit_rate = stats["hits"] / (stats["hits"] + stats["misses"])
+        print(f"缓存命中，节省约 {entry.get('elapsed', 0.0):.1f}s"
+              f"（累计命中率 {hit_rate:.0%}，累计节省 {stats['saved_seconds']:.0f}s）", file=sys.stderr)
+        return written
+
+    if args.stream:
+        written, files = generate_streaming(router, prompt, project_root, session, keep_alive, meta, args.repair_attempts)
+    else:
+        response_text = router.call(prompt, session, keep_alive, meta)
+        files = parse_files(response_text, router, session, keep_alive, args.repair_attempts)
+        if not files:
+            print("模型没有返回 files 字段或为空")
+            return []
+
+        summary = new_write_summary()
+        written = write_files(files, project_root, subdir, summary)
+        for path in written:
+            print(path)
+        print_write_summary(summary)
+
+    if cache and files:
+        cache.put(key, {
+            "model": meta.get("model", args.model),
+            "backend": meta.get("backend"),
+            "instruction": instruction,
+            "created": time.time(),
+            "elapsed": time.time() - start,
+            "files": files,
+        })
+        cache.record(False)
+
+    if len(router.backends) > 1 and meta.get("backend"):
+        print(f"由后端 {meta['backend']} 生成", file=sys.stderr)
+    if meta.get("load_duration", 0) > 0.5:
+        print(f"本次耗时 {time.time() - start:.1f}s，其中模型加载 {meta['load_duration']:.1f}s", file=sys.stderr)
+    return written
+
+
+def load_batch(path):
+    # 每行一条指令；"名称 | 指令" 可指定输出子目录名，# 开头为注释
+    tasks = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            match = re.match(r"^([\w.-]+)\s*\|\s*(.+)$", line)
+            if match:
+                name, instruction = match.group(1), match.group(2)
+                # "." 和 ".." 会指向 code 目录本身或其上级，以 "." 开头的目录也不允许
+                if name.startswith("."):
+                    raise ValueError(f"批量文件第 {lineno} 行的输出子目录名称不合法: {name}")
+            else:
+                name, instruction = f"task-{len(tasks) + 1:03d}", line
+            tasks.append((name, instruction))
+    return tasks
+
+
+def run_batch(args, project_root, router, index=None):
+    tasks = load_batch(args.batch)
+    if not tasks:
+        print("批量文件中没有指令")
+        return
+
+    names = [name for name, _ in tasks]
+    if len(set(names)) != len(names):
+        raise ValueError("批量文件中的输出子目录名称重复")
+
+    parallel = max(1, args.parallel)
+    session = make_session(pool_size=parallel)
+    # 批量模式下逐条流式输出会交错，统一使用非流式请求
+    if args.stream:
+        print("批量模式不支持流式输出，已忽略 --stream", file=sys.stderr)
+        args.stream = False
+    print(f"批量生成 {len(tasks)} 条指令，并发 {parallel}")
+
+    def run_task(task):
+        name, instruction = task
+        start = time.time()
+        try:
+            written = run_instruction(args, instruction, project_root, router, session, subdir=name, index=index)
+            return name, True, time.time() - start, len(written), None
+        except (requests.RequestException, ValueError, RuntimeError) as e:
+            return name, False, time.time() - start, 0, str(e)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        results = list(pool.map(run_task, tasks))
+    wall_time = time.time() - start
+    session.close()
+
+    print(f"\n{'名称':<24}{'状态':<8}{'耗时':>10}{'文件数':>8}")
+    for name, ok, elapsed, count, error in results:
+        status = "成功" if ok else "失败"
+        print(f"{name:<24}{status:<8}{elapsed:>9.1f}s{count:>8}")
+        if error:
+            print(f"    {error}")
+
+    succeeded = sum(1 for r in results if r[1])
+    serial_time = sum(r[2] for r in results)
+    print(f"\n成功 {succeeded}/{len(results)}，共写入 {sum(r[3] for r in results)} 个文件")
+    print(f"总耗时 {wall_time:.1f}s，吞吐 {len(results) / wall_time * 60:.1f} 条/分钟，"
+          f"相对串行执行加速 {serial_time / wall_time:.1f}x")
+    if len(router.backends) > 1:
+        router.print_summary()
+
+
+def run_repl(args, project_root, router, index=None):
+    session = make_session()
+    keep_alive = parse_keep_alive(args.keep_alive)
+    # 预热和保活只对 Ollama 后端有意义，OpenAI 兼容服务的模型常驻显存
+    ollama_backends = [b for b in router.backends if b.kind == "ollama"]
+    for backend in ollama_backends:
+        try:
+            elapsed = warm_up(backend.model, backend.url, session, keep_alive)
+            print(f"模型 {backend.model} 已就绪（预热 {elapsed:.1f}s）")
+        except requests.RequestException as e:
+            print(f"预热失败: {e}")
+
+    stop_pingers = []
+    if args.ping_interval > 0:
+        for backend in ollama_backends:
+            stop_pingers.append(start_keepalive_pinger(backend.model, backend.url, keep_alive, args.ping_interval,
+                                                       session))
+
+    print("交互模式：输入需求后回车生成，输入 exit 或按 Ctrl-D 退出")
+    try:
+        while True:
+            try:
+                instruction = input("> ").strip()
+            except EOFError:
+                print()
+                break
+            if not instruction:
+                continue
+            if instruction in ("exit", "quit"):
+                break
+            start = time.time()
+            try:
+                run_instruction(args, instruction, project_root, router, session, index=index)
+            except (requests.RequestException, ValueError, RuntimeError) as e:
+                print(f"生成失败: {e}")
+                continue
+            print(f"完成，用时 {time.time() - start:.1f}s")
+    except KeyboardInterrupt:
+        print()
+    finally:
+        for stop_pinger in stop_pingers:
+            stop_pinger.set()
+        session.close()
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("instruction", help="自然语言的代码生成需求")
+    parser.add_argument("instruction", nargs="?", help="自然语言的代码生成需求，省略时进入交互模式")
     parser.add_argument(
         "--project-root",
         default=os.getcwd(),
@@ -100,24 +1047,113 @@ def main():
     parser.add_argument(
         "--ollama-url",
         default=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
-        help="Ollama 服务地址",
+        help="Ollama 服务地址，未指定 --backend 时使用",
+    )
+    parser.add_argument(
+        "--backend",
+        action="append",
+        default=[],
+        help="推理后端，格式为 类型,地址[,模型]，类型为 ollama 或 openai，可重复指定多个",
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=95,
+        help="请求耗时超过当前后端该分位延迟时，向下一个后端发送对冲请求，0 表示不对冲",
+    )
+    parser.add_argument(
+        "--health-interval",
+        type=float,
+        default=30,
+        help="后端健康检查间隔（秒）",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="流式生成，每个文件生成完毕后立即写入",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        default=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+        help="请求结束后模型在 Ollama 中保留的时长，例如 30m、3600、-1（常驻），为空时使用服务端默认值",
+    )
+    parser.add_argument(
+        "--ping-interval",
+        type=float,
+        default=0,
+        help="交互模式下空闲时预热模型的间隔秒数，0 表示不预热",
+    )
+    parser.add_argument(
+        "--context",
+        action="store_true",
+        help="从项目根目录检索相关的已有文件附加到提示词中，模型只返回有改动的文件",
+    )
+    parser.add_argument(
+        "--context-tokens",
+        type=int,
+        default=2000,
+        help="附加上下文的 token 预算",
+    )
+    parser.add_argument(
+        "--repair-attempts",
+        type=int,
+        default=1,
+        help="输出 JSON 损坏时请求模型修复损坏部分的次数，0 表示不修复",
+    )
+    parser.add_argument(
+        "--batch",
+        help="批量指令文件，每行一条指令（可写作 \"名称 | 指令\"），结果写入 ai_generated/code/<名称>/",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=int(os.getenv("OLLAMA_NUM_PARALLEL", "4")),
+        help="批量模式的并发请求数，应与服务端 OLLAMA_NUM_PARALLEL 一致",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="不读取也不写入响应缓存",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.getenv("CLIENT_CACHE_DIR"),
+        help="响应缓存目录，默认 <项目根目录>/ai_generated/.cache",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=100,
+        help="响应缓存容量上限（MB），超出后淘汰最久未使用的记录",
     )
     args = parser.parse_args()
 
     project_root = os.path.abspath(args.project_root)
     os.makedirs(os.path.join(project_root, "ai_generated", "code"), exist_ok=True)
 
-    prompt = build_prompt(args.instruction)
-    response_text = call_ollama(args.model, prompt, args.ollama_url)
-    data = extract_json_block(response_text)
-    files = data.get("files", [])
-    if not files:
-        print("模型没有返回 files 字段或为空")
+    try:
+        backends = [parse_backend(spec, args.model) for spec in args.backend]
+    except ValueError as e:
+        parser.error(str(e))
+    if not backends:
+        backends = [Backend("ollama", args.ollama_url, args.model)]
+    router = BackendRouter(backends, args.hedge_percentile, args.health_interval)
+
+    index = None
+    if args.context:
+        start = time.time()
+        index = ProjectIndex(project_root)
+        print(f"已索引 {len(index.docs)} 个项目文件（{time.time() - start:.2f}s）", file=sys.stderr)
+
+    if args.batch:
+        run_batch(args, project_root, router, index)
         return
 
-    written = write_files(files, project_root)
-    for path in written:
-        print(path)
+    if args.instruction is None:
+        run_repl(args, project_root, router, index)
+        return
+
+    run_instruction(args, args.instruction, project_root, router, index=index)
 
 
 if __name__ == "__main__":
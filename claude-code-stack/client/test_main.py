@@ -0,0 +1,571 @@
+"""
+客户端模型输出解析的离线测试
+
+运行测试: pytest test_main.py -v
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from main import (Backend, BackendRouter, FilesStreamParser, ProjectIndex, estimate_tokens, pack_context, ResponseCache, cache_key, generate_streaming, load_batch, parse_files,
+                  router_cache_model, run_batch, safe_join_generated, new_write_summary, start_keepalive_pinger, warm_up,
+                  write_files)
+
+GOOD = '{"path": "a.py", "content": "print(1)\\n"}'
+REPAIRED = '{"files": [{"path": "b.py", "content": "x\\\\q"}, {"path": "c.py", "content": "ok"}]}'
+
+
+class FakeRouter:
+    """按块返回流式输出，记录修复请求并返回固定的修复结果"""
+
+    def __init__(self, reply=REPAIRED, output=""):
+        self.reply = reply
+        self.output = output
+        self.prompts = []
+        self.backends = [Backend("ollama", "http://localhost:11434", "fake")]
+
+    def stream(self, prompt, session=None, keep_alive=None, meta=None):
+        for i in range(0, len(self.output), 5):
+            yield self.output[i:i + 5]
+
+    def call(self, prompt, session=None, keep_alive=None, meta=None):
+        self.prompts.append(prompt)
+        return self.reply
+
+
+def broken_output(bad_item):
+    return '{"files": [' + GOOD + ', ' + bad_item + ', {"path": "c.py", "content": "ok"}]}'
+
+
+def test_parser_stops_at_malformed_item():
+    """测试已闭合但无法解析的元素不抛出异常，之前的元素保留，之后不再返回"""
+    text = broken_output('{"path": "b.py", "content": "x\\q"}')
+    parser = FilesStreamParser()
+    items = []
+    for i in range(0, len(text), 7):
+        items.extend(parser.feed(text[i:i + 7]))
+
+    assert [item["path"] for item in items] == ["a.py"]
+    assert parser.failed
+    assert text[parser.last_end:].lstrip(", ").startswith('{"path": "b.py"')
+
+
+def test_parse_files_repairs_invalid_escape():
+    """测试非法转义：完整文件保留，损坏部分交给修复"""
+    router = FakeRouter()
+    files = parse_files(broken_output('{"path": "b.py", "content": "x\\q"}'), router)
+
+    assert {item["path"]: item["content"] for item in files} == {"a.py": "print(1)\n", "b.py": "x\\q", "c.py": "ok"}
+    assert len(router.prompts) == 1
+    assert '"path": "a.py"' not in router.prompts[0]
+    assert '"path": "b.py"' in router.prompts[0]
+
+
+def test_parse_files_repairs_raw_newline():
+    """测试字符串中的原始换行：同样走修复，而不是抛出 JSONDecodeError"""
+    router = FakeRouter()
+    files = parse_files(broken_output('{"path": "b.py", "content": "line1\nline2"}'), router)
+
+    assert [item["path"] for item in files] == ["a.py", "b.py", "c.py"]
+    assert len(router.prompts) == 1
+
+
+def test_parse_files_repairs_first_item():
+    """测试第一个元素就损坏时整段交给修复"""
+    router = FakeRouter(json.dumps({"files": [{"path": "b.py", "content": "fixed"}]}))
+    files = parse_files('{"files": [{"path": "b.py", "content": "x\\q"}]}', router)
+
+    assert files == [{"path": "b.py", "content": "fixed"}]
+    assert len(router.prompts) == 1
+
+
+def test_generate_streaming_defers_malformed_item(tmp_path):
+    """测试流式生成中遇到损坏的元素不中断，之前的文件在流中写入，其余修复后补写"""
+    router = FakeRouter(output=broken_output('{"path": "b.py", "content": "x\\q"}'))
+    written, files = generate_streaming(router, "prompt", str(tmp_path))
+
+    code_dir = tmp_path / "ai_generated" / "code"
+    assert [os.path.basename(path) for path in written] == ["a.py", "b.py", "c.py"]
+    assert (code_dir / "a.py").read_text(encoding="utf-8") == "print(1)\n"
+    assert (code_dir / "b.py").read_text(encoding="utf-8") == "x\\q"
+    assert (code_dir / "c.py").read_text(encoding="utf-8") == "ok"
+    assert len(router.prompts) == 1
+
+
+def test_cache_stats_concurrent_record(tmp_path):
+    """测试多线程同时记录命中统计时计数不丢失"""
+    cache = ResponseCache(str(tmp_path), 1 << 20)
+
+    def worker(i):
+        # 每个线程使用自己的实例，与批量模式中每条指令各自打开缓存一致
+        own = ResponseCache(str(tmp_path), 1 << 20)
+        for _ in range(50):
+            own.record(i % 2 == 0, 0.5)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(worker, range(8)))
+
+    stats = cache.load_stats()
+    assert stats["hits"] == 200 and stats["misses"] == 200
+    assert stats["saved_seconds"] == 200.0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_cache_concurrent_put_and_evict(tmp_path):
+    """测试并发写入并淘汰时不因文件已被其他线程删除而失败"""
+    entry = {"files": [{"path": "a.py", "content": "x" * 200}]}
+    errors = []
+
+    def worker(i):
+        cache = ResponseCache(str(tmp_path), 1000)
+        for j in range(30):
+            try:
+                cache.put(f"{i}-{j}", entry)
+                cache.get(f"{i}-{j // 2}")
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    total = sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path) if name.endswith(".json"))
+    assert total <= 1000
+
+
+class FakeBackends:
+    def __init__(self, *models):
+        self.backends = [Backend("openai", f"http://host{i}/v1", model) for i, model in enumerate(models)]
+
+
+def test_cache_key_covers_routed_models():
+    """测试缓存键包含路由中所有后端的模型，单一模型时与直接使用模型名一致"""
+    single = router_cache_model(FakeBackends("qwen", "qwen"))
+    assert single == "qwen"
+    assert cache_key(single, "p") == cache_key("qwen", "p")
+
+    mixed = router_cache_model(FakeBackends("qwen", "llama"))
+    assert mixed == ["llama", "qwen"]
+    assert cache_key(mixed, "p") != cache_key("qwen", "p")
+
+
+def batch_args(batch, **overrides):
+    args = argparse.Namespace(batch=str(batch), parallel=2, stream=False, no_cache=True, cache_dir=None,
+                              cache_max_mb=1, keep_alive=None, context_tokens=2000, repair_attempts=0, model="fake")
+    for key, value in overrides.items():
+        setattr(args, key, value)
+    return args
+
+
+class BatchRouter(FakeRouter):
+    """按指令返回不同的文件，指令中含 fail 时请求失败"""
+
+    def call(self, prompt, session=None, keep_alive=None, meta=None):
+        self.prompts.append(prompt)
+        instruction = prompt.rsplit("用户指令如下:\n", 1)[1].strip()
+        if "fail" in instruction:
+            raise RuntimeError("backend down")
+        return json.dumps({"files": [{"path": "main.py", "content": instruction}]})
+
+
+def test_load_batch(tmp_path):
+    """测试批量文件的注释、空行、指定名称和默认名称"""
+    batch = tmp_path / "batch.txt"
+    batch.write_text("# 注释\n\nweb-app | make a web app\nmake a cli\nv1.2_x|make lib\n", encoding="utf-8")
+
+    assert load_batch(str(batch)) == [("web-app", "make a web app"), ("task-002", "make a cli"),
+                                      ("v1.2_x", "make lib")]
+
+
+@pytest.mark.parametrize("name", ["..", ".", ".hidden"])
+def test_load_batch_rejects_dot_names(tmp_path, name):
+    """测试 "."、".." 和以 "." 开头的名称被拒绝，不会写到 code 目录本身或其上级"""
+    batch = tmp_path / "batch.txt"
+    batch.write_text(f"ok | make y\n{name} | make x\n", encoding="utf-8")
+
+    with pytest.raises(ValueError, match="第 2 行"):
+        load_batch(str(batch))
+
+
+def test_safe_join_generated_subdir(tmp_path):
+    """测试子目录归一化后必须位于 ai_generated/code 之下"""
+    code_root = os.path.join(str(tmp_path), "ai_generated", "code")
+    assert safe_join_generated(str(tmp_path), "a.py", "x/./y") == os.path.join(code_root, "x", "y", "a.py")
+    for subdir in ("..", ".", "x/../..", "/etc"):
+        with pytest.raises(ValueError):
+            safe_join_generated(str(tmp_path), "a.py", subdir)
+    with pytest.raises(ValueError):
+        safe_join_generated(str(tmp_path), "../a.py", "x")
+    with pytest.raises(ValueError):
+        safe_join_generated(str(tmp_path), "x/..", None)
+
+
+def test_run_batch_writes_each_task_to_its_subdir(tmp_path, capsys):
+    """测试批量任务写入各自的子目录，单条失败不影响其他任务，--stream 被忽略时给出提示"""
+    batch = tmp_path / "batch.txt"
+    batch.write_text("one | make one\ntwo | please fail\nmake three\n", encoding="utf-8")
+    router = BatchRouter()
+    args = batch_args(batch, stream=True)
+
+    run_batch(args, str(tmp_path), router)
+
+    code_dir = tmp_path / "ai_generated" / "code"
+    assert (code_dir / "one" / "main.py").read_text(encoding="utf-8") == "make one"
+    assert (code_dir / "task-003" / "main.py").read_text(encoding="utf-8") == "make three"
+    assert not (code_dir / "two").exists()
+    assert len(router.prompts) == 3
+    assert args.stream is False
+
+    out, err = capsys.readouterr()
+    assert "已忽略 --stream" in err
+    assert "成功 2/3" in out
+    assert "backend down" in out
+
+
+def test_run_batch_rejects_duplicate_names(tmp_path):
+    """测试输出子目录名称重复（包括与默认名称重复）时不发送任何请求"""
+    batch = tmp_path / "batch.txt"
+    batch.write_text("make one\ntask-001 | make two\n", encoding="utf-8")
+    router = BatchRouter()
+
+    with pytest.raises(ValueError, match="重复"):
+        run_batch(batch_args(batch), str(tmp_path), router)
+    assert router.prompts == []
+
+
+class FakeBackend(Backend):
+    """按设定的延迟返回或抛出异常的后端；chunks 中的异常在流式输出到该位置时抛出"""
+
+    def __init__(self, name, delay=0.0, error=None, chunks=("ok",)):
+        super().__init__("openai", f"http://{name}/v1", f"model-{name}")
+        self.label = name
+        self.delay = delay
+        self.error = error
+        self.chunks = chunks
+        self.calls = 0
+
+    def check_health(self, session=None):
+        return self.healthy
+
+    def chat(self, prompt, session=None, keep_alive=None, meta=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.label
+
+    def stream(self, prompt, session=None, keep_alive=None, meta=None):
+        self.calls += 1
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+def make_router(*backends):
+    return BackendRouter(list(backends), hedge_percentile=95, health_interval=0)
+
+
+def warm(backend, latency=0.05, samples=Backend.MIN_HEDGE_SAMPLES):
+    for _ in range(samples):
+        backend.record(latency)
+
+
+def test_no_hedge_before_min_samples():
+    """测试延迟样本不足 MIN_HEDGE_SAMPLES 时不发送对冲请求"""
+    slow, fast = FakeBackend("slow", delay=0.3), FakeBackend("fast")
+    warm(slow, samples=Backend.MIN_HEDGE_SAMPLES - 1)
+    fast.latency_ewma = 0.5     # 排在 slow 之后
+    router = make_router(slow, fast)
+    meta = {}
+
+    assert router.call("p", meta=meta) == "slow"
+    assert fast.calls == 0
+    assert meta["backend"] == slow.name
+
+
+def test_faster_hedge_wins():
+    """测试超过 p95 延迟后向下一个后端发送对冲请求，先返回的结果胜出并记入 meta"""
+    slow, fast = FakeBackend("slow", delay=1.0), FakeBackend("fast")
+    warm(slow)
+    fast.latency_ewma = 0.5     # 排在 slow 之后
+    router = make_router(slow, fast)
+    meta = {}
+
+    start = time.time()
+    assert router.call("p", meta=meta) == "fast"
+    assert time.time() - start < 0.8
+    assert meta == {"backend": fast.name, "model": fast.model}
+    assert fast.requests == 1
+
+
+def test_single_hedge():
+    """测试每个请求最多发送一个对冲请求"""
+    first, second, third = FakeBackend("a", delay=0.3), FakeBackend("b", delay=0.3), FakeBackend("c")
+    warm(first)
+    second.latency_ewma, third.latency_ewma = 0.5, 0.6
+    router = make_router(first, second, third)
+
+    assert router.call("p") in ("a", "b")
+    assert third.calls == 0
+
+
+def test_failover_on_error():
+    """测试首选后端出错时切换到下一个后端，出错的后端被标记为异常"""
+    broken, backup = FakeBackend("broken", error=requests.ConnectionError("refused")), FakeBackend("backup")
+    backup.latency_ewma = 1.0
+    router = make_router(broken, backup)
+    meta = {}
+
+    assert router.call("p", meta=meta) == "backup"
+    assert meta["backend"] == backup.name
+    assert not broken.healthy and broken.failures == 1
+    assert router.ranked() == [backup, broken]
+
+
+def test_failover_waits_for_pending_hedge():
+    """测试对冲请求先失败时仍等待原请求；两者都失败后才切换到第三个后端"""
+    first = FakeBackend("a", delay=0.3, error=RuntimeError("a failed"))
+    second = FakeBackend("b", error=RuntimeError("b failed"))
+    third = FakeBackend("c")
+    warm(first)
+    second.latency_ewma, third.latency_ewma = 0.5, 0.6
+    router = make_router(first, second, third)
+
+    start = time.time()
+    assert router.call("p") == "c"
+    # 第三个后端在原请求失败（约0.3s）之后才启动
+    assert time.time() - start >= 0.25
+    assert (first.calls, second.calls, third.calls) == (1, 1, 1)
+
+
+def test_all_backends_fail():
+    """测试所有后端都失败时抛出最后一个错误"""
+    first = FakeBackend("a", error=requests.ConnectionError("a down"))
+    second = FakeBackend("b", error=ValueError("b bad json"))
+    second.latency_ewma = 1.0
+    router = make_router(first, second)
+
+    with pytest.raises(ValueError, match="b bad json"):
+        router.call("p")
+
+
+def test_ranked_by_health_and_latency():
+    """测试健康的后端按延迟滑动平均排序，尚无数据的优先，不健康的排在最后"""
+    fast, slow, new, down = FakeBackend("fast"), FakeBackend("slow"), FakeBackend("new"), FakeBackend("down")
+    fast.record(1.0)
+    slow.record(3.0)
+    down.record(0.1)
+    down.mark_failed()
+    router = make_router(slow, down, fast, new)
+
+    assert router.ranked() == [new, fast, slow, down]
+    # 滑动平均随新样本变化后排序跟着变化
+    for _ in range(10):
+        fast.record(5.0)
+    assert router.ranked() == [new, slow, fast, down]
+
+
+def test_stream_failover_before_first_chunk():
+    """测试流式请求在收到第一个片段之前出错时切换后端"""
+    broken = FakeBackend("broken", chunks=(requests.ConnectionError("refused"),))
+    backup = FakeBackend("backup", chunks=("a", "b"))
+    backup.latency_ewma = 1.0
+    router = make_router(broken, backup)
+    meta = {}
+
+    assert list(router.stream("p", meta=meta)) == ["a", "b"]
+    assert meta["backend"] == backup.name
+    assert broken.failures == 1
+
+
+def test_stream_error_after_first_chunk_is_raised():
+    """测试已经输出片段后出错时直接抛出，不切换后端（否则输出会重复）"""
+    flaky = FakeBackend("flaky", chunks=("a", RuntimeError("lost")))
+    backup = FakeBackend("backup")
+    backup.latency_ewma = 1.0
+    router = make_router(flaky, backup)
+    received = []
+
+    with pytest.raises(RuntimeError, match="lost"):
+        for chunk in router.stream("p"):
+            received.append(chunk)
+    assert received == ["a"]
+    assert backup.calls == 0
+
+
+def test_write_files_summary_and_unchanged(tmp_path):
+    """测试新建/更新/未变化的计数，未变化的文件不重写（修改时间不变）"""
+    code_dir = tmp_path / "ai_generated" / "code"
+    summary = new_write_summary()
+    written = write_files([{"path": "a.py", "content": "a"}, {"path": "pkg/b.py", "content": "b"}],
+                          str(tmp_path), summary=summary)
+    assert len(written) == 2
+    assert summary == {"created": 2, "updated": 0, "unchanged": 0}
+
+    old = time.time() - 100
+    os.utime(code_dir / "a.py", (old, old))
+    os.utime(code_dir / "pkg" / "b.py", (old, old))
+    summary = new_write_summary()
+    written = write_files([{"path": "a.py", "content": "a"}, {"path": "pkg/b.py", "content": "bb"},
+                           {"path": "c.py", "content": ""}], str(tmp_path), summary=summary)
+
+    assert [os.path.basename(path) for path in written] == ["b.py", "c.py"]
+    assert summary == {"created": 1, "updated": 1, "unchanged": 1}
+    assert os.path.getmtime(code_dir / "a.py") == pytest.approx(old)
+    assert (code_dir / "pkg" / "b.py").read_text(encoding="utf-8") == "bb"
+
+
+def test_write_files_tmp_suffix_and_concurrency(tmp_path):
+    """测试 x 和 x.tmp 同时生成时互不影响，并发写入同一路径不出错，不留下临时文件"""
+    code_dir = tmp_path / "ai_generated" / "code"
+    write_files([{"path": "x.tmp", "content": "tmp"}, {"path": "x", "content": "x"}], str(tmp_path))
+    assert (code_dir / "x").read_text(encoding="utf-8") == "x"
+    assert (code_dir / "x.tmp").read_text(encoding="utf-8") == "tmp"
+
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(code_dir / "x").st_mode & 0o777 == 0o666 & ~umask
+
+    contents = [str(i) * 1000 for i in range(8)]
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda c: write_files([{"path": "shared/y.py", "content": c}], str(tmp_path)), contents))
+    assert (code_dir / "shared" / "y.py").read_text(encoding="utf-8") in contents
+    assert sorted(os.listdir(code_dir / "shared")) == ["y.py"]
+    assert sorted(os.listdir(code_dir)) == ["shared", "x", "x.tmp"]
+
+
+def make_project(root, files):
+    for rel_path, content in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content, encoding="utf-8")
+
+
+def test_index_ranks_by_query_terms(tmp_path):
+    """测试按查询词的 BM25 得分排序，不含查询词的文件不返回"""
+    make_project(tmp_path, {
+        "src/db.py": "def connect_database():\n    database = open_database()\n    return database\n",
+        "src/util.py": "def format_name(name):\n    return name.strip()  # database\n",
+        "README.md": "hello world\n",
+    })
+    index = ProjectIndex(str(tmp_path))
+
+    results = index.search("database connection")
+    assert [path for _, path, _ in results] == [os.path.join("src", "db.py"), os.path.join("src", "util.py")]
+    assert results[0][0] > results[1][0] > 0
+    # 驼峰和下划线拆分后匹配
+    assert [path for _, path, _ in index.search("openDatabase")][0] == os.path.join("src", "db.py")
+
+
+def test_index_path_boost(tmp_path):
+    """测试文件路径中的词按更高权重计入：同样出现一次，路径中出现的文件排在前面"""
+    make_project(tmp_path, {
+        "auth/views.py": "def handle(request):\n    return render(request)\n",
+        "core/views.py": "def handle(request):\n    return auth(request)\n",
+    })
+    results = ProjectIndex(str(tmp_path)).search("auth")
+    assert [path for _, path, _ in results] == [os.path.join("auth", "views.py"), os.path.join("core", "views.py")]
+
+
+def test_index_skips_ignored_dirs_and_binary_files(tmp_path):
+    """测试跳过忽略的目录、隐藏目录、二进制文件和超过大小上限的文件"""
+    make_project(tmp_path, {
+        "app.py": "token = 1\n",
+        "node_modules/lib/index.js": "token\n",
+        "ai_generated/code/x.py": "token\n",
+        ".hidden/secret.py": "token\n",
+        "image.png": b"\x89PNG\r\n\x1a\n\0\0token",
+        "big.py": "token " * 100,
+    })
+    index = ProjectIndex(str(tmp_path), max_file_bytes=300)
+    assert [path for path, _, _, _ in index.docs] == ["app.py"]
+
+
+def test_pack_context_truncates_at_budget(tmp_path):
+    """测试按相关度放入文件，超出预算的文件截断后结束，使用量不超过预算"""
+    make_project(tmp_path, {
+        "small.py": "cache = {}\n" * 10,
+        "large.py": "cache_value = compute()\n" * 400,
+        "other.py": "cache\n" * 100,
+    })
+    index = ProjectIndex(str(tmp_path))
+    ranked = [path for _, path, _ in index.search("cache")]
+
+    context, used = pack_context(index, "cache", 1000)
+    assert used <= 1000
+    assert [path for path, _ in context] == ranked[:len(context)]
+    assert context[-1][1].endswith("...（已截断）")
+    assert sum(estimate_tokens(path) + estimate_tokens(text) for path, text in context[:-1]) < 1000
+
+    # 预算充足时完整放入，不截断
+    context, used = pack_context(index, "cache", 100000)
+    assert sorted(path for path, _ in context) == ["large.py", "other.py", "small.py"]
+    assert not any(text.endswith("（已截断）") for _, text in context)
+    assert used == sum(estimate_tokens(path) + estimate_tokens(text) for path, text in context)
+
+
+def test_pack_context_empty(tmp_path):
+    """测试空项目或没有可检索的查询词时上下文为空"""
+    assert pack_context(ProjectIndex(str(tmp_path)), "cache", 1000) == ([], 0)
+
+    make_project(tmp_path, {"a.py": "cache = 1\n"})
+    index = ProjectIndex(str(tmp_path))
+    assert pack_context(index, "", 1000) == ([], 0)
+    assert pack_context(index, "!!! ???", 1000) == ([], 0)
+
+
+class RecordingSession:
+    """记录 POST 请求的会话，代替 requests.Session"""
+
+    def __init__(self):
+        self.posts = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None, **kwargs):
+        with self.lock:
+            self.posts.append((url, json))
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+
+def test_warm_up_payload():
+    """测试预热请求只包含模型和 keep_alive，不带 prompt，不会触发生成"""
+    session = RecordingSession()
+    warm_up("qwen", "http://ollama:11434", session, "30m")
+    warm_up("qwen", "http://ollama:11434", session)
+
+    assert session.posts == [("http://ollama:11434/api/generate", {"model": "qwen", "keep_alive": "30m"}),
+                             ("http://ollama:11434/api/generate", {"model": "qwen"})]
+
+
+def test_keepalive_pinger_uses_session_and_stops():
+    """测试保活线程复用传入的会话定期预热，设置停止事件后不再发送请求"""
+    session = RecordingSession()
+    stop = start_keepalive_pinger("qwen", "http://ollama:11434", -1, 0.02, session)
+    deadline = time.time() + 2
+    while len(session.posts) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    time.sleep(0.05)
+    count = len(session.posts)
+    time.sleep(0.1)
+
+    assert count >= 3
+    assert len(session.posts) == count
+    assert all(post == ("http://ollama:11434/api/generate", {"model": "qwen", "keep_alive": -1})
+               for post in session.posts)
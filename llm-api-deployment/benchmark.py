@@ -3,19 +3,45 @@
 """
 大模型 API 性能测试脚本
 测试并发性能、延迟和吞吐量
+
+支持多进程压测：协调进程生成统一的请求到达时间表，
+N 个 worker 进程各自运行独立的事件循环和 aiohttp.ClientSession，
+结束后合并各进程的延迟直方图，并报告客户端 CPU 饱和度。
+
+连接池大小、keep-alive 和 DNS 缓存均显式配置，并通过 aiohttp 的
+trace 钩子把每个请求的耗时拆分为 排队/建连/发送/等待/接收 五段，
+用于区分服务端耗时和客户端开销。
+
+--duration 启用持续压测（soak）模式：按固定速率长时间发送请求，
+每秒输出吞吐量、错误率和延迟百分位的时间序列，预热阶段不计入统计。
+
+--search 启用 SLO 搜索模式：逐步提高并发数或请求速率，直到延迟 SLO
+（如 p95 TTFT、p95 TPOT）被打破，报告满足 SLO 的最大 goodput 及对应配置，
+用于确定 OLLAMA_NUM_PARALLEL 或 vLLM --max-num-seqs。
 """
 
+import argparse
 import asyncio
 import aiohttp
-import time
-import statistics
-from typing import List, Dict
 import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import List, Dict, Optional, Tuple
 
 
 API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_NAME = "qwen2.5-coder-32b-instruct"
 
+# 单个 worker 进程的 CPU 占用超过该比例时，认为客户端已成为瓶颈
+CPU_SATURATION_THRESHOLD = 0.85
+
+# 按速率搜索时客户端允许的最大在途请求数
+RATE_MODE_MAX_IN_FLIGHT = 1024
+
 
 test_prompts = [
     "解释一下Python的装饰器是什么",
@@ -31,32 +57,310 @@ test_prompts = [
 ]
 
 
-async def send_request(session: aiohttp.ClientSession, prompt: str) -> Dict:
+@dataclass(frozen=True)
+class BenchConfig:
+    """请求配置（需要可 pickle，以便传给 worker 进程）"""
+    api_url: str = API_URL
+    model: str = MODEL_NAME
+    max_tokens: int = 500
+    temperature: float = 0.7
+    # 连接池上限，0 表示与并发数相同（aiohttp 默认只有 100）
+    pool_size: int = 0
+    # 空闲连接保持时间（秒），0 表示每个请求后关闭连接
+    keepalive_timeout: float = 30.0
+    dns_cache_ttl: int = 300
+    # 流式请求，可测量首 token 延迟（TTFT）和每 token 耗时（TPOT）
+    stream: bool = False
+
+
+@dataclass(frozen=True)
+class Slo:
+    """延迟 SLO，阈值为 None 的指标不做要求（单位：秒）"""
+    ttft: Optional[float] = None
+    tpot: Optional[float] = None
+    latency: Optional[float] = None
+    percentile: float = 95.0
+    max_error_rate: float = 0.01
+
+    def request_ok(self, result: Dict) -> bool:
+        """单个请求是否满足 SLO（用于计算 goodput）"""
+        if not result["success"]:
+            return False
+        checks = ((self.ttft, result.get("ttft")),
+                  (self.tpot, result.get("tpot")),
+                  (self.latency, result["latency"]))
+        return all(limit is None or value is None or value <= limit for limit, value in checks)
+
+    def violations(self, stats: "RunStats") -> List[str]:
+        """整体统计不满足 SLO 的项，空列表表示满足"""
+        p = self.percentile
+        problems = []
+        total = stats.success + stats.failed
+        if not stats.success:
+            return ["没有成功的请求"]
+        if total and stats.failed / total > self.max_error_rate:
+            problems.append(f"错误率 {stats.failed / total:.1%} > {self.max_error_rate:.1%}")
+        for name, limit, histogram in (("TTFT", self.ttft, stats.ttft),
+                                       ("TPOT", self.tpot, stats.tpot),
+                                       ("延迟", self.latency, stats.latency)):
+            if limit is not None and histogram.count and histogram.percentile(p) > limit:
+                problems.append(f"P{p:g} {name} {histogram.percentile(p) * 1000:.0f}ms > {limit * 1000:.0f}ms")
+        return problems
+
+
+# 请求耗时分段（按发生顺序）
+TIMING_PHASES = ("queue", "connect", "send", "wait", "receive")
+TIMING_PHASE_NAMES = {
+    "queue": "连接池排队",
+    "connect": "建立连接",
+    "send": "发送请求",
+    "wait": "等待响应",
+    "receive": "接收响应",
+}
+
+
+class LatencyHistogram:
+    """
+    对数分桶的延迟直方图
+
+    桶边界按 growth 等比增长，百分位的相对误差不超过 growth - 1。
+    只保存非空桶，可以 pickle 后在进程间传递并合并。
+    """
+
+    def __init__(self, min_value: float = 0.001, growth: float = 1.02):
+        self.min_value = min_value
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return int(math.log(value / self.min_value) / self._log_growth) + 1
+
+    def _upper_bound(self, bucket: int) -> float:
+        return self.min_value * self.growth ** bucket
+
+    def record(self, value: float):
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        if (other.min_value, other.growth) != (self.min_value, self.growth):
+            raise ValueError("直方图分桶参数不一致，无法合并")
+        for bucket, n in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def stdev(self) -> float:
+        """样本标准差（与 statistics.stdev 一致）"""
+        if self.count < 2:
+            return 0.0
+        variance = (self.total_sq - self.total * self.total / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def percentile(self, p: float) -> float:
+        """返回第 p 百分位（0-100）所在桶的上界，并限制在 [min, max] 内"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(max(self._upper_bound(bucket), self.min), self.max)
+        return self.max
+
+
+class RunStats:
+    """一次压测（或一个 worker 进程）的汇总结果，可合并"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        # 仅流式请求有 TTFT / TPOT
+        self.ttft = LatencyHistogram()
+        self.tpot = LatencyHistogram()
+        self.success = 0
+        self.failed = 0
+        self.tokens = 0
+        self.errors: List[str] = []
+        # 每个 worker 的 (CPU 时间, 墙钟时间)
+        self.cpu_samples: List[Tuple[float, float]] = []
+        # 成功请求各耗时分段的累计值
+        self.phase_totals: Dict[str, float] = {phase: 0.0 for phase in TIMING_PHASES}
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def add(self, result: Dict):
+        if result["success"]:
+            self.success += 1
+            self.tokens += result["tokens"]
+            self.latency.record(result["latency"])
+            if result.get("ttft") is not None:
+                self.ttft.record(result["ttft"])
+            if result.get("tpot") is not None:
+                self.tpot.record(result["tpot"])
+            timing = result.get("timing")
+            if timing:
+                for phase in TIMING_PHASES:
+                    self.phase_totals[phase] += timing[phase]
+                if timing["reused"]:
+                    self.reused_connections += 1
+                else:
+                    self.new_connections += 1
+        else:
+            self.failed += 1
+            if len(self.errors) < 3:
+                self.errors.append(result["error"])
+
+    def merge(self, other: "RunStats"):
+        self.latency.merge(other.latency)
+        self.ttft.merge(other.ttft)
+        self.tpot.merge(other.tpot)
+        self.success += other.success
+        self.failed += other.failed
+        self.tokens += other.tokens
+        self.errors.extend(other.errors[:max(0, 3 - len(self.errors))])
+        self.cpu_samples.extend(other.cpu_samples)
+        for phase in TIMING_PHASES:
+            self.phase_totals[phase] += other.phase_totals[phase]
+        self.new_connections += other.new_connections
+        self.reused_connections += other.reused_connections
+
+
+def make_trace_config() -> aiohttp.TraceConfig:
+    """
+    创建 trace 钩子，把关键时间点写入每个请求的 trace_request_ctx 字典
+
+    on_request_end 在收到响应头时触发，此时响应体还未读取。
+    """
+    trace_config = aiohttp.TraceConfig()
+
+    def mark(name):
+        async def handler(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                ctx.trace_request_ctx[name] = time.perf_counter()
+        return handler
+
+    async def on_reuse(session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx["reused"] = True
+
+    trace_config.on_request_start.append(mark("request_start"))
+    trace_config.on_connection_queued_start.append(mark("queued_start"))
+    trace_config.on_connection_queued_end.append(mark("queued_end"))
+    trace_config.on_connection_create_start.append(mark("connect_start"))
+    trace_config.on_connection_create_end.append(mark("connect_end"))
+    trace_config.on_connection_reuseconn.append(on_reuse)
+    trace_config.on_request_headers_sent.append(mark("headers_sent"))
+    trace_config.on_request_chunk_sent.append(mark("body_sent"))
+    trace_config.on_request_end.append(mark("response_start"))
+    return trace_config
+
+
+def make_session(config: BenchConfig, concurrency: int) -> aiohttp.ClientSession:
+    """创建显式配置连接池的 ClientSession"""
+    connector = aiohttp.TCPConnector(
+        limit=config.pool_size or concurrency,
+        limit_per_host=config.pool_size or concurrency,
+        ttl_dns_cache=config.dns_cache_ttl,
+        use_dns_cache=config.dns_cache_ttl > 0,
+        force_close=config.keepalive_timeout <= 0,
+        keepalive_timeout=config.keepalive_timeout if config.keepalive_timeout > 0 else None,
+    )
+    return aiohttp.ClientSession(connector=connector, trace_configs=[make_trace_config()])
+
+
+def split_timing(marks: Dict[str, float], start: float, end: float) -> Dict:
+    """把 trace 时间点换算为各阶段耗时（秒）"""
+    request_start = marks.get("request_start", start)
+    queued = marks.get("queued_end", request_start) - marks.get("queued_start", request_start)
+    connect = marks.get("connect_end", request_start) - marks.get("connect_start", request_start)
+    # 连接就绪（排队和建连都结束）之后开始发送
+    ready = max(request_start, marks.get("queued_end", 0.0), marks.get("connect_end", 0.0))
+    sent = max(marks.get("headers_sent", ready), marks.get("body_sent", ready))
+    response_start = marks.get("response_start", end)
+
+    return {
+        # 请求开始前的开销（构造 payload 等）计入发送阶段
+        "queue": queued,
+        "connect": connect,
+        "send": (ready - start - queued - connect) + (sent - ready),
+        "wait": response_start - sent,
+        "receive": end - response_start,
+        "reused": marks.get("reused", False),
+    }
+
+
+async def send_request(session: aiohttp.ClientSession, prompt: str,
+                       config: BenchConfig = BenchConfig()) -> Dict:
     """发送单个请求"""
-    start_time = time.time()
+    start_time = time.perf_counter()
+    marks: Dict[str, float] = {}
 
     payload = {
-        "model": MODEL_NAME,
+        "model": config.model,
         "messages": [
             {"role": "user", "content": prompt}
         ],
-        "temperature": 0.7,
-        "max_tokens": 500
+        "temperature": config.temperature,
+        "max_tokens": config.max_tokens
     }
+    if config.stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
 
     try:
-        async with session.post(API_URL, json=payload) as response:
+        async with session.post(config.api_url, json=payload,
+                                trace_request_ctx=marks) as response:
+            if config.stream and response.status == 200:
+                chunks, first_token_time, usage_tokens = await read_stream(response)
+                end_time = time.perf_counter()
+                tokens = usage_tokens or chunks
+                ttft = first_token_time - start_time if first_token_time else None
+                tpot = None
+                if first_token_time and tokens > 1:
+                    tpot = (end_time - first_token_time) / (tokens - 1)
+
+                return {
+                    "success": True,
+                    "latency": end_time - start_time,
+                    "tokens": tokens,
+                    "error": None,
+                    "timing": split_timing(marks, start_time, end_time),
+                    "ttft": ttft,
+                    "tpot": tpot
+                }
+
             result = await response.json()
-            end_time = time.time()
+            end_time = time.perf_counter()
 
             return {
                 "success": response.status == 200,
                 "latency": end_time - start_time,
                 "tokens": result.get("usage", {}).get("completion_tokens", 0),
-                "error": None if response.status == 200 else str(result)
+                "error": None if response.status == 200 else str(result),
+                "timing": split_timing(marks, start_time, end_time)
             }
     except Exception as e:
-        end_time = time.time()
+        end_time = time.perf_counter()
         return {
             "success": False,
             "latency": end_time - start_time,
@@ -65,81 +369,601 @@ async def send_request(session: aiohttp.ClientSession, prompt: str) -> Dict:
         }
 
 
-async def run_concurrent_test(num_requests: int, concurrency: int):
-    """运行并发测试"""
-    print(f"\n{'='*60}")
-    print(f"并发测试: {num_requests} 个请求, 并发数: {concurrency}")
-    print(f"{'='*60}\n")
+async def read_stream(response: aiohttp.ClientResponse) -> Tuple[int, Optional[float], Optional[int]]:
+    """
+    读取 SSE 流式响应
 
-    async with aiohttp.ClientSession() as session:
-        semaphore = asyncio.Semaphore(concurrency)
+    Returns:
+        (包含内容的 chunk 数, 首个内容 chunk 到达时刻, usage 中的 completion_tokens)
+    """
+    chunks = 0
+    first_token_time = None
+    usage_tokens = None
 
-        async def bounded_request(prompt):
-            async with semaphore:
-                return await send_request(session, prompt)
+    async for raw_line in response.content:
+        line = raw_line.strip()
+        if not line.startswith(b"data:"):
+            continue
+        data = line[len(b"data:"):].strip()
+        if data == b"[DONE]":
+            break
+        event = json.loads(data)
+        if event.get("usage"):
+            usage_tokens = event["usage"].get("completion_tokens")
+        for choice in event.get("choices") or []:
+            if (choice.get("delta") or {}).get("content"):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                chunks += 1
+
+    return chunks, first_token_time, usage_tokens
+
+
+def build_schedule(num_requests: int, rate: Optional[float] = None,
+                   seed: int = 0) -> List[Tuple[float, str]]:
+    """
+    生成请求到达时间表
+
+    Args:
+        num_requests: 请求总数
+        rate: 平均到达速率（请求/秒），按泊松过程生成；为 None 时全部在 0 时刻到达
+        seed: 随机种子，保证多次运行的时间表一致
 
+    Returns:
+        [(相对开始时间的偏移秒数, 提示词), ...]
+    """
+    rng = random.Random(seed)
+    schedule = []
+    offset = 0.0
+    for i in range(num_requests):
+        if rate:
+            offset += rng.expovariate(rate)
         # 循环使用测试提示词
-        prompts = [test_prompts[i % len(test_prompts)] for i in range(num_requests)]
+        schedule.append((offset, test_prompts[i % len(test_prompts)]))
+    return schedule
 
-        start_time = time.time()
-        results = await asyncio.gather(*[bounded_request(p) for p in prompts])
-        total_time = time.time() - start_time
 
-    # 统计结果
-    successful = [r for r in results if r["success"]]
-    failed = [r for r in results if not r["success"]]
+async def execute_schedule(session: aiohttp.ClientSession,
+                           schedule: List[Tuple[float, str]],
+                           concurrency: int, start_at: float,
+                           config: BenchConfig) -> List[Dict]:
+    """按时间表发送请求，start_at 为所有进程共享的墙钟起点"""
+    semaphore = asyncio.Semaphore(concurrency)
 
-    if successful:
-        latencies = [r["latency"] for r in successful]
-        tokens = [r["tokens"] for r in successful]
+    async def scheduled_request(offset, prompt):
+        delay = start_at + offset - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            return await send_request(session, prompt, config)
+
+    return await asyncio.gather(*[scheduled_request(o, p) for o, p in schedule])
+
+
+async def _worker_async(schedule, concurrency, start_at, config) -> RunStats:
+    stats = RunStats()
+    cpu_start = time.process_time()
+    wall_start = time.time()
+
+    async with make_session(config, concurrency) as session:
+        results = await execute_schedule(session, schedule, concurrency, start_at, config)
+
+    for result in results:
+        stats.add(result)
+    # 等待起点的时间不计入墙钟，否则 CPU 占用会被低估
+    wall_time = time.time() - max(wall_start, start_at)
+    stats.cpu_samples.append((time.process_time() - cpu_start, wall_time))
+    return stats
+
+
+def _worker_main(schedule, concurrency, start_at, config) -> RunStats:
+    """worker 进程入口：独立的事件循环和 ClientSession"""
+    return asyncio.run(_worker_async(schedule, concurrency, start_at, config))
+
+
+async def run_concurrent_test(num_requests: int, concurrency: int,
+                              workers: int = 1, rate: Optional[float] = None,
+                              config: BenchConfig = BenchConfig()) -> RunStats:
+    """运行并发测试，返回所有 worker 合并后的统计"""
+    print(f"\n{'='*60}")
+    print(f"并发测试: {num_requests} 个请求, 并发数: {concurrency}"
+          + (f", 进程数: {workers}" if workers > 1 else "")
+          + (f", 到达速率: {rate} 请求/秒" if rate else ""))
+    print(f"{'='*60}\n")
+
+    schedule = build_schedule(num_requests, rate)
+
+    if workers <= 1:
+        start_at = time.time()
+        stats = await _worker_async(schedule, concurrency, start_at, config)
+    else:
+        # 按轮询把时间表分给各进程，并发额度均分
+        slices = [schedule[i::workers] for i in range(workers)]
+        per_worker = max(1, math.ceil(concurrency / workers))
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # 留出进程启动时间，保证所有 worker 从同一时刻开始
+            start_at = time.time() + 1.0 + 0.1 * workers
+            futures = [
+                loop.run_in_executor(pool, _worker_main, s, per_worker, start_at, config)
+                for s in slices if s
+            ]
+            stats = RunStats()
+            for worker_stats in await asyncio.gather(*futures):
+                stats.merge(worker_stats)
+
+    total_time = time.time() - start_at
+    print_report(stats, num_requests, total_time)
+    return stats
+
+
+def print_report(stats: RunStats, num_requests: int, total_time: float):
+    """打印统计结果"""
+    if stats.success:
+        latency = stats.latency
 
         print(f"总请求数: {num_requests}")
-        print(f"成功: {len(successful)}, 失败: {len(failed)}")
+        print(f"成功: {stats.success}, 失败: {stats.failed}")
         print(f"总耗时: {total_time:.2f}秒")
-        print(f"吞吐量: {len(successful) / total_time:.2f} 请求/秒")
+        print(f"吞吐量: {stats.success / total_time:.2f} 请求/秒")
         print(f"\n延迟统计:")
-        print(f"  平均: {statistics.mean(latencies):.2f}秒")
-        print(f"  中位数: {statistics.median(latencies):.2f}秒")
-        print(f"  最小: {min(latencies):.2f}秒")
-        print(f"  最大: {max(latencies):.2f}秒")
-        if len(latencies) > 1:
-            print(f"  标准差: {statistics.stdev(latencies):.2f}秒")
+        print(f"  平均: {latency.mean():.2f}秒")
+        print(f"  中位数: {latency.percentile(50):.2f}秒")
+        print(f"  P90: {latency.percentile(90):.2f}秒")
+        print(f"  P99: {latency.percentile(99):.2f}秒")
+        print(f"  最小: {latency.min:.2f}秒")
+        print(f"  最大: {latency.max:.2f}秒")
+        if latency.count > 1:
+            print(f"  标准差: {latency.stdev():.2f}秒")
+
+        for name, histogram in (("首token延迟(TTFT)", stats.ttft), ("每token耗时(TPOT)", stats.tpot)):
+            if histogram.count:
+                print(f"\n{name}:")
+                print(f"  平均: {histogram.mean() * 1000:.0f}ms, "
+                      f"P50: {histogram.percentile(50) * 1000:.0f}ms, "
+                      f"P95: {histogram.percentile(95) * 1000:.0f}ms, "
+                      f"P99: {histogram.percentile(99) * 1000:.0f}ms")
 
         print(f"\nToken统计:")
-        print(f"  平均token数: {statistics.mean(tokens):.0f}")
-        print(f"  总token数: {sum(tokens)}")
-        print(f"  Token/秒: {sum(tokens) / total_time:.2f}")
+        print(f"  平均token数: {stats.tokens / stats.success:.0f}")
+        print(f"  总token数: {stats.tokens}")
+        print(f"  Token/秒: {stats.tokens / total_time:.2f}")
 
-    if failed:
-        print(f"\n失败请求数: {len(failed)}")
-        for i, f in enumerate(failed[:3], 1):
-            print(f"  错误 {i}: {f['error']}")
+    if stats.failed:
+        print(f"\n失败请求数: {stats.failed}")
+        for i, error in enumerate(stats.errors[:3], 1):
+            print(f"  错误 {i}: {error}")
 
+    print_timing_report(stats)
+    print_cpu_report(stats.cpu_samples)
 
-async def main():
+
+def print_timing_report(stats: RunStats):
+    """报告平均耗时分段，以及客户端开销在延迟中的占比"""
+    if not stats.success or not any(stats.phase_totals.values()):
+        return
+
+    total_latency = stats.latency.total
+    print(f"\n耗时分段 (平均):")
+    for phase in TIMING_PHASES:
+        value = stats.phase_totals[phase]
+        print(f"  {TIMING_PHASE_NAMES[phase]}: {value / stats.success * 1000:.1f}ms "
+              f"({value / total_latency:.1%})")
+
+    # 除"等待响应"之外的时间都发生在客户端或网络连接上；
+    # 流式请求的"接收响应"包含服务端生成时间，不计入客户端开销
+    overhead = total_latency - stats.phase_totals["wait"]
+    if stats.ttft.count:
+        overhead -= stats.phase_totals["receive"]
+    print(f"  客户端开销: {overhead / stats.success * 1000:.1f}ms "
+          f"(占延迟 {overhead / total_latency:.1%})")
+
+    connections = stats.new_connections + stats.reused_connections
+    print(f"  连接复用率: {stats.reused_connections / connections:.1%} "
+          f"(新建 {stats.new_connections}, 复用 {stats.reused_connections})")
+    if stats.phase_totals["queue"] > 0.05 * total_latency:
+        print("  ⚠️  请求在连接池中排队时间较长，请调大 --pool-size")
+
+
+def print_cpu_report(cpu_samples: List[Tuple[float, float]]):
+    """报告客户端 CPU 占用，判断压测结果是否可信"""
+    if not cpu_samples:
+        return
+
+    usages = [cpu / wall if wall > 0 else 0.0 for cpu, wall in cpu_samples]
+    print(f"\n客户端CPU:")
+    print(f"  进程数: {len(usages)} (本机核数: {os.cpu_count()})")
+    print(f"  单进程CPU占用: 平均 {sum(usages) / len(usages):.0%}, 最高 {max(usages):.0%}")
+
+    if max(usages) >= CPU_SATURATION_THRESHOLD:
+        print("  ⚠️  客户端CPU已接近饱和，测得的延迟和吞吐量可能受压测端限制，"
+              "请增加 --workers 或换用更多核的机器")
+    if len(usages) > (os.cpu_count() or 1):
+        print("  ⚠️  压测进程数超过本机核数，进程之间会争抢CPU，结果可能不可信")
+
+
+class SoakRecorder:
+    """
+    持续压测的按秒统计
+
+    请求按完成时刻归入对应的秒，当前秒结束后该秒的统计即不再变化，
+    可以写入时间序列文件并刷新终端摘要。
+    """
+
+    def __init__(self, warmup: float, output_path: Optional[str]):
+        self.warmup = warmup
+        self.buckets: Dict[int, RunStats] = {}
+        self.overall = RunStats()
+        self.rows: List[Dict] = []
+        self.in_flight = 0
+        self.output = open(output_path, "w", encoding="utf-8") if output_path else None
+
+    def add(self, sent_offset: float, done_offset: float, result: Dict):
+        self.buckets.setdefault(int(done_offset), RunStats()).add(result)
+        # 预热阶段发出的请求不计入总体统计
+        if sent_offset >= self.warmup:
+            self.overall.add(result)
+
+    def flush(self, second: int):
+        """输出第 second 秒（已结束）的统计"""
+        stats = self.buckets.pop(second, RunStats())
+        completed = stats.success + stats.failed
+        row = {
+            "t": second,
+            "warmup": second < self.warmup,
+            "completed": completed,
+            "success": stats.success,
+            "errors": stats.failed,
+            "error_rate": round(stats.failed / completed, 4) if completed else 0.0,
+            "tokens_per_sec": stats.tokens,
+            "latency_p50": round(stats.latency.percentile(50), 4),
+            "latency_p90": round(stats.latency.percentile(90), 4),
+            "latency_p99": round(stats.latency.percentile(99), 4),
+            "in_flight": self.in_flight,
+        }
+        self.rows.append(row)
+        if self.output:
+            self.output.write(json.dumps(row) + "\n")
+            self.output.flush()
+
+        phase = "预热" if row["warmup"] else "统计"
+        print(f"\r[{second:>5}s {phase}] 完成 {completed:>4}/s  错误率 {row['error_rate']:>6.1%}  "
+              f"P50 {row['latency_p50']:>6.2f}s  P99 {row['latency_p99']:>6.2f}s  "
+              f"token/s {stats.tokens:>6}  进行中 {self.in_flight:>4}", end="", flush=True)
+
+    def close(self):
+        if self.output:
+            self.output.close()
+
+
+async def run_soak_test(duration: float, rate: float, warmup: float, concurrency: int,
+                        config: BenchConfig, output_path: Optional[str]):
+    """持续压测：按固定速率发送请求，直到 duration 秒后停止发送并等待进行中的请求完成"""
+    print(f"\n{'='*60}")
+    print(f"持续压测: {duration:.0f} 秒, 速率: {rate} 请求/秒, 预热: {warmup:.0f} 秒, 并发上限: {concurrency}")
+    if output_path:
+        print(f"时间序列输出: {output_path}")
+    print(f"{'='*60}\n")
+
+    recorder = SoakRecorder(warmup, output_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+
+    async def tracked_request(index, sent_offset):
+        recorder.in_flight += 1
+        try:
+            async with semaphore:
+                result = await send_request(session, test_prompts[index % len(test_prompts)], config)
+        finally:
+            recorder.in_flight -= 1
+        recorder.add(sent_offset, time.perf_counter() - start, result)
+
+    async def reporter():
+        second = 0
+        while True:
+            await asyncio.sleep(max(0.0, start + second + 1 - time.perf_counter()))
+            recorder.flush(second)
+            second += 1
+
+    # 只保留进行中的请求，完成后立即移除：长时间压测时压测端自身的内存不随请求数增长
+    tasks = set()
+    async with make_session(config, concurrency) as session:
+        reporter_task = asyncio.create_task(reporter())
+        # 固定速率发送（开环）：服务变慢时请求在客户端积压，体现在"进行中"一列
+        index = 0
+        while index / rate < duration:
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(tracked_request(index, index / rate))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            index += 1
+        await asyncio.gather(*tasks)
+        total_time = time.perf_counter() - start
+
+        # 等当前秒结束，输出最后一行后停止
+        await asyncio.sleep(max(0.0, math.ceil(total_time) - (time.perf_counter() - start)))
+        reporter_task.cancel()
+    for second in sorted(recorder.buckets):
+        recorder.flush(second)
+    recorder.close()
+    print()
+
+    stats = recorder.overall
+    stats.cpu_samples.append((time.process_time() - cpu_start, total_time))
+    measured = max(total_time - warmup, 1e-6)
+    print(f"\n预热之后的统计（{measured:.0f} 秒）:")
+    print_report(stats, stats.success + stats.failed, measured)
+    print_drift_report(recorder.rows)
+
+
+def print_drift_report(rows: List[Dict]):
+    """比较统计阶段前 1/3 和后 1/3 的延迟与吞吐，提示性能随时间退化"""
+    rows = [row for row in rows if not row["warmup"] and row["completed"]]
+    if len(rows) < 6:
+        return
+
+    third = len(rows) // 3
+
+    def summarize(part):
+        return (sum(r["latency_p50"] for r in part) / len(part),
+                sum(r["completed"] for r in part) / len(part))
+
+    head_p50, head_rps = summarize(rows[:third])
+    tail_p50, tail_rps = summarize(rows[-third:])
+    print(f"\n性能漂移（前1/3 → 后1/3）:")
+    print(f"  P50延迟: {head_p50:.2f}s → {tail_p50:.2f}s")
+    print(f"  吞吐量: {head_rps:.2f} → {tail_rps:.2f} 请求/秒")
+    if tail_p50 > head_p50 * 1.2 or tail_rps < head_rps * 0.8:
+        print("  ⚠️  性能随时间明显下降，可能存在降频、KV cache 碎片或内存泄漏")
+
+
+async def run_closed_loop(session: aiohttp.ClientSession, concurrency: int,
+                          duration: float, config: BenchConfig) -> List[Dict]:
+    """闭环压测：concurrency 个虚拟用户在 duration 秒内连续发送请求"""
+    deadline = time.perf_counter() + duration
+    results = []
+
+    async def user(index):
+        while time.perf_counter() < deadline:
+            results.append(await send_request(session, test_prompts[index % len(test_prompts)], config))
+            index += concurrency
+
+    await asyncio.gather(*[user(i) for i in range(concurrency)])
+    return results
+
+
+async def run_trial(mode: str, value: float, duration: float,
+                    config: BenchConfig, slo: Slo) -> Dict:
+    """以给定并发数或速率运行一轮，返回统计和 SLO 判定"""
+    if mode == "concurrency":
+        pool_size = int(value)
+    else:
+        pool_size = RATE_MODE_MAX_IN_FLIGHT
+
+    start = time.perf_counter()
+    async with make_session(config, pool_size) as session:
+        if mode == "concurrency":
+            results = await run_closed_loop(session, int(value), duration, config)
+        else:
+            schedule = build_schedule(max(1, round(value * duration)), value)
+            results = await execute_schedule(session, schedule, RATE_MODE_MAX_IN_FLIGHT,
+                                             time.time(), config)
+    elapsed = time.perf_counter() - start
+
+    stats = RunStats()
+    for result in results:
+        stats.add(result)
+    good = [r for r in results if slo.request_ok(r)]
+
+    return {
+        "value": value,
+        "stats": stats,
+        "elapsed": elapsed,
+        "throughput": stats.success / elapsed,
+        "goodput": len(good) / elapsed,
+        "token_goodput": sum(r["tokens"] for r in good) / elapsed,
+        "violations": slo.violations(stats),
+    }
+
+
+def print_trial(mode: str, trial: Dict, slo: Slo):
+    stats = trial["stats"]
+    p = slo.percentile
+    total = stats.success + stats.failed
+    label = f"并发 {int(trial['value'])}" if mode == "concurrency" else f"速率 {trial['value']:.2f}/s"
+    status = "✓" if not trial["violations"] else "✗ " + "; ".join(trial["violations"])
+    print(f"  {label:<14} 吞吐 {trial['throughput']:6.2f}/s  goodput {trial['goodput']:6.2f}/s  "
+          f"P{p:g} TTFT {stats.ttft.percentile(p) * 1000:6.0f}ms  "
+          f"P{p:g} TPOT {stats.tpot.percentile(p) * 1000:5.0f}ms  "
+          f"P{p:g} 延迟 {stats.latency.percentile(p):6.2f}s  "
+          f"错误 {stats.failed}/{total}  {status}")
+
+
+MIN_SEARCH_RATE = 0.01
+
+
+def positive_float(text: str) -> float:
+    value = float(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"必须大于 0: {text}")
+    return value
+
+
+async def run_slo_search(mode: str, start: float, maximum: float, duration: float,
+                         config: BenchConfig, slo: Slo):
+    """
+    搜索满足 SLO 的最大并发数/速率
+
+    先从 start 开始倍增直到 SLO 被打破（或达到 maximum），
+    再在最后一个满足值与第一个不满足值之间二分。
+    """
+    print(f"\n{'='*60}")
+    print(f"SLO 搜索: 按{'并发数' if mode == 'concurrency' else '请求速率'}, "
+          f"每轮 {duration:.0f} 秒, 上限 {maximum:g}")
+    limits = [f"{name} ≤ {limit * 1000:.0f}ms" for name, limit in
+              (("TTFT", slo.ttft), ("TPOT", slo.tpot), ("延迟", slo.latency)) if limit is not None]
+    print(f"SLO: P{slo.percentile:g} {', '.join(limits) or '（未设置延迟要求）'}, "
+          f"错误率 ≤ {slo.max_error_rate:.1%}")
+    print(f"{'='*60}\n")
+
+    trials: Dict[float, Dict] = {}
+
+    async def evaluate(value):
+        if value not in trials:
+            if trials:
+                await asyncio.sleep(2)  # 两轮之间等待服务恢复
+            trials[value] = await run_trial(mode, value, duration, config, slo)
+            print_trial(mode, trials[value], slo)
+        return not trials[value]["violations"]
+
+    def normalize(value):
+        # 速率精确到 0.01，过小的值取 0.01，否则倍增阶段停在 0
+        return max(1, int(value)) if mode == "concurrency" else max(MIN_SEARCH_RATE, round(value, 2))
+
+    good, bad = None, None
+    value = normalize(start)
+    while True:
+        if await evaluate(value):
+            good = value
+            if value >= maximum:
+                break
+            value = normalize(min(value * 2, maximum))
+        else:
+            bad = value
+            break
+
+    if good is not None and bad is not None:
+        # 并发数精确到 1，速率精确到 5%
+        while True:
+            resolution = 1 if mode == "concurrency" else max(0.01, good * 0.05)
+            if bad - good <= resolution:
+                break
+            middle = normalize((good + bad) / 2)
+            if middle in (good, bad):
+                break
+            if await evaluate(middle):
+                good = middle
+            else:
+                bad = middle
+
+    print(f"\n{'='*60}")
+    passing = [t for t in trials.values() if not t["violations"]]
+    if not passing:
+        print(f"在 {mode} = {normalize(start)} 时已无法满足 SLO，请放宽 SLO 或检查服务状态")
+        return
+
+    best = max(passing, key=lambda t: t["goodput"])
+    setting = f"并发数 {int(best['value'])}" if mode == "concurrency" else f"请求速率 {best['value']:.2f}/s"
+    print(f"最大可持续 goodput: {best['goodput']:.2f} 请求/秒 "
+          f"({best['token_goodput']:.1f} token/秒), 配置: {setting}")
+    if mode == "concurrency":
+        print(f"建议: OLLAMA_NUM_PARALLEL={int(good)} 或 vLLM --max-num-seqs {int(good)}")
+    if bad is None:
+        print(f"注意: 已达到搜索上限 {maximum:g} 仍满足 SLO，可调大 --search-max 继续搜索")
+
+
+async def main(args):
     """主函数"""
+    config = BenchConfig(api_url=args.url, model=args.model,
+                         pool_size=args.pool_size,
+                         keepalive_timeout=args.keepalive,
+                         dns_cache_ttl=args.dns_ttl,
+                         stream=args.stream)
+
     print("="*60)
     print("大模型 API 性能测试")
-    print(f"API: {API_URL}")
-    print(f"模型: {MODEL_NAME}")
+    print(f"API: {config.api_url}")
+    print(f"模型: {config.model}")
     print("="*60)
 
-    # 测试场景
-    test_scenarios = [
-        (5, 1),    # 5个请求，1个并发（顺序测试）
-        (10, 2),   # 10个请求，2个并发
-        (10, 5),   # 10个请求，5个并发
-        (20, 10),  # 20个请求，10个并发
-    ]
+    if args.search:
+        slo = Slo(ttft=args.slo_ttft, tpot=args.slo_tpot, latency=args.slo_latency,
+                  percentile=args.slo_percentile, max_error_rate=args.max_error_rate)
+        if slo.ttft is not None or slo.tpot is not None:
+            # TTFT / TPOT 只能通过流式响应测量
+            config = replace(config, stream=True)
+        await run_slo_search(args.search, args.search_start, args.search_max,
+                             args.trial_duration, config, slo)
+        return
 
-    for num_requests, concurrency in test_scenarios:
-        await run_concurrent_test(num_requests, concurrency)
-        await asyncio.sleep(2)  # 测试之间等待2秒
+    if args.duration:
+        await run_soak_test(args.duration, args.rate or 1.0, args.warmup, args.concurrency,
+                            config, args.output)
+        return
+
+    if args.requests:
+        test_scenarios = [(args.requests, args.concurrency)]
+    else:
+        # 测试场景
+        test_scenarios = [
+            (5, 1),    # 5个请求，1个并发（顺序测试）
+            (10, 2),   # 10个请求，2个并发
+            (10, 5),   # 10个请求，5个并发
+            (20, 10),  # 20个请求，10个并发
+        ]
+
+    for i, (num_requests, concurrency) in enumerate(test_scenarios):
+        if i:
+            await asyncio.sleep(2)  # 测试之间等待2秒
+        await run_concurrent_test(num_requests, concurrency,
+                                  workers=args.workers, rate=args.rate, config=config)
 
     print(f"\n{'='*60}")
     print("测试完成！")
     print(f"{'='*60}\n")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="大模型 API 性能测试")
+    parser.add_argument("--url", default=os.getenv("BENCH_API_URL", API_URL),
+                        help="Chat Completions 接口地址")
+    parser.add_argument("--model", default=os.getenv("BENCH_MODEL", MODEL_NAME),
+                        help="模型名称")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="请求总数，不指定时运行内置测试场景")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="总并发数（多进程时平均分配）")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="压测进程数，每个进程独立的事件循环和连接池")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="请求到达速率（请求/秒，泊松分布），不指定时一次性全部发出")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="持续压测时长（秒），指定后按 --rate 固定速率运行 soak 测试")
+    parser.add_argument("--warmup", type=float, default=30.0,
+                        help="持续压测的预热时长（秒），预热期间发出的请求不计入统计")
+    parser.add_argument("--output", default="soak_timeseries.jsonl",
+                        help="持续压测的逐秒时间序列输出文件（JSON Lines），为空时不输出")
+    parser.add_argument("--stream", action="store_true",
+                        help="使用流式请求，额外统计 TTFT 和 TPOT")
+    parser.add_argument("--search", choices=["concurrency", "rate"],
+                        help="SLO 搜索模式：逐步提高并发数或请求速率直到 SLO 被打破")
+    parser.add_argument("--search-start", type=positive_float, default=1,
+                        help="搜索起始值")
+    parser.add_argument("--search-max", type=positive_float, default=256,
+                        help="搜索上限")
+    parser.add_argument("--trial-duration", type=float, default=30,
+                        help="搜索时每一轮的压测时长（秒）")
+    parser.add_argument("--slo-ttft", type=float, default=None,
+                        help="TTFT 的 SLO（秒），例如 1.0")
+    parser.add_argument("--slo-tpot", type=float, default=None,
+                        help="TPOT 的 SLO（秒），例如 0.05")
+    parser.add_argument("--slo-latency", type=float, default=None,
+                        help="端到端延迟的 SLO（秒）")
+    parser.add_argument("--slo-percentile", type=float, default=95,
+                        help="SLO 使用的百分位")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="SLO 允许的最大错误率")
+    parser.add_argument("--pool-size", type=int, default=0,
+                        help="每个进程的连接池上限，默认与该进程的并发数相同")
+    parser.add_argument("--keepalive", type=float, default=30.0,
+                        help="空闲连接保持秒数，0 表示禁用 keep-alive")
+    parser.add_argument("--dns-ttl", type=int, default=300,
+                        help="DNS 缓存秒数，0 表示禁用缓存")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
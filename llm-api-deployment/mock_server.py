@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟大模型服务（不需要 GPU）
+
+同时提供 OpenAI 兼容的 /v1/chat/completions（流式/非流式）和
+Ollama 的 /api/chat 接口，可配置首 token 延迟、生成速度、错误率和最大并发，
+用于离线测试 benchmark.py 自身的开销以及 claude-code-stack 客户端的解析逻辑。
+
+用法:
+    python3 mock_server.py --port 8000 --ttft 0.2 --tokens-per-sec 30
+    python3 benchmark.py --url http://localhost:8000/v1/chat/completions
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+from aiohttp import web
+
+
+# Ollama 接口默认返回的内容：符合 claude-code-stack 客户端要求的 JSON
+DEFAULT_OLLAMA_CONTENT = json.dumps({
+    "files": [
+        {"path": "examples/hello.py", "content": "print('hello from mock server')\n"},
+        {"path": "examples/README.md", "content": "# Mock\n\n由 mock_server.py 生成。\n"},
+    ]
+}, ensure_ascii=False, indent=2)
+
+# 按约 4 个字符切分为一个 token
+CHARS_PER_TOKEN = 4
+
+# 生成速度很高时，每次 sleep 至少间隔这么久，避免事件循环被大量短 sleep 拖慢
+MIN_SLEEP_INTERVAL = 0.005
+
+
+@dataclass
+class MockConfig:
+    """模拟服务配置"""
+    ttft: float = 0.2               # 首 token 延迟（秒）
+    tokens_per_sec: float = 30.0    # 首 token 之后的生成速度
+    output_tokens: int = 128        # 默认生成 token 数（不超过请求的 max_tokens）
+    error_rate: float = 0.0         # 随机返回 500 的比例
+    max_concurrency: int = 0        # 同时生成的请求数上限，0 表示不限制
+    max_queue: int = 0              # 超过并发上限后允许排队的请求数，0 表示不限制
+    response_text: Optional[str] = None  # 固定返回内容，None 时按接口生成默认内容
+    seed: Optional[int] = None
+
+
+class MockLLMServer:
+    """模拟服务状态：并发控制、统计计数"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.semaphore = asyncio.Semaphore(config.max_concurrency) if config.max_concurrency else None
+        self.waiting = 0
+        self.active = 0
+        self.stats = {
+            "requests": 0,
+            "completed": 0,
+            "errors_injected": 0,
+            "rejected": 0,
+            "peak_active": 0,
+        }
+
+    def build_tokens(self, max_tokens: Optional[int], default_text: Optional[str]) -> List[str]:
+        """生成要返回的 token 序列"""
+        text = self.config.response_text or default_text
+        if text is not None:
+            return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+        count = self.config.output_tokens
+        if max_tokens:
+            count = min(count, max_tokens)
+        return [f"tok{i} " for i in range(count)]
+
+    async def acquire(self) -> bool:
+        """占用一个生成槽位，队列已满时返回 False"""
+        self.stats["requests"] += 1
+        if self.semaphore is not None:
+            if self.config.max_queue and self.semaphore.locked() and self.waiting >= self.config.max_queue:
+                self.stats["rejected"] += 1
+                return False
+            self.waiting += 1
+            try:
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        self.active += 1
+        self.stats["peak_active"] = max(self.stats["peak_active"], self.active)
+        return True
+
+    def release(self):
+        self.active -= 1
+        self.stats["completed"] += 1
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+    def should_fail(self) -> bool:
+        if self.config.error_rate and self.rng.random() < self.config.error_rate:
+            self.stats["errors_injected"] += 1
+            return True
+        return False
+
+    async def stream_tokens(self, tokens: List[str]):
+        """按首 token 延迟和生成速度逐个产出 token"""
+        start = time.perf_counter()
+        interval = 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+        for i, token in enumerate(tokens):
+            due = start + self.config.ttft + i * interval
+            delay = due - time.perf_counter()
+            # 落后于计划时不 sleep，直接补发
+            if delay >= MIN_SLEEP_INTERVAL or (i == 0 and delay > 0):
+                await asyncio.sleep(delay)
+            yield token
+
+    async def wait_full_generation(self, num_tokens: int):
+        """非流式请求：一次性等待完整生成时间"""
+        interval = 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+        await asyncio.sleep(self.config.ttft + max(0, num_tokens - 1) * interval)
+
+
+MOCK_SERVER_KEY = web.AppKey("mock_server", MockLLMServer)
+
+
+def _error_response(status: int, message: str) -> web.Response:
+    return web.json_response({"error": {"message": message, "type": "mock_error"}}, status=status)
+
+
+async def handle_chat_completions(request: web.Request) -> web.StreamResponse:
+    """OpenAI 兼容接口"""
+    server: MockLLMServer = request.app[MOCK_SERVER_KEY]
+    body = await request.json()
+
+    if not await server.acquire():
+        return _error_response(429, "too many requests")
+    try:
+        if server.should_fail():
+            return _error_response(500, "injected error")
+
+        tokens = server.build_tokens(body.get("max_tokens"), None)
+        model = body.get("model", "mock-model")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": sum(len(m.get("content") or "") for m in body.get("messages", [])) // CHARS_PER_TOKEN,
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            await server.wait_full_generation(len(tokens))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        async def send(data):
+            await response.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        first = True
+        async for token in server.stream_tokens(tokens):
+            delta = {"role": "assistant", "content": token} if first else {"content": token}
+            first = False
+            await send(chunk(delta))
+        await send(chunk({}, "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({**chunk({}), "choices": [], "usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    finally:
+        server.release()
+
+
+async def handle_ollama_chat(request: web.Request) -> web.StreamResponse:
+    """Ollama /api/chat 接口（默认流式，NDJSON）"""
+    server: MockLLMServer = request.app[MOCK_SERVER_KEY]
+    body = await request.json()
+
+    if not await server.acquire():
+        return web.json_response({"error": "too many requests"}, status=429)
+    try:
+        if server.should_fail():
+            return web.json_response({"error": "injected error"}, status=500)
+
+        options = body.get("options") or {}
+        tokens = server.build_tokens(options.get("num_predict"), DEFAULT_OLLAMA_CONTENT)
+        model = body.get("model", "mock-model")
+        start = time.perf_counter()
+
+        def final_message(content):
+            return {
+                "model": model,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "message": {"role": "assistant", "content": content},
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": int((time.perf_counter() - start) * 1e9),
+                "load_duration": 0,
+                "eval_count": len(tokens),
+            }
+
+        if body.get("stream", True) is False:
+            await server.wait_full_generation(len(tokens))
+            return web.json_response(final_message("".join(tokens)))
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        async for token in server.stream_tokens(tokens):
+            line = {
+                "model": model,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "message": {"role": "assistant", "content": token},
+                "done": False,
+            }
+            await response.write((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+        await response.write((json.dumps(final_message("")) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+    finally:
+        server.release()
+
+
+async def handle_ollama_generate(request: web.Request) -> web.Response:
+    """Ollama /api/generate：客户端用不带 prompt 的请求预热模型"""
+    body = await request.json()
+    return web.json_response({
+        "model": body.get("model", "mock-model"),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "response": "",
+        "done": True,
+        "done_reason": "load",
+    })
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def handle_models(request: web.Request) -> web.Response:
+    return web.json_response({"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+
+
+async def handle_ollama_tags(request: web.Request) -> web.Response:
+    return web.json_response({"models": [{"name": "mock-model", "model": "mock-model"}]})
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    server: MockLLMServer = request.app[MOCK_SERVER_KEY]
+    return web.json_response({**server.stats, "active": server.active, "waiting": server.waiting})
+
+
+def create_app(config: MockConfig) -> web.Application:
+    """创建模拟服务应用（测试中可直接使用）"""
+    app = web.Application()
+    app[MOCK_SERVER_KEY] = MockLLMServer(config)
+    app.router.add_post("/v1/chat/completions", handle_chat_completions)
+    app.router.add_post("/api/chat", handle_ollama_chat)
+    app.router.add_post("/api/generate", handle_ollama_generate)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/v1/models", handle_models)
+    app.router.add_get("/api/tags", handle_ollama_tags)
+    app.router.add_get("/mock/stats", handle_stats)
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地模拟大模型服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--ttft", type=float, default=0.2, help="首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=30.0, help="每个请求的生成速度")
+    parser.add_argument("--output-tokens", type=int, default=128, help="默认生成 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 500 的比例（0-1）")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="同时生成的请求数上限，0 表示不限制")
+    parser.add_argument("--max-queue", type=int, default=0, help="排队上限，超过后返回 429，0 表示不限制")
+    parser.add_argument("--response-file", help="固定返回该文件的内容")
+    parser.add_argument("--seed", type=int, default=None, help="错误注入的随机种子")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    response_text = None
+    if args.response_file:
+        with open(args.response_file, "r", encoding="utf-8") as f:
+            response_text = f.read()
+
+    config = MockConfig(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        response_text=response_text,
+        seed=args.seed,
+    )
+
+    print(f"模拟服务已启动: http://{args.host}:{args.port}")
+    print(f"  首token延迟: {config.ttft}s, 生成速度: {config.tokens_per_sec} token/s, "
+          f"错误率: {config.error_rate:.0%}, 最大并发: {config.max_concurrency or '不限'}")
+    web.run_app(create_app(config), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
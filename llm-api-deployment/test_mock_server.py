@@ -0,0 +1,290 @@
+"""
+模拟大模型服务与压测客户端的离线测试
+
+运行测试: pytest test_mock_server.py -v
+"""
+
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+
+import pytest
+
+from benchmark import (TIMING_PHASES, BenchConfig, LatencyHistogram, RunStats, Slo, build_schedule, execute_schedule,
+                       make_session, run_concurrent_test, run_soak_test, send_request, split_timing)
+from mock_server import MockConfig, create_app
+
+
+async def _with_server(config, scenario):
+    """在随机端口启动模拟服务并运行测试场景"""
+    runner = web.AppRunner(create_app(config))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        return await scenario(f"http://127.0.0.1:{port}")
+    finally:
+        await runner.cleanup()
+
+
+def run(config, scenario):
+    return asyncio.run(_with_server(config, scenario))
+
+
+def test_chat_completions_non_stream():
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            payload = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 5}
+            async with session.post(base_url + "/v1/chat/completions", json=payload) as resp:
+                return resp.status, await resp.json()
+
+    status, body = run(MockConfig(ttft=0, tokens_per_sec=0), scenario)
+    assert status == 200
+    assert body["usage"]["completion_tokens"] == 5
+    assert body["choices"][0]["message"]["content"].startswith("tok0")
+
+
+def test_chat_completions_stream():
+    async def scenario(base_url):
+        chunks = []
+        async with aiohttp.ClientSession() as session:
+            payload = {"model": "m", "messages": [], "max_tokens": 3, "stream": True}
+            async with session.post(base_url + "/v1/chat/completions", json=payload) as resp:
+                async for line in resp.content:
+                    line = line.decode().strip()
+                    if line.startswith("data: "):
+                        chunks.append(line[len("data: "):])
+        return chunks
+
+    chunks = run(MockConfig(ttft=0, tokens_per_sec=0), scenario)
+    assert chunks[-1] == "[DONE]"
+    contents = [json.loads(c)["choices"][0]["delta"].get("content") for c in chunks[:-1]]
+    assert contents[:3] == ["tok0 ", "tok1 ", "tok2 "]
+
+
+def test_ollama_chat_returns_files_json():
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            payload = {"model": "m", "messages": [], "stream": False}
+            async with session.post(base_url + "/api/chat", json=payload) as resp:
+                return await resp.json()
+
+    body = run(MockConfig(ttft=0, tokens_per_sec=0), scenario)
+    assert body["done"] is True
+    assert json.loads(body["message"]["content"])["files"]
+
+
+def test_ollama_generate_warm_up():
+    """不带 prompt 的 /api/generate 只加载模型，不计入生成请求"""
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            payload = {"model": "qwen", "keep_alive": "30m"}
+            async with session.post(base_url + "/api/generate", json=payload) as resp:
+                body = await resp.json()
+            async with session.get(base_url + "/mock/stats") as resp:
+                return body, await resp.json()
+
+    body, stats = run(MockConfig(ttft=1.0), scenario)
+    assert body["model"] == "qwen"
+    assert body["done"] is True and body["done_reason"] == "load"
+    assert body["response"] == ""
+    assert stats["requests"] == 0
+
+
+def test_error_injection_and_queue_limit():
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(base_url + "/health") as resp:
+                assert resp.status == 200
+            payload = {"model": "m", "messages": [], "max_tokens": 1}
+
+            async def post():
+                async with session.post(base_url + "/v1/chat/completions", json=payload) as resp:
+                    await resp.read()
+                    return resp.status
+
+            return sorted(await asyncio.gather(*[post() for _ in range(6)]))
+
+    statuses = run(MockConfig(ttft=0.2, max_concurrency=1, max_queue=1), scenario)
+    assert statuses.count(200) == 2
+    assert statuses.count(429) == 4
+
+    async def failing(base_url):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(base_url + "/v1/chat/completions", json={"messages": []}) as resp:
+                return resp.status
+
+    assert run(MockConfig(ttft=0, error_rate=1.0), failing) == 500
+
+
+def test_benchmark_against_mock():
+    async def scenario(base_url):
+        config = BenchConfig(api_url=base_url + "/v1/chat/completions", max_tokens=8)
+        stats = RunStats()
+        async with make_session(config, 4) as session:
+            results = await execute_schedule(session, build_schedule(12), 4, 0.0, config)
+        for result in results:
+            stats.add(result)
+        return stats
+
+    stats = run(MockConfig(ttft=0.01, tokens_per_sec=0), scenario)
+    assert stats.success == 12
+    assert stats.tokens == 12 * 8
+    assert stats.reused_connections > 0
+    assert stats.latency.percentile(50) >= 0.01
+
+
+def test_stream_request_measures_ttft_and_slo():
+    async def scenario(base_url):
+        config = BenchConfig(api_url=base_url + "/v1/chat/completions", max_tokens=5, stream=True)
+        async with make_session(config, 1) as session:
+            return await send_request(session, "hi", config)
+
+    result = run(MockConfig(ttft=0.05, tokens_per_sec=100), scenario)
+    assert result["success"]
+    assert result["tokens"] == 5
+    assert result["ttft"] >= 0.05
+    assert 0.005 < result["tpot"] < 0.05
+
+    stats = RunStats()
+    stats.add(result)
+    assert Slo(ttft=1.0, tpot=0.05).violations(stats) == []
+    assert Slo(ttft=0.01).violations(stats)
+    assert not Slo(ttft=0.01).request_ok(result)
+
+
+def test_histogram_merge_matches_single_histogram():
+    """分开记录再合并的直方图与直接记录全部样本的结果相同"""
+    values = [0.0005, 0.01, 0.02, 0.05, 0.1, 0.3, 1.0, 2.5]
+    whole, left, right = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i, value in enumerate(values):
+        whole.record(value)
+        (left if i % 2 else right).record(value)
+    left.merge(right)
+
+    assert left.counts == whole.counts
+    assert (left.count, left.min, left.max) == (whole.count, whole.min, whole.max)
+    assert left.mean() == pytest.approx(whole.mean())
+    assert left.stdev() == pytest.approx(whole.stdev())
+    for p in (50, 90, 99):
+        assert left.percentile(p) == whole.percentile(p)
+
+    # 合并空直方图不改变结果
+    left.merge(LatencyHistogram())
+    assert left.percentile(50) == whole.percentile(50)
+    with pytest.raises(ValueError):
+        left.merge(LatencyHistogram(growth=1.05))
+
+
+def test_two_workers_match_single_run():
+    """两个 worker 进程分担同一时间表，合并后的总数与单进程运行一致"""
+    async def scenario(base_url):
+        config = BenchConfig(api_url=base_url + "/v1/chat/completions", max_tokens=4)
+        single = await run_concurrent_test(10, 4, workers=1, config=config)
+        multi = await run_concurrent_test(10, 4, workers=2, config=config)
+        return single, multi
+
+    single, multi = run(MockConfig(ttft=0.01, tokens_per_sec=0), scenario)
+    for stats in (single, multi):
+        assert (stats.success, stats.failed, stats.tokens) == (10, 0, 40)
+        assert stats.latency.count == 10
+        assert stats.new_connections + stats.reused_connections == 10
+    # 每个 worker 各自报告一份 CPU 占用
+    assert len(single.cpu_samples) == 1
+    assert len(multi.cpu_samples) == 2
+    # 两个 worker 各自建立连接
+    assert multi.new_connections >= 2
+
+
+def test_run_stats_merge():
+    """合并各 worker 的统计：计数和分段耗时相加，错误样例最多保留 3 条"""
+    timing = {"queue": 0.1, "connect": 0.2, "send": 0.0, "wait": 0.5, "receive": 0.1, "reused": False}
+    parts = []
+    for worker in range(2):
+        stats = RunStats()
+        stats.add({"success": True, "latency": 0.9, "tokens": 7, "timing": timing})
+        for i in range(2):
+            stats.add({"success": False, "latency": 0.1, "tokens": 0, "error": f"w{worker}-e{i}"})
+        parts.append(stats)
+
+    merged = RunStats()
+    for stats in parts:
+        merged.merge(stats)
+    assert (merged.success, merged.failed, merged.tokens) == (2, 4, 14)
+    assert merged.errors == ["w0-e0", "w0-e1", "w1-e0"]
+    assert merged.phase_totals["wait"] == pytest.approx(1.0)
+    assert merged.new_connections == 2
+
+
+def test_split_timing_phases():
+    """各阶段耗时按 trace 时间点计算，相加等于总耗时"""
+    marks = {"request_start": 10.1, "queued_start": 10.1, "queued_end": 10.3, "connect_start": 10.3,
+             "connect_end": 10.6, "headers_sent": 10.65, "body_sent": 10.7, "response_start": 11.5}
+    timing = split_timing(marks, 10.0, 12.0)
+
+    assert timing["queue"] == pytest.approx(0.2)
+    assert timing["connect"] == pytest.approx(0.3)
+    assert timing["send"] == pytest.approx(0.2)   # 请求开始前的 0.1s 加上发送的 0.1s
+    assert timing["wait"] == pytest.approx(0.8)
+    assert timing["receive"] == pytest.approx(0.5)
+    assert timing["reused"] is False
+    assert sum(timing[phase] for phase in TIMING_PHASES) == pytest.approx(2.0)
+
+
+def test_split_timing_missing_marks():
+    """缺少 trace 时间点（复用连接、请求未发出即失败等）时各阶段非负，相加仍等于总耗时"""
+    cases = [
+        {},
+        {"request_start": 1.0, "reused": True, "headers_sent": 1.1, "body_sent": 1.2, "response_start": 1.5},
+        {"request_start": 1.0, "connect_start": 1.0, "connect_end": 1.4},
+        {"request_start": 1.0, "queued_start": 1.0, "queued_end": 1.3, "response_start": 1.8},
+    ]
+    for marks in cases:
+        timing = split_timing(marks, 1.0, 2.0)
+        assert sum(timing[phase] for phase in TIMING_PHASES) == pytest.approx(1.0)
+        assert all(timing[phase] >= -1e-9 for phase in TIMING_PHASES)
+        assert timing["reused"] == marks.get("reused", False)
+
+    assert split_timing({}, 1.0, 2.0)["wait"] == pytest.approx(1.0)
+    assert split_timing(cases[1], 1.0, 2.0)["connect"] == 0
+
+
+def test_request_timing_from_trace():
+    """真实请求的 trace 分段相加等于请求延迟，后续请求复用连接"""
+    async def scenario(base_url):
+        config = BenchConfig(api_url=base_url + "/v1/chat/completions", max_tokens=4)
+        async with make_session(config, 1) as session:
+            return [await send_request(session, "hi", config) for _ in range(3)]
+
+    results = run(MockConfig(ttft=0.02, tokens_per_sec=0), scenario)
+    for result in results:
+        timing = result["timing"]
+        assert sum(timing[phase] for phase in TIMING_PHASES) == pytest.approx(result["latency"])
+        assert all(timing[phase] >= 0 for phase in TIMING_PHASES)
+        assert timing["wait"] >= 0.02
+    assert [result["timing"]["reused"] for result in results] == [False, True, True]
+
+
+def test_soak_writes_one_row_per_second(tmp_path):
+    """持续压测每秒写入一行时间序列，预热阶段单独标记，所有请求都被统计"""
+    output = tmp_path / "soak.jsonl"
+
+    async def scenario(base_url):
+        config = BenchConfig(api_url=base_url + "/v1/chat/completions", max_tokens=4)
+        await run_soak_test(2.0, 5.0, 1.0, 4, config, str(output))
+
+    run(MockConfig(ttft=0.05, tokens_per_sec=0), scenario)
+    rows = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+
+    assert [row["t"] for row in rows] == list(range(len(rows)))
+    assert len(rows) >= 2
+    assert set(rows[0]) == {"t", "warmup", "completed", "success", "errors", "error_rate", "tokens_per_sec",
+                            "latency_p50", "latency_p90", "latency_p99", "in_flight"}
+    assert [row["warmup"] for row in rows] == [row["t"] < 1 for row in rows]
+    assert sum(row["completed"] for row in rows) == 10
+    assert sum(row["tokens_per_sec"] for row in rows) == 40
+    assert all(row["errors"] == 0 for row in rows)
+    assert all(row["latency_p50"] >= 0.05 for row in rows if row["completed"])
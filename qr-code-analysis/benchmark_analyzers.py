@@ -0,0 +1,403 @@
+"""
+二维码分析器性能基准测试
+
+用固定随机种子的 QRCodeSampleGenerator 生成各类别的示例图片，按类别和分辨率（缩放倍数）测量：
+- 方案1 QRCodeAnalyzer
+- 方案8 QRCodeAnalyzerEnsemble 的每种融合策略
+- 方案2 QRCodeAnalyzerYOLOv8 的 pyzbar 检测路径（不加载模型）
+
+记录每组的吞吐量、单张延迟（P50/P95）、检出数和分阶段耗时（qr_metrics.py），以及每个分析器的峰值内存（RSS），
+结果保存为 JSON 基线；compare 对比两份结果，延迟、吞吐量或内存退化超过阈值时退出码非零。
+
+- 每个分析器在单独的进程中运行，峰值 RSS 只包含该分析器
+- 计时只包含 analyze_array，不包含图片解码；每组先预热一轮再计时
+- 分析器的控制台输出在计时期间被丢弃
+
+运行:
+    python benchmark_analyzers.py run --output benchmarks/baseline.json
+    python benchmark_analyzers.py run --output benchmarks/current.json --baseline benchmarks/baseline.json
+    python benchmark_analyzers.py compare benchmarks/baseline.json benchmarks/current.json --threshold 0.1
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from qr_metrics import Metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+ANALYZERS = ['basic', 'ensemble.voting', 'ensemble.weighted', 'ensemble.union', 'ensemble.intersection',
+             'yolo.pyzbar']
+CATEGORIES = ['clear', 'blurred', 'small', 'large', 'low_contrast', 'mixed']
+BASELINE_VERSION = 1
+
+
+# ---------------------------------------------------------------------------
+# 数据集
+# ---------------------------------------------------------------------------
+
+def generate_dataset(output_dir: str, categories: List[str], per_category: int, seed: int) -> Dict[str, Any]:
+    """
+    生成固定种子的示例图片，返回数据集描述（每个类别的图片数、尺寸和内容指纹）
+
+    每个类别单独设置种子，只生成部分类别时其他类别的图片不变
+    """
+    from generate_sample_data import QRCodeSampleGenerator
+
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        generator = QRCodeSampleGenerator(output_dir)
+        for category in categories:
+            index = CATEGORIES.index(category)
+            random.seed(seed + index)
+            np.random.seed(seed + index)
+            getattr(generator, f'generate_{category}_samples')(per_category)
+
+    dataset = {}
+    for category in categories:
+        digest = hashlib.sha256()
+        sizes = []
+        for path in category_paths(output_dir, category):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+            image = cv2.imread(path)
+            sizes.append([image.shape[1], image.shape[0]])
+        dataset[category] = {'images': len(sizes), 'sizes': sizes, 'sha256': digest.hexdigest()[:16]}
+    return dataset
+
+
+def category_paths(data_dir: str, category: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(data_dir, category, '*.jpg')))
+
+
+def scale_image(image: np.ndarray, scale: float) -> np.ndarray:
+    if scale == 1:
+        return image
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+
+
+# ---------------------------------------------------------------------------
+# 单个分析器（在子进程中运行）
+# ---------------------------------------------------------------------------
+
+class _NoInference:
+    """只测 pyzbar 路径时代替推理客户端，YOLOv8 分析器不导入 ultralytics 也不加载模型"""
+
+    def detect_batch(self, images):
+        raise RuntimeError("基准测试不运行YOLO推理")
+
+
+def create_analyzer(name: str, metrics: Metrics):
+    """按名称创建分析器，返回 (分析器, analyze_array 的额外参数)"""
+    if name == 'basic':
+        from qr_analyzer_basic import QRCodeAnalyzer
+        return QRCodeAnalyzer(metrics=metrics), {}
+    if name.startswith('ensemble.'):
+        from solution_8_ensemble.qr_analyzer_ensemble import QRCodeAnalyzerEnsemble
+        analyzer = QRCodeAnalyzerEnsemble(use_wechat_detector=False, fusion_strategy=name.split('.', 1)[1],
+                                          metrics=metrics)
+        return analyzer, {}
+    if name == 'yolo.pyzbar':
+        from solution_2_yolov8.qr_analyzer_yolov8 import QRCodeAnalyzerYOLOv8
+        return QRCodeAnalyzerYOLOv8(inference_client=_NoInference(), metrics=metrics), {'use_yolo': False}
+    raise ValueError(f"未知的分析器: {name}")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值常驻内存（MB），不支持的平台返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_analyzer(name: str, data_dir: str, categories: List[str], scales: List[float],
+                 repeat: int, warmup: int) -> Dict[str, Any]:
+    """在当前进程中测量一个分析器在所有类别和分辨率上的性能"""
+    originals = {category: [cv2.imread(path) for path in category_paths(data_dir, category)]
+                 for category in categories}
+    rss_before = peak_rss_mb()
+
+    metrics = Metrics()
+    devnull = open(os.devnull, 'w', encoding='utf-8')
+    with contextlib.redirect_stdout(devnull):
+        analyzer, call_kwargs = create_analyzer(name, metrics)
+
+    cells = {}
+    for scale in scales:
+        for category in categories:
+            images = [scale_image(image, scale) for image in originals[category]]
+            if not images:
+                continue
+            with contextlib.redirect_stdout(devnull):
+                for _ in range(warmup):
+                    for image in images:
+                        analyzer.analyze_array(image, **call_kwargs)
+                metrics.reset()
+
+                latencies = []
+                qr_codes = 0
+                for _ in range(repeat):
+                    for image in images:
+                        start = time.perf_counter()
+                        results = analyzer.analyze_array(image, **call_kwargs)
+                        latencies.append(time.perf_counter() - start)
+                        qr_codes += len(results)
+
+            total = sum(latencies)
+            latencies_ms = np.array(latencies) * 1000
+            summary = metrics.summary()
+            cells[f'{category}@{scale:g}'] = {
+                'category': category,
+                'scale': scale,
+                'images': len(images),
+                'runs': len(latencies),
+                'qr_codes': qr_codes // repeat,
+                'throughput_ips': round(len(latencies) / total, 2) if total else 0.0,
+                'mean_ms': round(float(latencies_ms.mean()), 3),
+                'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+                'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+                'stages': {stage: {'count': s['count'], 'mean_ms': s['mean_ms'], 'p95_ms': s['p95_ms']}
+                           for stage, s in summary['stages'].items()},
+                'counters': summary['counters'],
+            }
+    devnull.close()
+
+    return {'rss_before_mb': rss_before, 'peak_rss_mb': peak_rss_mb(), 'cells': cells}
+
+
+# ---------------------------------------------------------------------------
+# 对比
+# ---------------------------------------------------------------------------
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1,
+                    min_delta_ms: float = 1.0, rss_threshold: float = 0.2,
+                    stage_threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    对比两份基准结果，返回发现的问题列表
+
+    Args:
+        threshold: P50 延迟增加或吞吐量下降超过该比例时视为退化
+        min_delta_ms: 延迟增加的绝对值小于该值时忽略（避免毫秒以下的抖动）
+        rss_threshold: 峰值内存增加超过该比例时视为退化
+        stage_threshold: 单个阶段平均耗时增加超过该比例时视为退化，为None时不检查阶段
+
+    Returns:
+        每项为 {'analyzer', 'cell', 'metric', 'baseline', 'current', 'change', 'kind'}，
+        kind 为 'regression'（性能退化）或 'changed'（检出数与基线不同）
+    """
+    issues = []
+
+    def add(analyzer, cell, metric, old, new, kind='regression'):
+        change = (new - old) / old if old else 0.0
+        issues.append({'analyzer': analyzer, 'cell': cell, 'metric': metric,
+                       'baseline': old, 'current': new, 'change': round(change, 4), 'kind': kind})
+
+    for analyzer, old in baseline['results'].items():
+        new = current['results'].get(analyzer)
+        if new is None:
+            continue
+
+        if old.get('peak_rss_mb') and new.get('peak_rss_mb') and \
+                new['peak_rss_mb'] > old['peak_rss_mb'] * (1 + rss_threshold):
+            add(analyzer, None, 'peak_rss_mb', old['peak_rss_mb'], new['peak_rss_mb'])
+
+        for cell, old_cell in old['cells'].items():
+            new_cell = new['cells'].get(cell)
+            if new_cell is None:
+                continue
+
+            if new_cell['p50_ms'] > old_cell['p50_ms'] * (1 + threshold) and \
+                    new_cell['p50_ms'] - old_cell['p50_ms'] >= min_delta_ms:
+                add(analyzer, cell, 'p50_ms', old_cell['p50_ms'], new_cell['p50_ms'])
+            if new_cell['throughput_ips'] < old_cell['throughput_ips'] / (1 + threshold) and \
+                    new_cell['mean_ms'] - old_cell['mean_ms'] >= min_delta_ms:
+                add(analyzer, cell, 'throughput_ips', old_cell['throughput_ips'], new_cell['throughput_ips'])
+            if new_cell['qr_codes'] != old_cell['qr_codes']:
+                add(analyzer, cell, 'qr_codes', old_cell['qr_codes'], new_cell['qr_codes'], kind='changed')
+
+            if stage_threshold is None:
+                continue
+            for stage, old_stage in old_cell['stages'].items():
+                new_stage = new_cell['stages'].get(stage)
+                if new_stage and new_stage['mean_ms'] > old_stage['mean_ms'] * (1 + stage_threshold) and \
+                        new_stage['mean_ms'] - old_stage['mean_ms'] >= min_delta_ms:
+                    add(analyzer, cell, f'stage.{stage}', old_stage['mean_ms'], new_stage['mean_ms'])
+
+    return issues
+
+
+def print_comparison(baseline: Dict[str, Any], current: Dict[str, Any], issues: List[Dict[str, Any]]):
+    if baseline.get('dataset') != current.get('dataset'):
+        print("警告: 两次运行的数据集不同（种子、图片数或生成脚本有变化），对比结果仅供参考")
+    if baseline.get('environment') != current.get('environment'):
+        print("警告: 两次运行的环境不同:")
+        for key in sorted(set(baseline.get('environment', {})) | set(current.get('environment', {}))):
+            old, new = baseline.get('environment', {}).get(key), current.get('environment', {}).get(key)
+            if old != new:
+                print(f"  {key}: {old} -> {new}")
+
+    print("=" * 96)
+    print(f"{'分析器':<22}{'类别@缩放':<20}{'基线P50':>12}{'当前P50':>12}{'变化':>10}{'基线吞吐':>12}{'当前吞吐':>12}")
+    print("-" * 96)
+    for analyzer, old in baseline['results'].items():
+        new = current['results'].get(analyzer)
+        if new is None:
+            print(f"{analyzer:<24}（当前结果中没有）")
+            continue
+        for cell, old_cell in old['cells'].items():
+            new_cell = new['cells'].get(cell)
+            if new_cell is None:
+                continue
+            change = (new_cell['p50_ms'] - old_cell['p50_ms']) / old_cell['p50_ms'] * 100 \
+                if old_cell['p50_ms'] else 0.0
+            print(f"{analyzer:<24}{cell:<22}{old_cell['p50_ms']:>10.2f}ms{new_cell['p50_ms']:>10.2f}ms"
+                  f"{change:>+9.1f}%{old_cell['throughput_ips']:>10.1f}/s{new_cell['throughput_ips']:>10.1f}/s")
+        print(f"{analyzer:<24}{'峰值内存':<18}{old.get('peak_rss_mb') or 0:>10.1f}MB{new.get('peak_rss_mb') or 0:>10.1f}MB")
+    print("-" * 96)
+
+    regressions = [issue for issue in issues if issue['kind'] == 'regression']
+    changes = [issue for issue in issues if issue['kind'] == 'changed']
+    for issue in changes:
+        print(f"检出数变化: {issue['analyzer']} {issue['cell']} {issue['baseline']} -> {issue['current']}")
+    for issue in regressions:
+        where = f" {issue['cell']}" if issue['cell'] else ''
+        print(f"退化: {issue['analyzer']}{where} {issue['metric']} "
+              f"{issue['baseline']:g} -> {issue['current']:g} ({issue['change'] * 100:+.1f}%)")
+    print(f"\n共 {len(regressions)} 项退化，{len(changes)} 项检出数变化")
+
+
+# ---------------------------------------------------------------------------
+# 命令行
+# ---------------------------------------------------------------------------
+
+def environment() -> Dict[str, Any]:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+    }
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    categories = args.categories.split(',')
+    scales = [float(s) for s in args.scales.split(',')]
+    analyzers = args.analyzers.split(',')
+    for name in categories:
+        if name not in CATEGORIES:
+            raise SystemExit(f"未知的类别: {name}（可选: {', '.join(CATEGORIES)}）")
+    for name in analyzers:
+        if name not in ANALYZERS:
+            raise SystemExit(f"未知的分析器: {name}（可选: {', '.join(ANALYZERS)}）")
+
+    report = {
+        'version': BASELINE_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'config': {'seed': args.seed, 'per_category': args.per_category, 'categories': categories,
+                   'scales': scales, 'repeat': args.repeat, 'warmup': args.warmup},
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='qr_bench_') as data_dir:
+        print(f"生成数据集（种子 {args.seed}，每类 {args.per_category} 张）...")
+        report['dataset'] = generate_dataset(data_dir, categories, args.per_category, args.seed)
+
+        # 每个分析器使用新的进程，峰值内存互不影响
+        context = mp.get_context('spawn')
+        for name in analyzers:
+            print(f"测量 {name} ...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                try:
+                    result = executor.submit(run_analyzer, name, data_dir, categories, scales,
+                                             args.repeat, args.warmup).result()
+                except Exception as e:
+                    print(f"  跳过 {name}: {e}")
+                    continue
+            report['results'][name] = result
+            for cell, data in result['cells'].items():
+                print(f"  {cell:<20} {data['throughput_ips']:>8.1f} 张/秒  P50 {data['p50_ms']:>8.2f}ms  "
+                      f"P95 {data['p95_ms']:>8.2f}ms  检出 {data['qr_codes']}/{data['images']}")
+            print(f"  峰值内存 {result['peak_rss_mb']}MB（加载图片后 {result['rss_before_mb']}MB）")
+
+    return report
+
+
+def load_report(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    if report.get('version') != BASELINE_VERSION:
+        raise SystemExit(f"不支持的基线版本: {path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='二维码分析器性能基准测试')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='运行基准测试并保存 JSON 结果')
+    run.add_argument('--output', default='benchmarks/baseline.json', help='结果保存路径')
+    run.add_argument('--analyzers', default=','.join(ANALYZERS), help='逗号分隔的分析器列表')
+    run.add_argument('--categories', default=','.join(CATEGORIES), help='逗号分隔的类别列表')
+    run.add_argument('--scales', default='0.5,1,2', help='逗号分隔的缩放倍数（相对生成的原图）')
+    run.add_argument('--per-category', type=int, default=4, help='每个类别生成的图片数')
+    run.add_argument('--seed', type=int, default=42, help='生成数据集的随机种子')
+    run.add_argument('--repeat', type=int, default=3, help='每组图片计时的轮数')
+    run.add_argument('--warmup', type=int, default=1, help='计时前预热的轮数')
+    run.add_argument('--baseline', help='运行后与该基线对比')
+
+    for command in (run, commands.add_parser('compare', help='对比两份基准测试结果')):
+        command.add_argument('--threshold', type=float, default=0.1, help='延迟/吞吐量退化阈值（比例）')
+        command.add_argument('--min-delta-ms', type=float, default=1.0, help='忽略小于该值的延迟变化（毫秒）')
+        command.add_argument('--rss-threshold', type=float, default=0.2, help='峰值内存退化阈值（比例）')
+        command.add_argument('--stage-threshold', type=float, help='单个阶段平均耗时的退化阈值，默认不检查')
+        if command is not run:
+            command.add_argument('baseline', help='基线 JSON')
+            command.add_argument('current', help='当前 JSON')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run_benchmark(args)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+        if not args.baseline:
+            return
+        baseline, current = load_report(args.baseline), report
+    else:
+        baseline, current = load_report(args.baseline), load_report(args.current)
+
+    issues = compare_results(baseline, current, args.threshold, args.min_delta_ms,
+                             args.rss_threshold, args.stage_threshold)
+    print_comparison(baseline, current, issues)
+    if any(issue['kind'] == 'regression' for issue in issues):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
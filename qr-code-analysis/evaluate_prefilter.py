@@ -0,0 +1,134 @@
+"""
+二维码预筛选效果评估
+
+在示例数据的各个类别上测量预筛选的漏检率，并用 QRCodeSampleGenerator 生成不含二维码的背景图
+（纯色、渐变、纹理、噪声照片）测量跳过率。
+
+漏检的判定标准：
+- 默认认为示例数据中的每张图片都含有二维码
+- 指定 --reference 时，只统计参考分析器能检测到二维码、却被预筛选跳过的图片
+
+运行: python evaluate_prefilter.py --reference basic --min-finders 1 --ratio-tolerance 0.5
+"""
+
+import argparse
+import glob
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+from qr_prefilter import QRPreFilter
+
+
+def generate_negatives(count_per_type: int, seed: int):
+    """生成不含二维码的背景图"""
+    from generate_sample_data import QRCodeSampleGenerator
+
+    random.seed(seed)
+    np.random.seed(seed)
+    sizes = [(640, 480), (800, 600), (1200, 900), (1920, 1080)]
+    negatives = []
+    for bg_type in ('solid', 'gradient', 'texture', 'photo'):
+        for _ in range(count_per_type):
+            width, height = random.choice(sizes)
+            bg = QRCodeSampleGenerator.create_background(width, height, bg_type)
+            negatives.append((bg_type, cv2.cvtColor(np.array(bg), cv2.COLOR_RGB2BGR)))
+    return negatives
+
+
+def create_reference(name: str):
+    if name == 'basic':
+        from qr_analyzer_basic import QRCodeAnalyzer
+        return QRCodeAnalyzer()
+    if name == 'ensemble':
+        from solution_8_ensemble.qr_analyzer_ensemble import QRCodeAnalyzerEnsemble
+        return QRCodeAnalyzerEnsemble(use_wechat_detector=False)
+    raise ValueError(f"未知的分析器: {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='二维码预筛选效果评估')
+    parser.add_argument('--data-dir', default='sample_data', help='示例数据目录（每个子目录一个类别）')
+    parser.add_argument('--negatives', type=int, default=10, help='每种背景生成的无二维码图片数')
+    parser.add_argument('--seed', type=int, default=42, help='生成背景图的随机种子')
+    parser.add_argument('--reference', choices=['basic', 'ensemble'], help='用于判定图片是否含有可检测二维码的分析器')
+    parser.add_argument('--thumbnail-size', type=int, default=800)
+    parser.add_argument('--ratio-tolerance', type=float, default=0.5)
+    parser.add_argument('--min-finders', type=int, default=1)
+    parser.add_argument('--min-hits', type=int, default=2)
+    parser.add_argument('--min-template-agreement', type=float, default=0.8)
+    parser.add_argument('--scan-step', type=int, default=2)
+    args = parser.parse_args()
+
+    prefilter = QRPreFilter(thumbnail_size=args.thumbnail_size, ratio_tolerance=args.ratio_tolerance,
+                            min_finders=args.min_finders, min_hits=args.min_hits,
+                            min_template_agreement=args.min_template_agreement, scan_step=args.scan_step)
+    reference = create_reference(args.reference) if args.reference else None
+
+    categories = sorted(d for d in os.listdir(args.data_dir) if os.path.isdir(os.path.join(args.data_dir, d)))
+    if not categories:
+        print(f"未找到示例数据: {args.data_dir}，请先运行 generate_sample_data.py")
+        return
+
+    print("=" * 72)
+    print(f"{'类别':<14}{'图片数':>8}{'含二维码':>10}{'漏检':>8}{'漏检率':>10}{'平均耗时':>12}")
+    print("-" * 72)
+    filter_time = 0.0
+    reference_time = 0.0
+    total_images = total_positive = total_missed = 0
+    for category in categories:
+        paths = sorted(glob.glob(os.path.join(args.data_dir, category, '*.jpg')))
+        positive = missed = 0
+        category_time = 0.0
+        for path in paths:
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            start = time.perf_counter()
+            passed = prefilter.contains_qr(image)
+            category_time += time.perf_counter() - start
+
+            if reference is not None:
+                start = time.perf_counter()
+                has_qr = bool(reference.analyze_array(image))
+                reference_time += time.perf_counter() - start
+            else:
+                has_qr = True
+            positive += has_qr
+            missed += has_qr and not passed
+
+        filter_time += category_time
+        total_images += len(paths)
+        total_positive += positive
+        total_missed += missed
+        rate = missed / positive * 100 if positive else 0.0
+        avg_ms = category_time / len(paths) * 1000 if paths else 0.0
+        print(f"{category:<16}{len(paths):>8}{positive:>10}{missed:>8}{rate:>9.1f}%{avg_ms:>10.1f}ms")
+
+    print("-" * 72)
+    rate = total_missed / total_positive * 100 if total_positive else 0.0
+    print(f"{'合计':<14}{total_images:>8}{total_positive:>10}{total_missed:>8}{rate:>9.1f}%"
+          f"{filter_time / max(total_images, 1) * 1000:>10.1f}ms")
+
+    negatives = generate_negatives(args.negatives, args.seed)
+    print("\n无二维码背景图的跳过率:")
+    skipped_by_type = {}
+    for bg_type, image in negatives:
+        skipped = skipped_by_type.setdefault(bg_type, [0, 0])
+        skipped[0] += not prefilter.contains_qr(image)
+        skipped[1] += 1
+    for bg_type, (skipped, count) in skipped_by_type.items():
+        print(f"  {bg_type:<10} {skipped}/{count} ({skipped / count * 100:.0f}%)")
+    total_skipped = sum(s for s, _ in skipped_by_type.values())
+    print(f"  合计       {total_skipped}/{len(negatives)} ({total_skipped / len(negatives) * 100:.0f}%)")
+
+    if reference is not None and total_images:
+        print(f"\n预筛选平均 {filter_time / total_images * 1000:.1f}ms/张，"
+              f"{args.reference} 分析器平均 {reference_time / total_images * 1000:.1f}ms/张")
+
+
+if __name__ == '__main__':
+    main()
@@ -69,10 +69,11 @@ class QRCodeSampleGenerator:
 
         return qr_img
 
-    def create_background(self, width: int, height: int,
-                         bg_type: str = "solid") -> Image.Image:
+    @staticmethod
+    def create_background(width: int, height: int,
+                          bg_type: str = "solid") -> Image.Image:
         """
-        创建背景图像
+        创建背景图像（不依赖生成器实例，也用于 evaluate_prefilter.py 生成无二维码的图片）
 
         Args:
             width: 宽度
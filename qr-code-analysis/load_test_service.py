@@ -0,0 +1,129 @@
+"""
+二维码分析服务压测脚本
+
+按固定速率（开环）发送请求，统计状态码分布和延迟分位数，用于验证服务在目标 RPS 下的 p99 延迟。
+
+运行: python load_test_service.py --url http://localhost:8080 --rps 50 --duration 30 --target-p99-ms 500
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+from collections import Counter
+from typing import List
+
+import aiohttp
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def send_one(session, url, name, data, results):
+    form = aiohttp.FormData()
+    form.add_field('file', data, filename=name, content_type='application/octet-stream')
+    start = time.perf_counter()
+    try:
+        async with session.post(url, data=form) as resp:
+            await resp.read()
+            status = resp.status
+    except asyncio.TimeoutError:
+        # ClientTimeout 到期时抛出的是 TimeoutError，不属于 ClientError
+        status = 'timeout'
+    except (aiohttp.ClientError, OSError) as e:
+        status = type(e).__name__
+    results.append((status, time.perf_counter() - start))
+
+
+async def run_load(url: str, images, rps: float, duration: float, concurrency_limit: int,
+                   timeout_s: float = 60):
+    results = []
+    total = int(rps * duration)
+    connector = aiohttp.TCPConnector(limit=concurrency_limit)
+    timeout = aiohttp.ClientTimeout(total=timeout_s)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        tasks = []
+        start = time.perf_counter()
+        for i in range(total):
+            # 开环发送：按计划时间发出请求，不等待前一个请求返回
+            delay = start + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name, data = images[i % len(images)]
+            tasks.append(asyncio.create_task(send_one(session, url, name, data, results)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def print_report(results, elapsed: float, target_p99_ms: float) -> bool:
+    statuses = Counter(status for status, _ in results)
+    latencies = [latency * 1000 for status, latency in results if status == 200]
+
+    print("\n" + "=" * 60)
+    print("压测结果")
+    print("=" * 60)
+    if not results:
+        print("没有发出任何请求，请增大 --rps 或 --duration（两者乘积至少为 1）")
+        return False
+    print(f"发送请求: {len(results)}，耗时 {elapsed:.1f}s，实际速率 {len(results) / max(elapsed, 1e-9):.1f} req/s")
+    for status, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+        print(f"  状态 {status}: {count} ({count / len(results) * 100:.1f}%)")
+
+    if not latencies:
+        print("没有成功的请求")
+        return False
+
+    p99 = percentile(latencies, 99)
+    print(f"\n成功请求延迟 (ms):")
+    print(f"  平均: {sum(latencies) / len(latencies):.1f}")
+    print(f"  p50:  {percentile(latencies, 50):.1f}")
+    print(f"  p95:  {percentile(latencies, 95):.1f}")
+    print(f"  p99:  {p99:.1f}")
+    print(f"  最大: {max(latencies):.1f}")
+
+    if target_p99_ms > 0:
+        passed = p99 <= target_p99_ms
+        print(f"\np99 目标 {target_p99_ms:.0f}ms: {'达标' if passed else '未达标'}")
+        return passed
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='二维码分析服务压测')
+    parser.add_argument('--url', default='http://localhost:8080', help='服务地址')
+    parser.add_argument('--images', default='sample_data/*/*.jpg', help='请求使用的图片（glob 模式）')
+    parser.add_argument('--rps', type=float, default=20, help='目标请求速率')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--connections', type=int, default=256, help='最大并发连接数')
+    parser.add_argument('--timeout', type=float, default=60, help='单个请求的超时时间（秒），超时记为 timeout')
+    parser.add_argument('--target-p99-ms', type=float, default=0, help='p99 延迟目标，未达标时返回非零退出码')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images))
+    if not paths:
+        print(f"未找到图片: {args.images}，请先运行 generate_sample_data.py")
+        sys.exit(1)
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((os.path.basename(path), f.read()))
+
+    url = args.url.rstrip('/') + '/api/v1/analyze/qr'
+    print(f"压测 {url}: {args.rps:g} req/s，持续 {args.duration:g}s，使用 {len(images)} 张图片")
+    results, elapsed = asyncio.run(run_load(url, images, args.rps, args.duration, args.connections,
+                                            args.timeout))
+    if not print_report(results, elapsed, args.target_p99_ms):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
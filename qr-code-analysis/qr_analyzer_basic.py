@@ -6,15 +6,32 @@
 import cv2
 from pyzbar import pyzbar
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 
+from qr_metrics import NULL_METRICS
+from qr_prefilter import match_finder_runs, order_corners, snap_module_count
+
 
 class QRCodeAnalyzer:
     """二维码分析器 - 基础实现"""
 
-    def __init__(self):
-        """初始化分析器"""
+    def __init__(self, contrast_mode: str = 'region', metrics=None):
+        """
+        初始化分析器
+
+        Args:
+            contrast_mode: 对比度计算方式
+                'region'  - 二维码区域与周围背景的整体均值（灰度、RGB、HSV）
+                'modules' - 按模块网格只采样模块中心和静区，得到符号对比度；
+                            无法建立模块网格时退回 'region'
+            metrics: 分阶段计时与计数（见 qr_metrics.py），为None时不记录
+        """
+        if contrast_mode not in ('region', 'modules'):
+            raise ValueError(f"不支持的对比度计算方式: {contrast_mode}")
+        self.contrast_mode = contrast_mode
+        self.metrics = metrics or NULL_METRICS
+
         # 清晰度分类阈值
         self.clarity_thresholds = {
             'clear': 500,           # 清晰
@@ -25,6 +42,9 @@ class QRCodeAnalyzer:
         # 颜色对比度阈值
         self.contrast_threshold = 50
 
+        # 符号对比度（百分比）分级下限，参考 ISO/IEC 15415 的 A~D 级
+        self.symbol_contrast_grades = [(70, 'A'), (55, 'B'), (40, 'C'), (20, 'D')]
+
     def analyze_image(self, image_path: str) -> List[Dict[str, Any]]:
         """
         分析图片中的二维码
@@ -36,24 +56,64 @@ class QRCodeAnalyzer:
             分析结果列表，每个二维码一个字典
         """
         # 读取图像
-        image = cv2.imread(image_path)
+        with self.metrics.timer('decode'):
+            image = cv2.imread(image_path)
         if image is None:
             raise ValueError(f"无法读取图片: {image_path}")
 
-        # 转换为灰度图
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return self.analyze_array(image, source=image_path)
+
+    def analyze_bytes(self, data) -> List[Dict[str, Any]]:
+        """
+        分析内存中的图片数据（如上传的文件内容），不经过文件系统
+
+        Args:
+            data: 编码后的图片数据（bytes、bytearray 或 memoryview）
+
+        Returns:
+            分析结果列表，每个二维码一个字典
+        """
+        # np.frombuffer 直接引用原缓冲区，不复制数据
+        buffer = np.frombuffer(memoryview(data), dtype=np.uint8)
+        with self.metrics.timer('decode'):
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+        if image is None:
+            raise ValueError("无法解码图片数据")
 
-        # 检测并解码二维码
-        qr_codes = pyzbar.decode(gray)
+        return self.analyze_array(image)
 
-        if not qr_codes:
-            print(f"警告: 在图片 {image_path} 中未检测到二维码")
-            return []
+    def analyze_array(self, image: np.ndarray, source: str = "<内存图像>") -> List[Dict[str, Any]]:
+        """
+        分析已解码的图像
 
-        results = []
-        for qr in qr_codes:
-            result = self._analyze_single_qr(image, gray, qr)
-            results.append(result)
+        Args:
+            image: BGR 格式的图像数组
+            source: 图像来源，仅用于提示信息
+
+        Returns:
+            分析结果列表，每个二维码一个字典
+        """
+        metrics = self.metrics
+        metrics.count('images')
+        with metrics.timer('analyze'):
+            # 转换为灰度图
+            with metrics.timer('color_convert'):
+                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+            # 检测并解码二维码
+            with metrics.timer('detect.pyzbar'):
+                qr_codes = pyzbar.decode(gray)
+
+            if not qr_codes:
+                metrics.count('images_without_qr')
+                print(f"警告: 在图片 {source} 中未检测到二维码")
+                return []
+
+            metrics.count('qr_codes', len(qr_codes))
+            results = []
+            for qr in qr_codes:
+                result = self._analyze_single_qr(image, gray, qr)
+                results.append(result)
 
         return results
 
@@ -74,10 +134,16 @@ class QRCodeAnalyzer:
         area_info = self._calculate_area_ratio(image, qr)
 
         # 2. 评估清晰度
-        clarity_info = self._assess_clarity(gray, qr)
+        with self.metrics.timer('clarity'):
+            clarity_info = self._assess_clarity(gray, qr)
 
         # 3. 分析颜色对比度
-        contrast_info = self._assess_color_contrast(image, gray, qr)
+        with self.metrics.timer('contrast'):
+            contrast_info = None
+            if self.contrast_mode == 'modules':
+                contrast_info = self._assess_module_contrast(gray, qr)
+            if contrast_info is None:
+                contrast_info = self._assess_color_contrast(image, gray, qr)
 
         # 合并结果
         result = {
@@ -232,32 +298,206 @@ class QRCodeAnalyzer:
             "contrast_score": round(contrast_score, 2),
             "gray_contrast": round(gray_contrast, 2),
             "rgb_contrast": round(rgb_contrast, 2),
-            "hsv_contrast": round(hsv_contrast, 2)
+            "hsv_contrast": round(hsv_contrast, 2),
+            "contrast_mode": "region"
         }
 
-    def batch_analyze(self, image_paths: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    @staticmethod
+    def _sample(gray: np.ndarray, points: np.ndarray) -> np.ndarray:
+        """按浮点坐标双线性采样灰度值，只读取给定的点，图像外的点丢弃"""
+        points = points.reshape(-1, 2).astype(np.float32)
+        inside = ((points[:, 0] >= 0) & (points[:, 0] <= gray.shape[1] - 1) &
+                  (points[:, 1] >= 0) & (points[:, 1] <= gray.shape[0] - 1))
+        points = points[inside].reshape(1, -1, 2)
+        if points.size == 0:
+            return np.empty(0, dtype=np.float32)
+        values = cv2.remap(gray, points[..., 0], points[..., 1], cv2.INTER_LINEAR)
+        return values.ravel().astype(np.float32)
+
+    def _estimate_modules(self, gray: np.ndarray, corners: np.ndarray) -> Optional[int]:
+        """
+        沿两条对角线估计模块数
+
+        对角线从有定位图案的角穿过定位图案中心，起点处的前五段游程满足 1:1:3:1:1，
+        五段合计为7个模块。三个有定位图案的角各给出一个估计，取中位数后对齐到 21 + 4k
+        """
+        side = max(np.linalg.norm(corners - np.roll(corners, 1, axis=0), axis=1))
+        steps = int(side * 1.5) + 2
+        t = np.linspace(0, 1, steps, dtype=np.float32)[:, None]
+
+        estimates = []
+        for i in range(4):
+            start, end = corners[i], corners[(i + 2) % 4]
+            # 只需要对角线靠近起点的一半
+            values = self._sample(gray, start + (end - start) * t[:steps // 2])
+            if values.size < steps // 2:
+                continue
+            dark = values < (values.min() + values.max()) / 2
+            edges = np.flatnonzero(np.diff(dark.astype(np.int8))) + 1
+            runs = np.diff(np.concatenate(([0], edges)))
+            # 角点落在静区边缘时，开头会有一小段浅色
+            if not dark[0]:
+                runs = runs[1:]
+            if len(runs) < 5:
+                continue
+            matched, module = match_finder_runs(runs[:5], 0.5)
+            if matched[0]:
+                estimates.append(steps / module[0])
+
+        if len(estimates) < 2:
+            return None
+        return snap_module_count(float(np.median(estimates)))
+
+    def _assess_module_contrast(self, gray: np.ndarray, qr: pyzbar.Decoded) -> Optional[Dict[str, Any]]:
+        """
+        按模块网格评估符号对比度
+
+        由 pyzbar 给出的四个角点和估计的模块数建立模块网格，只采样每个模块中心
+        以及静区（二维码外第2、3圈模块）的灰度，不做整块区域的颜色空间转换。
+        以采样值的中点为全局阈值区分深色/浅色模块，符号对比度为最亮与最暗反射率之差。
+
+        Returns:
+            包含对比度信息的字典；没有四个角点或无法估计模块数时返回 None
+        """
+        if len(qr.polygon) != 4:
+            return None
+        corners = order_corners([(p[0], p[1]) for p in qr.polygon])
+
+        estimate = self._estimate_modules(gray, corners)
+        if estimate is None:
+            return None
+
+        def sample_grid(modules):
+            # 模块坐标系（左上角为0，每个模块边长为1）到图像坐标的透视变换
+            grid = np.float32([[0, 0], [modules, 0], [modules, modules], [0, modules]])
+            matrix = cv2.getPerspectiveTransform(grid, corners)
+            centers = np.arange(modules, dtype=np.float32) + 0.5
+            points = np.stack(np.meshgrid(centers, centers), axis=-1).reshape(-1, 1, 2)
+            return matrix, self._sample(gray, cv2.perspectiveTransform(points, matrix))
+
+        # 模糊时对角线估计可能差一个版本；网格对齐时模块中心的采样值离中间灰度最远
+        candidates = []
+        for modules in (estimate - 4, estimate, estimate + 4):
+            if modules < 21:
+                continue
+            matrix, values = sample_grid(modules)
+            if values.size:
+                separation = np.abs(values - (values.min() + values.max()) / 2).mean()
+                candidates.append((separation, modules, matrix, values))
+        if not candidates:
+            return None
+        _, modules, matrix, module_values = max(candidates, key=lambda c: c[0])
+
+        # 静区：紧贴二维码的第一圈容易受模糊影响，采样第2、3圈
+        ring = []
+        for offset in (1.5, 2.5):
+            line = np.arange(-offset, modules + offset, dtype=np.float32)
+            low, high = np.full_like(line, -offset), np.full_like(line, modules + offset)
+            ring += [np.stack([line, low], axis=1), np.stack([line, high], axis=1),
+                     np.stack([low, line], axis=1), np.stack([high, line], axis=1)]
+        quiet_values = self._sample(gray, cv2.perspectiveTransform(np.concatenate(ring).reshape(-1, 1, 2), matrix))
+
+        all_values = np.concatenate([module_values, quiet_values])
+        threshold = (all_values.min() + all_values.max()) / 2
+        dark = module_values[module_values < threshold]
+        light = module_values[module_values >= threshold]
+        if dark.size == 0 or light.size == 0:
+            return None
+
+        dark_mean, light_mean = float(dark.mean()), float(light.mean())
+        quiet_mean = float(quiet_values.mean()) if quiet_values.size else None
+        symbol_contrast = float(all_values.max() - all_values.min()) / 255 * 100
+        grade = next((g for limit, g in self.symbol_contrast_grades if symbol_contrast >= limit), 'F')
+
+        # 与区域模式的阈值保持同一量纲：深浅模块的灰度均值之差
+        contrast_score = light_mean - dark_mean
+        has_good_contrast = bool(contrast_score > self.contrast_threshold)
+
+        return {
+            "color_contrast_class": "与背景颜色不相近" if has_good_contrast else "与背景颜色相近",
+            "has_good_contrast": has_good_contrast,
+            "contrast_score": round(contrast_score, 2),
+            "dark_module_mean": round(dark_mean, 2),
+            "light_module_mean": round(light_mean, 2),
+            "quiet_zone_mean": round(quiet_mean, 2) if quiet_mean is not None else None,
+            # 静区应当是浅色，偏深说明二维码紧贴深色背景或图案
+            "quiet_zone_ok": quiet_mean is not None and quiet_mean >= float(threshold),
+            "symbol_contrast": round(symbol_contrast, 2),
+            "symbol_contrast_grade": grade,
+            "qr_modules": modules,
+            "contrast_mode": "modules"
+        }
+
+    def batch_analyze(self, image_paths: List[str], workers: int = 1,
+                      prefilter=None) -> Dict[str, List[Dict[str, Any]]]:
         """
         批量分析多张图片
 
         Args:
             image_paths: 图片路径列表
+            workers: 进程数，大于1时由主进程解码图片，经共享内存交给子进程分析
+            prefilter: 预筛选器（见 qr_prefilter.py），判定不含二维码的图片直接返回空结果
 
         Returns:
             字典，键为图片路径，值为分析结果列表
         """
+        if workers > 1:
+            return self._parallel_batch_analyze(image_paths, workers, prefilter)
+
         results = {}
 
         for i, path in enumerate(image_paths, 1):
             print(f"处理 {i}/{len(image_paths)}: {path}")
             try:
-                result = self.analyze_image(path)
+                image = None
+                if prefilter is not None:
+                    with self.metrics.timer('decode'):
+                        image = cv2.imread(path)
+                if image is None:
+                    result = self.analyze_image(path)
+                else:
+                    with self.metrics.timer('prefilter'):
+                        passed = prefilter.contains_qr(image)
+                    if passed:
+                        result = self.analyze_array(image, source=path)
+                    else:
+                        # 预筛选未发现定位图案，跳过完整分析
+                        self.metrics.count('prefilter_skipped')
+                        result = []
                 results[path] = result
             except Exception as e:
+                self.metrics.count('errors')
                 print(f"错误: 处理 {path} 时出错 - {str(e)}")
                 results[path] = {"error": str(e)}
 
         return results
 
+    def _parallel_batch_analyze(self, image_paths: List[str], workers: int,
+                                prefilter=None) -> Dict[str, List[Dict[str, Any]]]:
+        from shared_frames import AnalyzerSpec, parallel_analyze, read_frames
+
+        spec = AnalyzerSpec(
+            type(self).__module__, type(self).__name__,
+            kwargs={'contrast_mode': self.contrast_mode},
+            attrs={'clarity_thresholds': self.clarity_thresholds, 'contrast_threshold': self.contrast_threshold,
+                   'symbol_contrast_grades': self.symbol_contrast_grades},
+            key_arg='source',
+            metrics=self.metrics.enabled,
+        )
+        outputs = parallel_analyze(spec, read_frames(image_paths, self.metrics), workers, prefilter=prefilter,
+                                   progress=lambda i, path: print(f"处理 {i}/{len(image_paths)}: {path}"),
+                                   metrics=self.metrics)
+
+        results = {}
+        for path, result, error in outputs:
+            if error is not None:
+                self.metrics.count('errors')
+                print(f"错误: 处理 {path} 时出错 - {str(error)}")
+                results[path] = {"error": str(error)}
+            else:
+                results[path] = result
+        return results
+
     def save_results(self, results: Dict[str, Any], output_path: str):
         """
         保存分析结果到JSON文件
@@ -266,7 +506,7 @@ class QRCodeAnalyzer:
             results: 分析结果
             output_path: 输出文件路径
         """
-        with open(output_path, 'w', encoding='utf-8') as f:
+        with self.metrics.timer('serialize'), open(output_path, 'w', encoding='utf-8') as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
 
         print(f"结果已保存到: {output_path}")
@@ -0,0 +1,197 @@
+"""
+二维码智能分析系统 - 分阶段计时与指标导出
+
+分析器的各个阶段（解码、颜色转换、各检测器、融合、清晰度、对比度、序列化）用计时器包起来：
+
+    metrics = Metrics()
+    analyzer = QRCodeAnalyzerEnsemble(metrics=metrics)
+    analyzer.batch_analyze(paths)
+    print(metrics.to_prometheus())        # Prometheus 文本格式
+    json.dumps(metrics.summary())         # 每个阶段的次数、总耗时、均值、分位数
+
+- 计时结果记录在固定分桶的直方图中，计数器记录图片数、二维码数、跳过数等
+- 分析器默认使用 NULL_METRICS：计时器是同一个空的上下文管理器，计数直接返回，
+  不取时间也不分配对象，关闭时几乎没有开销
+- snapshot()/merge() 用于把子进程中的指标汇总到主进程
+"""
+
+import bisect
+import re
+import time
+from typing import Any, Dict, Optional, Sequence
+
+
+# 默认分桶（秒）：覆盖亚毫秒级的单个检测器到秒级的整张大图
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """固定分桶的直方图，counts 比 buckets 多一项，最后一项为超过最大分桶的次数"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """按分桶估计分位数（取所在分桶的上界，超过最大分桶时取最大值）"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """分阶段计时器、计数器和直方图"""
+
+    def __init__(self, enabled: bool = True, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+
+    def _histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.buckets)
+        return histogram
+
+    def timer(self, stage: str):
+        """返回记录该阶段耗时的上下文管理器：with metrics.timer('detect.pyzbar'): ..."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self._histogram(stage))
+
+    def observe(self, stage: str, seconds: float):
+        """直接记录一次耗时（例如在别处测得的时间）"""
+        if self.enabled:
+            self._histogram(stage).observe(seconds)
+
+    def count(self, name: str, value: float = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        """可序列化的指标快照，reset=True 时取出后清空（子进程每批上报一次增量）"""
+        data = {
+            'counters': dict(self.counters),
+            'histograms': {name: {'buckets': list(h.buckets), 'counts': list(h.counts),
+                                  'count': h.count, 'sum': h.sum, 'max': h.max}
+                           for name, h in self.histograms.items()},
+        }
+        if reset:
+            self.reset()
+        return data
+
+    def merge(self, snapshot: Optional[Dict[str, Any]]):
+        """合并另一个 Metrics 的快照（分桶必须相同）"""
+        if not snapshot or not self.enabled:
+            return
+        for name, value in snapshot.get('counters', {}).items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, data in snapshot.get('histograms', {}).items():
+            histogram = self._histogram(name)
+            if list(histogram.buckets) != list(data['buckets']):
+                raise ValueError(f"直方图 {name} 的分桶不一致，无法合并")
+            histogram.counts = [a + b for a, b in zip(histogram.counts, data['counts'])]
+            histogram.count += data['count']
+            histogram.sum += data['sum']
+            histogram.max = max(histogram.max, data['max'])
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON 摘要：计数器，以及每个阶段的次数、总耗时、均值、P50/P95（毫秒）"""
+        stages = {}
+        for name in sorted(self.histograms):
+            h = self.histograms[name]
+            stages[name] = {
+                'count': h.count,
+                'total_ms': round(h.sum * 1000, 3),
+                'mean_ms': round(h.sum / h.count * 1000, 3) if h.count else 0.0,
+                'p50_ms': round(h.quantile(0.5) * 1000, 3),
+                'p95_ms': round(h.quantile(0.95) * 1000, 3),
+                'max_ms': round(h.max * 1000, 3),
+            }
+        return {'counters': dict(sorted(self.counters.items())), 'stages': stages}
+
+    def to_prometheus(self, namespace: str = 'qr') -> str:
+        """Prometheus 文本格式：阶段耗时为一个带 stage 标签的直方图，每个计数器为一个 counter"""
+        lines = []
+        if self.histograms:
+            name = f'{namespace}_stage_duration_seconds'
+            lines.append(f'# HELP {name} Time spent in each analysis stage.')
+            lines.append(f'# TYPE {name} histogram')
+            for stage in sorted(self.histograms):
+                h = self.histograms[stage]
+                label = _escape_label(stage)
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{label}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{label}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{stage="{label}"}} {h.sum:.9g}')
+                lines.append(f'{name}_count{{stage="{label}"}} {h.count}')
+        for counter in sorted(self.counters):
+            name = f'{namespace}_{_metric_name(counter)}_total'
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {self.counters[counter]:g}')
+        return '\n'.join(lines) + '\n'
+
+
+# 分析器的默认值：关闭状态，所有调用都是空操作
+NULL_METRICS = Metrics(enabled=False)
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,192 @@
+"""
+二维码智能分析系统 - 快速预筛选
+
+爬取的图片大多不含二维码，但每张都要经过完整的 pyzbar 解码或集成方案的多个检测器。
+预筛选在缩略图上扫描定位图案（finder pattern）的 1:1:3:1:1 黑白游程比例：
+- 逐行、逐列计算游程，用 numpy 整体匹配比例，不逐像素循环
+- 行方向和列方向的命中在同一位置交叉出现，且被多条相邻扫描线穿过，才算一个候选定位图案
+- 最后把候选区域按估计的模块大小重采样成 7x7，与定位图案模板比对，排除噪声纹理上的偶然命中
+- 候选数少于 min_finders 的图片判定为不含二维码，直接跳过
+
+游程比例匹配、角点排序和模块数取整也供 qr_analyzer_basic 与方案8估计模块数时使用。
+
+调大 ratio_tolerance、调小 min_finders 提高召回率，反之跳过更多图片。
+用 evaluate_prefilter.py 在示例数据上测量跳过率和漏检率。
+"""
+
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# 定位图案在一条扫描线上的游程比例：黑 白 黑 白 黑
+FINDER_RATIO = np.array([1, 1, 3, 1, 1], dtype=np.float32)
+
+# 定位图案的 7x7 模块模板（1 为深色）
+FINDER_TEMPLATE = np.ones((7, 7), dtype=np.uint8)
+FINDER_TEMPLATE[1:6, 1:6] = 0
+FINDER_TEMPLATE[2:5, 2:5] = 1
+
+
+def match_finder_runs(windows: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    判断连续五段游程是否符合定位图案的 1:1:3:1:1 比例
+
+    Args:
+        windows: 形状为 (n, 5) 的游程长度，每行从深色游程开始
+        tolerance: 每段游程相对期望长度允许的偏差比例
+
+    Returns:
+        (是否匹配, 估计的模块大小)
+    """
+    windows = np.asarray(windows, dtype=np.float32).reshape(-1, 5)
+    module = windows.sum(axis=1) / FINDER_RATIO.sum()
+    expected = module[:, None] * FINDER_RATIO
+    matched = np.all(np.abs(windows - expected) <= expected * tolerance, axis=1)
+    return matched, module
+
+
+def order_corners(points) -> np.ndarray:
+    """按绕中心的角度排列四个角点（从最靠近左上角的点开始），保证相邻的点是二维码相邻的角"""
+    pts = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    center = pts.mean(axis=0)
+    pts = pts[np.argsort(np.arctan2(pts[:, 1] - center[1], pts[:, 0] - center[0]))]
+    return np.roll(pts, -int(np.argmin(pts.sum(axis=1))), axis=0)
+
+
+def snap_module_count(count: float) -> int:
+    """把估计的每边模块数取整到合法的版本尺寸（21 + 4k，版本1到40）"""
+    version = int(round((count - 17) / 4))
+    return 17 + 4 * min(40, max(1, version))
+
+
+def scan_finder_runs(binary: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    在二值图的每一行中查找符合 1:1:3:1:1 比例的游程序列
+
+    Args:
+        binary: 二值图（1 为深色），每一行是一条扫描线
+        tolerance: 每段游程相对期望长度允许的偏差比例
+
+    Returns:
+        命中位置的 (行号, 中心列号, 模块大小)
+    """
+    height, width = binary.shape
+    # 每行开头强制作为新游程的起点，游程不会跨行
+    change = np.ones((height, width), dtype=bool)
+    change[:, 1:] = binary[:, 1:] != binary[:, :-1]
+    starts = np.flatnonzero(change)
+    if len(starts) < 5:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    lengths = np.diff(np.append(starts, binary.size)).astype(np.float32)
+    colors = binary.ravel()[starts]
+    rows = starts // width
+
+    n = len(starts) - 4
+    # 五段游程组成的窗口：lengths[i:i+5]
+    windows = np.stack([lengths[k:k + n] for k in range(5)], axis=1)
+    matched, module = match_finder_runs(windows, tolerance)
+    matched &= (colors[:n] == 1) & (rows[:n] == rows[4:4 + n]) & (module >= 1.0)
+
+    index = np.flatnonzero(matched)
+    centers = starts[index + 2] % width + (lengths[index + 2] // 2).astype(np.int64)
+    return rows[index], centers, module[index]
+
+
+class QRPreFilter:
+    """基于定位图案比例扫描的“是否可能含有二维码”判断"""
+
+    def __init__(self, thumbnail_size: int = 800, ratio_tolerance: float = 0.5,
+                 min_finders: int = 1, min_hits: int = 2, min_template_agreement: float = 0.8,
+                 scan_step: int = 2):
+        """
+        Args:
+            thumbnail_size: 缩略图最长边，原图更小时不缩放；模块在缩略图中小于约1像素的小二维码会被漏掉
+            ratio_tolerance: 游程比例允许的相对偏差，越大召回越高
+            min_finders: 至少需要的候选定位图案数（二维码有3个），越小召回越高
+            min_hits: 每个候选在行、列方向上各自至少需要的扫描线命中数，越小召回越高
+            min_template_agreement: 候选区域与 7x7 定位图案模板一致的模块比例下限，越小召回越高
+            scan_step: 扫描线间隔（像素），越大越快
+        """
+        self.thumbnail_size = thumbnail_size
+        self.ratio_tolerance = ratio_tolerance
+        self.min_finders = min_finders
+        self.min_hits = min_hits
+        self.min_template_agreement = min_template_agreement
+        self.scan_step = max(1, scan_step)
+        self.stats = {'checked': 0, 'skipped': 0}
+
+    def _binarize(self, image: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        h, w = gray.shape[:2]
+        scale = self.thumbnail_size / max(h, w)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))),
+                              interpolation=cv2.INTER_AREA)
+        _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        return binary
+
+    def _matches_template(self, binary: np.ndarray, cy: float, cx: float, module: float) -> bool:
+        """把候选中心周围 7x7 个模块的区域重采样，与定位图案模板比对"""
+        half = 3.5 * module
+        y0, y1 = int(round(cy - half)), int(round(cy + half))
+        x0, x1 = int(round(cx - half)), int(round(cx + half))
+        if y0 < 0 or x0 < 0 or y1 > binary.shape[0] or x1 > binary.shape[1] or y1 - y0 < 7 or x1 - x0 < 7:
+            return False
+        cells = cv2.resize(binary[y0:y1, x0:x1].astype(np.float32), (7, 7), interpolation=cv2.INTER_AREA)
+        agreement = np.mean((cells > 0.5) == FINDER_TEMPLATE)
+        return agreement >= self.min_template_agreement
+
+    def count_finders(self, image: np.ndarray) -> int:
+        """统计缩略图中的候选定位图案数"""
+        binary = self._binarize(image)
+        step = self.scan_step
+        hits_h = np.zeros(binary.shape, dtype=np.float32)
+        hits_v = np.zeros(binary.shape, dtype=np.float32)
+
+        # 命中位置记录估计的模块大小
+        rows, cols, modules = scan_finder_runs(binary[::step], self.ratio_tolerance)
+        hits_h[rows * step, cols] = modules
+        cols_t, rows_t, modules_t = scan_finder_runs(np.ascontiguousarray(binary.T[::step]), self.ratio_tolerance)
+        hits_v[rows_t, cols_t * step] = modules_t
+        if len(rows) == 0 or len(rows_t) == 0:
+            return 0
+
+        # 两个方向的命中中心允许相差几个像素
+        kernel = np.ones((2 * step + 3, 2 * step + 3), dtype=np.uint8)
+        both = cv2.dilate((hits_h > 0).astype(np.uint8), kernel) & cv2.dilate((hits_v > 0).astype(np.uint8), kernel)
+        count, labels = cv2.connectedComponents(both)
+        if count <= 1:
+            return 0
+
+        # 定位图案中心的 3x3 模块会被相邻的多条扫描线穿过，噪声纹理上的偶然命中通常是孤立的
+        in_h, in_v = hits_h > 0, hits_v > 0
+        votes_h = np.bincount(labels[in_h], minlength=count)
+        votes_v = np.bincount(labels[in_v], minlength=count)
+        candidates = np.flatnonzero((votes_h >= self.min_hits) & (votes_v >= self.min_hits))
+        candidates = candidates[candidates > 0]
+        if len(candidates) == 0:
+            return 0
+
+        # 每个候选的中心和模块大小取两个方向命中的平均值
+        ys, xs = np.nonzero(in_h | in_v)
+        point_labels = labels[ys, xs]
+        point_modules = np.maximum(hits_h[ys, xs], hits_v[ys, xs])
+        weights = np.bincount(point_labels, minlength=count)
+        cy = np.bincount(point_labels, ys, minlength=count) / np.maximum(weights, 1)
+        cx = np.bincount(point_labels, xs, minlength=count) / np.maximum(weights, 1)
+        module = np.bincount(point_labels, point_modules, minlength=count) / np.maximum(weights, 1)
+
+        return sum(self._matches_template(binary, cy[i], cx[i], module[i]) for i in candidates)
+
+    def contains_qr(self, image: Optional[np.ndarray]) -> bool:
+        """图像可能含有二维码时返回 True；无法判断（例如图像为空）时也返回 True，交给后续分析"""
+        if image is None or image.size == 0:
+            return True
+        self.stats['checked'] += 1
+        if self.count_finders(image) >= self.min_finders:
+            return True
+        self.stats['skipped'] += 1
+        return False
@@ -0,0 +1,479 @@
+"""
+二维码智能分析系统 - HTTP 分析服务
+
+按 qr_analysis_project/docs/08_API_Design.md 提供 POST /api/v1/analyze/qr 接口：
+- 请求在短时间窗口内合并成批，交给进程池中的分析器处理（YOLO 方案合并为一次批量推理）
+- 待处理队列满时直接返回 429，避免请求无限堆积
+- 启用 --metrics 时，分析进程中各阶段的耗时随每批结果传回，经 GET /metrics（Prometheus）
+  和 GET /metrics.json 查看
+
+运行: python qr_service.py --analyzer basic --workers 4 --port 8080
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+from aiohttp import web
+
+from qr_metrics import NULL_METRICS, Metrics
+
+
+# 清晰度分类与接口中的 level_code / class 对应
+CLARITY_LEVELS = {
+    '清晰': (1, 'Clear'),
+    '轻度模糊': (2, 'Mildly Blurred'),
+    '中度模糊': (3, 'Moderately Blurred'),
+    '重度模糊': (4, 'Severely Blurred'),
+}
+
+AREA_THRESHOLD = 0.05
+
+
+@dataclass
+class ServiceConfig:
+    """服务配置"""
+    analyzer: str = 'basic'         # basic / ensemble / yolo
+    workers: int = 4                # 分析进程数
+    batch_window_ms: float = 10.0   # 合并请求的时间窗口
+    max_batch_size: int = 16        # 单批最多图片数
+    max_queue: int = 64             # 待处理请求上限，超过返回 429
+    max_image_mb: float = 20.0      # 上传图片大小上限
+    shared_yolo: bool = False       # YOLO 模型由单独的推理进程持有，分析进程共享
+    prefilter: bool = False         # 先用定位图案预筛选，不含二维码的图片不做完整分析
+    metrics: bool = False           # 记录分阶段耗时，经 /metrics 导出
+
+
+class QueueFullError(Exception):
+    """待处理队列已满"""
+
+
+# ---------------------------------------------------------------------------
+# 分析进程
+# ---------------------------------------------------------------------------
+
+_worker_analyzer = None
+_worker_analyzer_name = None
+_worker_prefilter = None
+_worker_metrics = NULL_METRICS
+
+
+def create_analyzer(name: str, inference_client=None, metrics=None):
+    """按名称创建分析器，只在分析进程中导入对应依赖"""
+    if name == 'basic':
+        from qr_analyzer_basic import QRCodeAnalyzer
+        return QRCodeAnalyzer(metrics=metrics)
+    if name == 'ensemble':
+        from solution_8_ensemble.qr_analyzer_ensemble import QRCodeAnalyzerEnsemble
+        return QRCodeAnalyzerEnsemble(use_wechat_detector=False, metrics=metrics)
+    if name == 'yolo':
+        from solution_2_yolov8.qr_analyzer_yolov8 import QRCodeAnalyzerYOLOv8
+        return QRCodeAnalyzerYOLOv8(model_path=os.getenv('QR_YOLO_MODEL'), inference_client=inference_client,
+                                    metrics=metrics)
+    raise ValueError(f"未知的分析器: {name}")
+
+
+def init_worker(analyzer_name: str, inference_clients=None, client_ids=None, prefilter: bool = False,
+                metrics: bool = False):
+    """进程池初始化：每个进程只加载一次分析器；共享推理进程时各自领取一个客户端编号"""
+    global _worker_analyzer, _worker_analyzer_name, _worker_prefilter, _worker_metrics
+    inference_client = inference_clients[client_ids.get()] if inference_clients else None
+    _worker_metrics = Metrics() if metrics else NULL_METRICS
+    _worker_analyzer = create_analyzer(analyzer_name, inference_client, _worker_metrics)
+    _worker_analyzer_name = analyzer_name
+    if prefilter:
+        from qr_prefilter import QRPreFilter
+        _worker_prefilter = QRPreFilter()
+
+
+def measure_colors(image: np.ndarray, bbox: Dict[str, int]) -> Dict[str, Any]:
+    """
+    计算二维码前景色、背景色及两者的色差
+
+    前景取二维码区域内 Otsu 二值化后的深色像素，背景取二维码外围 20 像素的环形区域
+    """
+    h_img, w_img = image.shape[:2]
+    x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(w_img, x + w), min(h_img, y + h)
+    region = image[y1:y2, x1:x2]
+    if region.size == 0:
+        return {'contrast_delta_e': 0.0, 'dominant_color_fg': [0, 0, 0], 'dominant_color_bg': [0, 0, 0]}
+
+    gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    fg_mask = (binary == 0).astype(np.uint8)
+    if not fg_mask.any():
+        fg_mask[:] = 1
+    fg_bgr = cv2.mean(region, mask=fg_mask)[:3]
+
+    padding = 20
+    bx1, by1 = max(0, x1 - padding), max(0, y1 - padding)
+    bx2, by2 = min(w_img, x2 + padding), min(h_img, y2 + padding)
+    bg_region = image[by1:by2, bx1:bx2]
+    bg_mask = np.ones(bg_region.shape[:2], dtype=np.uint8)
+    bg_mask[y1 - by1:y2 - by1, x1 - bx1:x2 - bx1] = 0
+    if not bg_mask.any():
+        # 二维码占满整张图时没有外围区域，退回到二维码区域内的浅色像素
+        bg_region, bg_mask = region, (binary > 0).astype(np.uint8)
+    bg_bgr = cv2.mean(bg_region, mask=bg_mask)[:3]
+
+    # CIE76 色差：两种颜色在 Lab 空间中的欧氏距离
+    colors = np.array([[fg_bgr, bg_bgr]], dtype=np.float32) / 255.0
+    lab = cv2.cvtColor(colors, cv2.COLOR_BGR2LAB)[0]
+    delta_e = float(np.linalg.norm(lab[0] - lab[1]))
+
+    return {
+        'contrast_delta_e': round(delta_e, 2),
+        'dominant_color_fg': [int(round(c)) for c in fg_bgr[::-1]],
+        'dominant_color_bg': [int(round(c)) for c in bg_bgr[::-1]],
+    }
+
+
+def build_response(image: np.ndarray, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把分析器的结果转换为接口文档中的响应结构，主二维码取面积最大的一个"""
+    height, width = image.shape[:2]
+    body = {
+        'status': 'success',
+        'meta': {
+            'image_width': width,
+            'image_height': height,
+            'image_area': width * height,
+        },
+    }
+
+    if not results:
+        body['data'] = {'detected': False, 'message': 'No QR code detected in the image.'}
+        return body
+
+    primary = max(results, key=lambda r: r['bbox']['width'] * r['bbox']['height'])
+    bbox = primary['bbox']
+    x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+    area_pixels = w * h
+    area_ratio = area_pixels / (width * height)
+    passed = area_ratio > AREA_THRESHOLD
+    relation = '>' if passed else '<='
+    message = (f"QR code area is {'large enough' if passed else 'too small'} "
+               f"({area_ratio * 100:.2f}% {relation} {AREA_THRESHOLD * 100:g}%)")
+
+    level_code, clarity_class = CLARITY_LEVELS.get(primary.get('clarity_class'), (4, 'Severely Blurred'))
+    similar = not primary.get('has_good_contrast', False)
+
+    body['data'] = {
+        'detected': True,
+        'count': len(results),
+        'primary_qr': {
+            'content': primary.get('qr_data', ''),
+            'location': {
+                'polygon': [[x, y], [x + w, y], [x + w, y + h], [x, y + h]],
+                'area_pixels': area_pixels,
+                'area_ratio': round(area_ratio, 4),
+                'area_check': {
+                    'passed': passed,
+                    'threshold': AREA_THRESHOLD,
+                    'message': message,
+                },
+            },
+            'clarity': {
+                'score': round(float(primary.get('clarity_score', 0)), 2),
+                'class': clarity_class,
+                'level_code': level_code,
+            },
+            'color': {
+                'class': 'Low Contrast' if similar else 'High Contrast',
+                'is_similar_to_bg': similar,
+                **measure_colors(image, bbox),
+            },
+        },
+    }
+    return body
+
+
+def analyze_batch(items: List[bytes]) -> List[Dict[str, Any]]:
+    """
+    在分析进程中处理一批图片
+
+    Returns:
+        与输入顺序一致的列表，每项为 {'status': HTTP状态码, 'body': 响应内容}
+    """
+    metrics = _worker_metrics
+    outputs: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    images = []
+    indexes = []
+    for i, data in enumerate(items):
+        with metrics.timer('decode'):
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+        if image is None:
+            metrics.count('decode_errors')
+            outputs[i] = {'status': 400, 'body': {'status': 'error', 'message': 'Unable to decode image.'}}
+            continue
+        if _worker_prefilter is not None:
+            with metrics.timer('prefilter'):
+                passed = _worker_prefilter.contains_qr(image)
+            if not passed:
+                metrics.count('prefilter_skipped')
+                outputs[i] = {'status': 200, 'body': build_response(image, [])}
+                continue
+        images.append(image)
+        indexes.append(i)
+
+    if _worker_analyzer_name == 'yolo' and images:
+        # YOLO 一次推理处理整批图片
+        try:
+            batch_results = _worker_analyzer.analyze_arrays(images)
+        except Exception as e:
+            batch_results = [e] * len(images)
+    else:
+        batch_results = []
+        for image in images:
+            try:
+                batch_results.append(_worker_analyzer.analyze_array(image))
+            except Exception as e:
+                batch_results.append(e)
+
+    for i, image, results in zip(indexes, images, batch_results):
+        if isinstance(results, Exception):
+            metrics.count('errors')
+            outputs[i] = {'status': 500, 'body': {'status': 'error', 'message': str(results)}}
+        else:
+            with metrics.timer('build_response'):
+                outputs[i] = {'status': 200, 'body': build_response(image, results)}
+    return outputs
+
+
+def analyze_batch_with_metrics(items: List[bytes]):
+    """analyze_batch 的计时版本：返回 (结果列表, 本批在分析进程中记录的指标快照)"""
+    outputs = analyze_batch(items)
+    return outputs, _worker_metrics.snapshot(reset=True)
+
+
+# ---------------------------------------------------------------------------
+# 请求合并
+# ---------------------------------------------------------------------------
+
+class BatchingAnalyzer:
+    """
+    把并发请求合并成批交给执行器，执行器全部繁忙时请求在有界队列中等待
+
+    config.metrics 为 True 时 batch_fn 需返回 (结果列表, 指标快照)，快照合并到 self.metrics
+    """
+
+    def __init__(self, config: ServiceConfig, executor=None,
+                 batch_fn: Optional[Callable[[List[bytes]], Any]] = None):
+        self.config = config
+        self.inference_server = None
+        self.metrics = Metrics(enabled=config.metrics)
+        initargs = (config.analyzer, None, None, config.prefilter, config.metrics)
+        if executor is None and config.analyzer == 'yolo' and config.shared_yolo:
+            from solution_2_yolov8.yolo_inference_server import YOLOInferenceServer
+            self.inference_server = YOLOInferenceServer(
+                model_path=os.getenv('QR_YOLO_MODEL'), num_clients=config.workers,
+                slots_per_client=config.max_batch_size, max_batch_size=config.max_batch_size * config.workers)
+            client_ids = mp.Queue()
+            for i in range(config.workers):
+                client_ids.put(i)
+            initargs = (config.analyzer, self.inference_server.clients(), client_ids, config.prefilter,
+                        config.metrics)
+        self.executor = executor or ProcessPoolExecutor(
+            max_workers=config.workers, initializer=init_worker, initargs=initargs)
+        self.batch_fn = batch_fn or (analyze_batch_with_metrics if config.metrics else analyze_batch)
+        self.queue: Optional[asyncio.Queue] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.tasks = set()
+        self.stats = {'requests': 0, 'rejected': 0, 'batches': 0, 'batched_items': 0}
+
+    async def start(self):
+        if self.inference_server is not None:
+            # 等待推理进程加载模型
+            await asyncio.get_running_loop().run_in_executor(None, self.inference_server.start)
+        self.queue = asyncio.Queue(maxsize=self.config.max_queue)
+        self.slots = asyncio.Semaphore(self.config.workers)
+        self.tasks.add(asyncio.create_task(self._collect()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.inference_server is not None:
+            self.inference_server.stop()
+
+    async def submit(self, data: bytes) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self.queue.put_nowait((data, future, loop.time()))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            raise QueueFullError()
+        self.stats['requests'] += 1
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        window = self.config.batch_window_ms / 1000
+        while True:
+            # 先拿到一个空闲执行槽位，再开始攒批：执行器繁忙时请求留在队列里，队列满则拒绝
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + window
+            while len(batch) < self.config.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._dispatch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            started = loop.time()
+            for _, _, enqueued in batch:
+                self.metrics.observe('queue_wait', started - enqueued)
+            outputs = await loop.run_in_executor(self.executor, self.batch_fn, [data for data, _, _ in batch])
+            self.metrics.observe('batch', loop.time() - started)
+            if self.config.metrics:
+                outputs, snapshot = outputs
+                self.metrics.merge(snapshot)
+            self.stats['batches'] += 1
+            self.stats['batched_items'] += len(batch)
+            for (_, future, _), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+
+# ---------------------------------------------------------------------------
+# HTTP 接口
+# ---------------------------------------------------------------------------
+
+BATCHER_KEY = web.AppKey('batcher', BatchingAnalyzer)
+
+
+def error_response(status: int, message: str, headers=None) -> web.Response:
+    return web.json_response({'status': 'error', 'message': message}, status=status, headers=headers)
+
+
+async def handle_analyze(request: web.Request) -> web.Response:
+    batcher = request.app[BATCHER_KEY]
+    if not request.content_type.startswith('multipart/'):
+        return error_response(400, 'Content-Type must be multipart/form-data.')
+
+    data = None
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == 'file':
+            data = await part.read()
+            break
+    if not data:
+        return error_response(400, "Missing form field 'file'.")
+
+    try:
+        output = await batcher.submit(data)
+    except QueueFullError:
+        return error_response(429, 'Server is busy, please retry later.', headers={'Retry-After': '1'})
+    except Exception as e:
+        return error_response(500, str(e))
+    with batcher.metrics.timer('serialize'):
+        return web.json_response(output['body'], status=output['status'])
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({'status': 'ok'})
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    batcher = request.app[BATCHER_KEY]
+    stats = dict(batcher.stats)
+    stats['queued'] = batcher.queue.qsize()
+    stats['avg_batch_size'] = round(stats['batched_items'] / stats['batches'], 2) if stats['batches'] else 0
+    return web.json_response(stats)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Prometheus 文本格式的分阶段耗时和计数"""
+    metrics = request.app[BATCHER_KEY].metrics
+    if not metrics.enabled:
+        return error_response(404, 'Metrics are disabled, start the service with --metrics.')
+    return web.Response(body=metrics.to_prometheus().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def handle_metrics_json(request: web.Request) -> web.Response:
+    """每个阶段的次数、总耗时、均值和分位数（毫秒）"""
+    metrics = request.app[BATCHER_KEY].metrics
+    if not metrics.enabled:
+        return error_response(404, 'Metrics are disabled, start the service with --metrics.')
+    return web.json_response(metrics.summary())
+
+
+def create_app(config: ServiceConfig, batcher: Optional[BatchingAnalyzer] = None) -> web.Application:
+    app = web.Application(client_max_size=int(config.max_image_mb * 1024 * 1024))
+    app[BATCHER_KEY] = batcher or BatchingAnalyzer(config)
+
+    async def on_startup(app):
+        await app[BATCHER_KEY].start()
+
+    async def on_cleanup(app):
+        await app[BATCHER_KEY].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post('/api/v1/analyze/qr', handle_analyze)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/stats', handle_stats)
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/metrics.json', handle_metrics_json)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='二维码分析 HTTP 服务')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=8080, help='监听端口')
+    parser.add_argument('--analyzer', choices=['basic', 'ensemble', 'yolo'], default='basic', help='使用的分析器')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='分析进程数')
+    parser.add_argument('--batch-window-ms', type=float, default=10.0, help='合并请求的时间窗口（毫秒）')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='单批最多图片数')
+    parser.add_argument('--max-queue', type=int, default=64, help='待处理请求上限，超过返回 429')
+    parser.add_argument('--shared-yolo', action='store_true',
+                        help='YOLO 模型只在一个推理进程中加载，各分析进程通过共享内存提交图像')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='先在缩略图上扫描定位图案，不含二维码的图片直接返回未检测到')
+    parser.add_argument('--metrics', action='store_true',
+                        help='记录各阶段耗时，经 /metrics（Prometheus）和 /metrics.json 导出')
+    args = parser.parse_args()
+
+    config = ServiceConfig(
+        analyzer=args.analyzer,
+        workers=args.workers,
+        batch_window_ms=args.batch_window_ms,
+        max_batch_size=args.max_batch_size,
+        max_queue=args.max_queue,
+        shared_yolo=args.shared_yolo,
+        prefilter=args.prefilter,
+        metrics=args.metrics,
+    )
+    print(f"启动二维码分析服务: http://{args.host}:{args.port}/api/v1/analyze/qr "
+          f"(分析器 {config.analyzer}, {config.workers} 个进程)")
+    web.run_app(create_app(config), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+二维码智能分析系统 - 共享内存图像传递
+
+多进程批量分析时，如果把解码后的图像直接提交给进程池，每张图像都要在主进程序列化、
+在子进程反序列化，几 MB 的数据被复制两次。这里改为：
+- 主进程把解码后的图像写入共享内存环形缓冲区的一个槽位
+- 提交给子进程的只有 (槽位, 共享内存名, 形状, 数据类型) 这样的小元组
+- 子进程直接在共享内存上构造 numpy 视图交给 analyze_array，不复制像素
+
+用法:
+    spec = AnalyzerSpec('qr_analyzer_basic', 'QRCodeAnalyzer', key_arg='source')
+    for key, results, error in parallel_analyze(spec, read_frames(paths), workers=4):
+        ...
+"""
+
+import importlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from qr_metrics import NULL_METRICS, Metrics
+
+
+# 默认槽位大小可容纳一张 1920x1080 的彩色图像，更大的图像会让对应槽位自动扩容
+DEFAULT_SLOT_BYTES = 1920 * 1080 * 3
+
+
+class FrameHandle(NamedTuple):
+    """传给子进程的图像句柄"""
+    slot: int
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class AnalyzerSpec(NamedTuple):
+    """子进程中创建分析器所需的信息（分析器本身可能无法序列化）"""
+    module: str
+    cls: str
+    kwargs: Dict[str, Any] = {}
+    attrs: Dict[str, Any] = {}        # 创建后覆盖的属性，例如自定义的阈值
+    key_arg: Optional[str] = None     # analyze_array 中用于传入图片来源的参数名
+    call_kwargs: Dict[str, Any] = {}  # 调用 analyze_array 时的其他参数
+    metrics: bool = False             # 子进程中的分析器记录分阶段指标，每张图像的增量随结果传回主进程
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """连接已有的共享内存，由创建者负责释放"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数；子进程与创建者共用同一个 resource_tracker，
+        # 重复登记不会导致提前回收，也不能在这里注销，否则创建者释放时会报错
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrameRing:
+    """主进程一侧的共享内存环形缓冲区，每个槽位同一时间只存放一张图像"""
+
+    def __init__(self, slots: int, slot_bytes: int = DEFAULT_SLOT_BYTES):
+        self.blocks = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(slots)]
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def write(self, slot: int, image: np.ndarray) -> FrameHandle:
+        """把图像写入槽位，槽位容量不足时换成更大的共享内存"""
+        if image.nbytes > self.blocks[slot].size:
+            self.blocks[slot].close()
+            self.blocks[slot].unlink()
+            self.blocks[slot] = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        block = self.blocks[slot]
+        view = np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)
+        view[...] = image
+        del view
+        return FrameHandle(slot, block.name, image.shape, image.dtype.str)
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+class SharedFrameReader:
+    """子进程一侧：按句柄连接共享内存并构造图像视图，连接按槽位缓存"""
+
+    def __init__(self):
+        self.attached: Dict[int, shared_memory.SharedMemory] = {}
+
+    def view(self, handle: FrameHandle) -> np.ndarray:
+        block = self.attached.get(handle.slot)
+        if block is None or block.name != handle.name:
+            # 槽位扩容后名称会变化，关闭旧的连接
+            if block is not None:
+                block.close()
+            block = attach_shared_memory(handle.name)
+            self.attached[handle.slot] = block
+        return np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=block.buf)
+
+
+def read_frames(image_paths: Iterable[str], metrics=None):
+    """逐张读取图片，生成 (路径, 图像) 序列；读取失败时图像为异常对象"""
+    metrics = metrics or NULL_METRICS
+    for path in image_paths:
+        with metrics.timer('decode'):
+            image = cv2.imread(path)
+        yield path, image if image is not None else ValueError(f"无法读取图像: {path}")
+
+
+_worker_analyzer = None
+_worker_spec: Optional[AnalyzerSpec] = None
+_worker_reader: Optional[SharedFrameReader] = None
+
+
+def create_from_spec(spec: AnalyzerSpec):
+    analyzer_cls = getattr(importlib.import_module(spec.module), spec.cls)
+    kwargs = dict(spec.kwargs, metrics=Metrics()) if spec.metrics else spec.kwargs
+    analyzer = analyzer_cls(**kwargs)
+    for name, value in spec.attrs.items():
+        setattr(analyzer, name, value)
+    return analyzer
+
+
+def _init_worker(spec: AnalyzerSpec):
+    global _worker_analyzer, _worker_spec, _worker_reader
+    _worker_analyzer = create_from_spec(spec)
+    _worker_spec = spec
+    _worker_reader = SharedFrameReader()
+
+
+def _analyze_frame(handle: FrameHandle, key: Any) -> Any:
+    image = _worker_reader.view(handle)
+    kwargs = dict(_worker_spec.call_kwargs)
+    if _worker_spec.key_arg:
+        kwargs[_worker_spec.key_arg] = key
+    try:
+        results = _worker_analyzer.analyze_array(image, **kwargs)
+        if _worker_spec.metrics:
+            return results, _worker_analyzer.metrics.snapshot(reset=True)
+        return results
+    finally:
+        # 不保留指向共享内存的引用，主进程随后会复用该槽位
+        del image
+
+
+def parallel_analyze(spec: AnalyzerSpec, frames: Iterable[Tuple[Any, Any]], workers: int,
+                     slots: Optional[int] = None, slot_bytes: int = DEFAULT_SLOT_BYTES,
+                     progress: Optional[Callable[[int, Any], None]] = None,
+                     prefilter=None, metrics=None) -> List[Tuple[Any, Any, Optional[Exception]]]:
+    """
+    用进程池并行分析多张图像，图像经共享内存传给子进程
+
+    Args:
+        spec: 子进程中创建分析器的信息
+        frames: (key, image) 序列，image 为解码后的数组；解码失败时可传入异常对象
+        workers: 进程数
+        slots: 共享内存槽位数，即同时在途的图像数上限，默认为进程数的两倍
+        slot_bytes: 每个槽位的初始大小
+        progress: 每完成一张图像时调用 progress(已完成数量, key)
+        prefilter: 预筛选器（见 qr_prefilter.py），在主进程中判定不含二维码的图像不提交给子进程，结果为空列表
+        metrics: 主进程的 Metrics；spec.metrics 为 True 时子进程的指标合并到这里
+
+    Returns:
+        与输入顺序一致的 (key, 分析结果, 异常) 列表
+    """
+    metrics = metrics or NULL_METRICS
+    ring = SharedFrameRing(slots or workers * 2, slot_bytes)
+    outputs: List[Optional[Tuple[Any, Any, Optional[Exception]]]] = []
+    completed = 0
+
+    def finish(future, index, key):
+        nonlocal completed
+        try:
+            result = future.result()
+            if spec.metrics:
+                result, snapshot = result
+                metrics.merge(snapshot)
+            outputs[index] = (key, result, None)
+        except Exception as e:
+            outputs[index] = (key, None, e)
+        completed += 1
+        if progress:
+            progress(completed, key)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(spec,)) as pool:
+            free = list(range(len(ring)))
+            pending = {}
+            for index, (key, image) in enumerate(frames):
+                outputs.append(None)
+                if not isinstance(image, np.ndarray):
+                    outputs[index] = (key, None, image if isinstance(image, Exception) else ValueError(f"无效图像: {key}"))
+                elif prefilter is not None:
+                    with metrics.timer('prefilter'):
+                        passed = prefilter.contains_qr(image)
+                    if not passed:
+                        metrics.count('prefilter_skipped')
+                        outputs[index] = (key, [], None)
+                if outputs[index] is not None:
+                    completed += 1
+                    if progress:
+                        progress(completed, key)
+                    continue
+
+                # 槽位用完时等待任意一张图像处理完成
+                while not free:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        slot, done_index, done_key = pending.pop(future)
+                        free.append(slot)
+                        finish(future, done_index, done_key)
+
+                slot = free.pop()
+                handle = ring.write(slot, np.ascontiguousarray(image))
+                pending[pool.submit(_analyze_frame, handle, key)] = (slot, index, key)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _, done_index, done_key = pending.pop(future)
+                    finish(future, done_index, done_key)
+    finally:
+        ring.close()
+
+    return outputs
@@ -14,22 +14,56 @@ if sys.platform == 'win32':
 
 import cv2
 import numpy as np
-from ultralytics import YOLO
 from pyzbar import pyzbar
 import os
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from qr_metrics import NULL_METRICS
+except ImportError:
+    # 在方案目录下直接运行时，项目根目录不在 sys.path 中
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from qr_metrics import NULL_METRICS
+
+
+@lru_cache(maxsize=64)
+def _spectrum_weights(rows: int, cols: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    rfft2 半边频谱上的 (总能量权重, 高频能量权重)，按尺寸缓存
+
+    实数输入的频谱共轭对称，半边频谱中除第0列（以及偶数宽度时的最后一列）外，每一列代表两列；
+    高频部分与在 fftshift 后的完整频谱上挖去中心半径 min(rows, cols)//4 的圆相同
+    """
+    fy = np.fft.fftfreq(rows, 1 / rows)[:, None]
+    fx = np.arange(cols // 2 + 1)[None, :]
+    multiplicity = np.full(cols // 2 + 1, 2, dtype=np.float32)
+    multiplicity[0] = 1
+    if cols % 2 == 0:
+        multiplicity[-1] = 1
+
+    radius = min(rows, cols) // 4
+    total = np.broadcast_to(multiplicity, (rows, cols // 2 + 1)).copy()
+    high = total * (fy ** 2 + fx ** 2 > radius ** 2)
+    total.flags.writeable = False
+    high.flags.writeable = False
+    return total, high
 
 
 class QRCodeAnalyzerYOLOv8:
     """基于YOLOv8的二维码分析器"""
 
-    def __init__(self, model_path: str = None, confidence_threshold: float = 0.5):
+    def __init__(self, model_path: str = None, confidence_threshold: float = 0.5,
+                 inference_client=None, metrics=None):
         """
         初始化分析器
 
         Args:
             model_path: YOLOv8模型路径，如果为None则使用预训练模型
             confidence_threshold: 检测置信度阈值
+            inference_client: 共享推理进程的客户端（见 yolo_inference_server.py），
+                传入时不在本进程加载模型
+            metrics: 分阶段计时与计数（见 qr_metrics.py），默认不记录
         """
         # 清晰度阈值
         self.clarity_thresholds = {
@@ -43,6 +77,18 @@ class QRCodeAnalyzerYOLOv8:
 
         # 置信度阈值
         self.confidence_threshold = confidence_threshold
+        self.model_path = model_path
+
+        # 分阶段指标：YOLO推理、pyzbar、清晰度、对比度分别计时
+        self.metrics = metrics or NULL_METRICS
+
+        # 使用共享推理进程时，本进程不导入 ultralytics，也不加载模型
+        self.inference_client = inference_client
+        if inference_client is not None:
+            self.model = None
+            return
+
+        from ultralytics import YOLO
 
         # 加载YOLOv8模型
         if model_path and os.path.exists(model_path):
@@ -63,31 +109,52 @@ class QRCodeAnalyzerYOLOv8:
         Returns:
             检测到的二维码边界框列表
         """
-        results = self.model(image, conf=self.confidence_threshold)
+        return self.detect_qr_with_yolo_batch([image])[0]
+
+    def detect_qr_with_yolo_batch(self, images: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """
+        一次推理调用检测多张图像中的二维码
+
+        Args:
+            images: 输入图像列表（BGR格式）
+
+        Returns:
+            与输入顺序一致的检测结果列表
+        """
+        if not images:
+            return []
 
+        with self.metrics.timer('detect.yolo'):
+            if self.inference_client is not None:
+                return self.inference_client.detect_batch(images)
+
+            results = self.model(images, conf=self.confidence_threshold)
+
+            return [self._parse_yolo_result(result) for result in results]
+
+    def _parse_yolo_result(self, result) -> List[Dict[str, Any]]:
+        """将单张图像的YOLO推理结果转换为检测框列表"""
         qr_detections = []
 
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # 获取边界框坐标
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                confidence = float(box.conf[0])
-                class_id = int(box.cls[0])
-
-                # 注意: 如果是自定义训练的模型，需要确保class_id对应二维码类别
-                # 预训练模型可能无法直接识别二维码，这里作为演示
-
-                qr_detections.append({
-                    'bbox': {
-                        'x': int(x1),
-                        'y': int(y1),
-                        'width': int(x2 - x1),
-                        'height': int(y2 - y1)
-                    },
-                    'confidence': confidence,
-                    'class_id': class_id
-                })
+        for box in result.boxes:
+            # 获取边界框坐标
+            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+            confidence = float(box.conf[0])
+            class_id = int(box.cls[0])
+
+            # 注意: 如果是自定义训练的模型，需要确保class_id对应二维码类别
+            # 预训练模型可能无法直接识别二维码，这里作为演示
+
+            qr_detections.append({
+                'bbox': {
+                    'x': int(x1),
+                    'y': int(y1),
+                    'width': int(x2 - x1),
+                    'height': int(y2 - y1)
+                },
+                'confidence': confidence,
+                'class_id': class_id
+            })
 
         return qr_detections
 
@@ -155,59 +222,125 @@ class QRCodeAnalyzerYOLOv8:
         Returns:
             清晰度信息字典
         """
-        x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+        return self.calculate_clarity_batch([(image, bbox)])[0]
 
-        # 确保坐标在有效范围内
-        h_img, w_img = image.shape[:2]
-        x1 = max(0, x)
-        y1 = max(0, y)
-        x2 = min(w_img, x + w)
-        y2 = min(h_img, y + h)
+    def calculate_clarity_batch(self, regions: List[Tuple[np.ndarray, Dict[str, int]]]) -> List[Dict[str, Any]]:
+        """
+        批量计算多个二维码区域的清晰度
 
-        # 提取二维码区域
-        qr_region = image[y1:y2, x1:x2]
+        一张图里有几十个二维码、或整批图像一起分析时，逐个区域调用 Laplacian、Sobel 和 fft2
+        的开销主要花在调用本身。这里：
+        - 所有区域四周补1像素镜像边界后纵向拼成一张图，Laplacian、Sobel 各调用一次，
+          再按区域汇总，结果与逐个区域计算相同
+        - 频域特征把区域镜像补齐到 cv2.getOptimalDFTSize 给出的尺寸，同尺寸的区域堆叠后做一次 rfft2，
+          高通掩码按尺寸缓存；补齐带来的高频能量占比偏差通常在几个百分点以内
 
-        if qr_region.size == 0:
-            return {
-                'clarity_score': 0,
-                'clarity_level': 3,
-                'clarity_class': '重度模糊',
-                'method': 'invalid_region'
-            }
+        Args:
+            regions: (图像, 边界框) 列表，可以来自不同的图像
 
-        # 转换为灰度图
-        if len(qr_region.shape) == 3:
-            gray = cv2.cvtColor(qr_region, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = qr_region
+        Returns:
+            与输入顺序一致的清晰度信息字典列表
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(regions)
+        grays, indexes = [], []
+
+        for i, (image, bbox) in enumerate(regions):
+            x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+
+            # 确保坐标在有效范围内
+            h_img, w_img = image.shape[:2]
+            x1 = max(0, x)
+            y1 = max(0, y)
+            x2 = min(w_img, x + w)
+            y2 = min(h_img, y + h)
+
+            # 提取二维码区域
+            qr_region = image[y1:y2, x1:x2]
+
+            if qr_region.size == 0:
+                results[i] = {
+                    'clarity_score': 0,
+                    'clarity_level': 3,
+                    'clarity_class': '重度模糊',
+                    'method': 'invalid_region'
+                }
+                continue
+
+            # 转换为灰度图
+            if len(qr_region.shape) == 3:
+                grays.append(cv2.cvtColor(qr_region, cv2.COLOR_BGR2GRAY))
+            else:
+                grays.append(qr_region)
+            indexes.append(i)
+
+        if grays:
+            laplacian_vars, sobel_means = self._gradient_features(grays)
+            high_freq_ratios = self._high_freq_ratios(grays)
+            for k, i in enumerate(indexes):
+                results[i] = self._classify_clarity(laplacian_vars[k], sobel_means[k], high_freq_ratios[k])
+
+        return results
+
+    @staticmethod
+    def _gradient_features(grays: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """所有区域拼成一张图计算 Laplacian 方差和 Sobel 梯度均值"""
+        heights = np.array([gray.shape[0] + 2 for gray in grays])
+        offsets = np.concatenate(([0], np.cumsum(heights)[:-1]))
+        width = max(gray.shape[1] for gray in grays) + 2
+
+        # 每个区域自带1像素的镜像边界，3x3 卷积核在区域边缘看到的与单独处理该区域时相同
+        canvas = np.zeros((int(heights.sum()), width), dtype=np.uint8)
+        valid = np.zeros(canvas.shape, dtype=np.float32)
+        for gray, top in zip(grays, offsets):
+            h, w = gray.shape
+            canvas[top:top + h + 2, :w + 2] = cv2.copyMakeBorder(gray, 1, 1, 1, 1, cv2.BORDER_REFLECT_101)
+            valid[top + 1:top + h + 1, 1:w + 1] = 1
+
+        counts = np.array([gray.size for gray in grays], dtype=np.float64)
+
+        def region_sums(values: np.ndarray) -> np.ndarray:
+            # 先按行求有效像素之和，再把每个区域的行加起来
+            row_sums = np.einsum('ij,ij->i', values, valid).astype(np.float64)
+            return np.add.reduceat(row_sums, offsets)
 
         # 方法1: Laplacian方差
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        laplacian_var = laplacian.var()
+        laplacian = cv2.Laplacian(canvas, cv2.CV_32F)
+        laplacian_mean = region_sums(laplacian) / counts
+        laplacian_vars = region_sums(laplacian * laplacian) / counts - laplacian_mean ** 2
 
         # 方法2: Sobel梯度
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        sobel_magnitude = np.sqrt(sobelx**2 + sobely**2)
-        sobel_mean = sobel_magnitude.mean()
-
-        # 方法3: 频域分析（高频能量）
-        f_transform = np.fft.fft2(gray)
-        f_shift = np.fft.fftshift(f_transform)
-        magnitude_spectrum = np.abs(f_shift)
-
-        # 计算高频能量占比
-        rows, cols = gray.shape
-        crow, ccol = rows // 2, cols // 2
-        mask = np.ones((rows, cols), dtype=np.uint8)
-        r = min(rows, cols) // 4
-        center = (crow, ccol)
-        cv2.circle(mask, center, r, 0, -1)
-
-        high_freq_energy = np.sum(magnitude_spectrum * mask)
-        total_energy = np.sum(magnitude_spectrum)
-        high_freq_ratio = high_freq_energy / (total_energy + 1e-6)
-
+        sobel_magnitude = cv2.magnitude(cv2.Sobel(canvas, cv2.CV_32F, 1, 0, ksize=3),
+                                        cv2.Sobel(canvas, cv2.CV_32F, 0, 1, ksize=3))
+        sobel_means = region_sums(sobel_magnitude) / counts
+
+        return np.maximum(laplacian_vars, 0), sobel_means
+
+    @staticmethod
+    def _high_freq_ratios(grays: List[np.ndarray]) -> np.ndarray:
+        """方法3: 频域分析（高频能量占比），按补齐后的尺寸分组批量做实数FFT"""
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for k, gray in enumerate(grays):
+            shape = (cv2.getOptimalDFTSize(gray.shape[0]), cv2.getOptimalDFTSize(gray.shape[1]))
+            groups.setdefault(shape, []).append(k)
+
+        ratios = np.empty(len(grays), dtype=np.float64)
+        for (rows, cols), members in groups.items():
+            # 镜像补齐：补零会在区域边缘引入阶跃，明显抬高高频能量
+            stack = np.empty((len(members), rows, cols), dtype=np.float32)
+            for j, k in enumerate(members):
+                h, w = grays[k].shape
+                stack[j] = cv2.copyMakeBorder(grays[k], 0, rows - h, 0, cols - w, cv2.BORDER_REFLECT)
+
+            magnitude_spectrum = np.abs(np.fft.rfft2(stack))
+            total_weights, high_weights = _spectrum_weights(rows, cols)
+            high_freq_energy = (magnitude_spectrum * high_weights).sum(axis=(1, 2), dtype=np.float64)
+            total_energy = (magnitude_spectrum * total_weights).sum(axis=(1, 2), dtype=np.float64)
+            ratios[members] = high_freq_energy / (total_energy + 1e-6)
+
+        return ratios
+
+    def _classify_clarity(self, laplacian_var: float, sobel_mean: float,
+                          high_freq_ratio: float) -> Dict[str, Any]:
         # 综合评分（加权平均）
         clarity_score = (
             laplacian_var * 0.5 +
@@ -333,38 +466,141 @@ class QRCodeAnalyzerYOLOv8:
             分析结果列表
         """
         # 读取图像
-        image = cv2.imread(image_path)
+        with self.metrics.timer('decode'):
+            image = cv2.imread(image_path)
 
         if image is None:
             print(f"错误: 无法读取图像 {image_path}")
             return []
 
+        return self.analyze_array(image, use_yolo=use_yolo, image_path=image_path)
+
+    def analyze_bytes(self, data, use_yolo: bool = True,
+                      image_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        分析内存中的图片数据，不经过文件系统
+
+        Args:
+            data: 编码后的图片数据（bytes、bytearray 或 memoryview）
+            use_yolo: 是否使用YOLO检测（True）或使用pyzbar（False）
+            image_path: 图片来源，仅用于填充结果字段
+
+        Returns:
+            分析结果列表
+        """
+        # np.frombuffer 直接引用原缓冲区，不复制数据
+        buffer = np.frombuffer(memoryview(data), dtype=np.uint8)
+        with self.metrics.timer('decode'):
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+
+        if image is None:
+            print("错误: 无法解码图片数据")
+            return []
+
+        return self.analyze_array(image, use_yolo=use_yolo, image_path=image_path)
+
+    def analyze_arrays(self, images: List[np.ndarray], use_yolo: bool = True,
+                       prefilter=None) -> List[List[Dict[str, Any]]]:
+        """
+        分析多张已解码的图像，YOLO检测合并为一次批量推理
+
+        Args:
+            images: BGR 格式的图像数组列表
+            use_yolo: 是否使用YOLO检测（True）或使用pyzbar（False）
+            prefilter: 预筛选器（见 qr_prefilter.py），判定不含二维码的图像不参与推理
+
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        outputs: List[List[Dict[str, Any]]] = [[] for _ in images]
+        if prefilter is None:
+            indexes = list(range(len(images)))
+        else:
+            with self.metrics.timer('prefilter'):
+                indexes = [i for i, image in enumerate(images) if prefilter.contains_qr(image)]
+            self.metrics.count('prefilter_skipped', len(images) - len(indexes))
+        kept = [images[i] for i in indexes]
+
+        if not use_yolo:
+            batch_results = [self.analyze_array(image, use_yolo=False) for image in kept]
+        else:
+            detections_list = self.detect_qr_with_yolo_batch(kept) if kept else []
+            # 整批图像的所有检测框一起计算清晰度
+            with self.metrics.timer('clarity'):
+                clarity_list = iter(self.calculate_clarity_batch(
+                    [(image, d['bbox']) for image, detections in zip(kept, detections_list) for d in detections]))
+            batch_results = [self.analyze_array(image, detections=detections,
+                                                clarity=[next(clarity_list) for _ in detections])
+                             for image, detections in zip(kept, detections_list)]
+
+        for i, results in zip(indexes, batch_results):
+            outputs[i] = results
+        return outputs
+
+    def analyze_array(self, image: np.ndarray, use_yolo: bool = True,
+                      image_path: Optional[str] = None,
+                      detections: Optional[List[Dict[str, Any]]] = None,
+                      clarity: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        分析已解码的图像
+
+        Args:
+            image: BGR 格式的图像数组
+            use_yolo: 是否使用YOLO检测（True）或使用pyzbar（False）
+            image_path: 图片来源，仅用于填充结果字段
+            detections: 已有的YOLO检测结果（批量推理时传入），为None时在此检测
+            clarity: 与 detections 一一对应的已算好的清晰度（批量计算时传入）
+
+        Returns:
+            分析结果列表
+        """
+        with self.metrics.timer('analyze'):
+            results = self._analyze_array(image, use_yolo, image_path, detections, clarity)
+        self.metrics.count('images')
+        self.metrics.count('qr_codes', len(results))
+        if not results:
+            self.metrics.count('images_without_qr')
+        return results
+
+    def _analyze_array(self, image: np.ndarray, use_yolo: bool, image_path: Optional[str],
+                       detections: Optional[List[Dict[str, Any]]],
+                       clarity: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        metrics = self.metrics
+
         # 检测二维码
-        if use_yolo:
+        if detections is not None:
+            detections = list(detections)
+        elif use_yolo:
             detections = self.detect_qr_with_yolo(image)
         else:
-            detections = self.detect_qr_with_pyzbar(image)
+            with metrics.timer('detect.pyzbar'):
+                detections = self.detect_qr_with_pyzbar(image)
 
         if not detections:
             # 如果YOLO没检测到，尝试用pyzbar
             if use_yolo:
                 print("YOLOv8未检测到二维码，尝试使用pyzbar...")
-                detections = self.detect_qr_with_pyzbar(image)
+                metrics.count('pyzbar_fallbacks')
+                with metrics.timer('detect.pyzbar'):
+                    detections = self.detect_qr_with_pyzbar(image)
+
+        # 所有检测框的清晰度一次批量计算
+        if clarity is None or len(clarity) != len(detections):
+            with metrics.timer('clarity'):
+                clarity = self.calculate_clarity_batch([(image, d['bbox']) for d in detections])
 
         # 分析每个检测到的二维码
         results = []
 
-        for detection in detections:
+        for detection, clarity_info in zip(detections, clarity):
             bbox = detection['bbox']
 
             # 计算面积占比
             area_info = self.calculate_area_ratio(bbox, image.shape)
 
-            # 计算清晰度
-            clarity_info = self.calculate_clarity(image, bbox)
-
             # 计算颜色对比度
-            contrast_info = self.calculate_color_contrast(image, bbox)
+            with metrics.timer('contrast'):
+                contrast_info = self.calculate_color_contrast(image, bbox)
 
             # 尝试解码二维码内容
             qr_data = detection.get('data', '')
@@ -372,8 +608,9 @@ class QRCodeAnalyzerYOLOv8:
                 # 如果没有数据，尝试用pyzbar解码该区域
                 x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
                 qr_region = image[y:y+h, x:x+w]
-                gray_region = cv2.cvtColor(qr_region, cv2.COLOR_BGR2GRAY)
-                decoded = pyzbar.decode(gray_region)
+                with metrics.timer('decode_region'):
+                    gray_region = cv2.cvtColor(qr_region, cv2.COLOR_BGR2GRAY)
+                    decoded = pyzbar.decode(gray_region)
                 if decoded:
                     qr_data = decoded[0].data.decode('utf-8', errors='ignore')
 
@@ -395,31 +632,78 @@ class QRCodeAnalyzerYOLOv8:
 
         return results
 
-    def batch_analyze(self, image_paths: List[str], use_yolo: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+    def batch_analyze(self, image_paths: List[str], use_yolo: bool = True,
+                      workers: int = 1, prefilter=None) -> Dict[str, List[Dict[str, Any]]]:
         """
         批量分析多张图像
 
         Args:
             image_paths: 图像路径列表
             use_yolo: 是否使用YOLO检测
+            workers: 进程数，大于1时由主进程解码图片，经共享内存（shared_frames.py）交给子进程分析；
+                每个子进程各自加载模型，需要共用一份模型时请使用 yolo_inference_server.py
+            prefilter: 预筛选器（见 qr_prefilter.py），判定不含二维码的图像直接返回空结果
 
         Returns:
             字典，键为图像路径，值为分析结果列表
         """
+        if workers > 1:
+            return self._parallel_batch_analyze(image_paths, use_yolo, workers, prefilter)
+
         results = {}
 
         for i, image_path in enumerate(image_paths, 1):
             print(f"分析第 {i}/{len(image_paths)} 张图片: {image_path}")
 
             try:
-                result = self.analyze_image(image_path, use_yolo=use_yolo)
+                image = None
+                if prefilter is not None:
+                    with self.metrics.timer('decode'):
+                        image = cv2.imread(image_path)
+                if image is None:
+                    result = self.analyze_image(image_path, use_yolo=use_yolo)
+                else:
+                    with self.metrics.timer('prefilter'):
+                        passed = prefilter.contains_qr(image)
+                    if passed:
+                        result = self.analyze_array(image, use_yolo=use_yolo, image_path=image_path)
+                    else:
+                        print("预筛选未发现二维码，跳过")
+                        self.metrics.count('prefilter_skipped')
+                        result = []
                 results[image_path] = result
             except Exception as e:
                 print(f"分析失败: {e}")
+                self.metrics.count('errors')
                 results[image_path] = []
 
         return results
 
+    def _parallel_batch_analyze(self, image_paths: List[str], use_yolo: bool, workers: int,
+                                prefilter=None) -> Dict[str, List[Dict[str, Any]]]:
+        from shared_frames import AnalyzerSpec, parallel_analyze, read_frames
+
+        spec = AnalyzerSpec(
+            type(self).__module__, type(self).__name__,
+            kwargs={'model_path': self.model_path, 'confidence_threshold': self.confidence_threshold},
+            attrs={'clarity_thresholds': self.clarity_thresholds, 'contrast_threshold': self.contrast_threshold},
+            key_arg='image_path',
+            call_kwargs={'use_yolo': use_yolo},
+            metrics=self.metrics.enabled,
+        )
+        outputs = parallel_analyze(spec, read_frames(image_paths, self.metrics), workers, prefilter=prefilter,
+                                   progress=lambda i, path: print(f"分析第 {i}/{len(image_paths)} 张图片: {path}"),
+                                   metrics=self.metrics)
+
+        results = {}
+        for image_path, result, error in outputs:
+            if error is not None:
+                print(f"分析失败: {error}")
+                self.metrics.count('errors')
+                result = []
+            results[image_path] = result
+        return results
+
     def visualize_results(self, image_path: str, results: List[Dict[str, Any]],
                          output_path: Optional[str] = None):
         """
@@ -0,0 +1,312 @@
+"""
+二维码智能分析系统 - 方案2: 共享YOLOv8推理服务进程
+
+多进程部署时，每个分析进程各自加载一份YOLO模型并逐张推理，内存占用随进程数线性增长。
+这里由一个独立进程持有模型：
+- 分析进程把图像写入预先分配的共享内存槽位，通过队列只传递槽位编号和图像尺寸
+- 推理进程把一段时间窗口内收到的请求合并成一批，一次推理后把检测框发回对应的分析进程
+- 分析进程只负责 pyzbar 解码和各项指标计算，不需要导入 ultralytics
+
+用法:
+    server = YOLOInferenceServer(model_path="best.pt", num_clients=4)
+    server.start()
+    # 在每个分析进程中
+    analyzer = QRCodeAnalyzerYOLOv8(inference_client=client)
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+try:
+    from shared_frames import attach_shared_memory
+except ImportError:
+    # 在方案目录下直接运行时，项目根目录不在 sys.path 中
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from shared_frames import attach_shared_memory
+
+
+def parse_boxes(result, scale: float) -> List[Dict[str, Any]]:
+    """把单张图像的YOLO结果转换为检测框列表，坐标按缩放比例还原到原图"""
+    detections = []
+    for box in result.boxes:
+        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy() / scale
+        detections.append({
+            'bbox': {
+                'x': int(x1),
+                'y': int(y1),
+                'width': int(x2 - x1),
+                'height': int(y2 - y1)
+            },
+            'confidence': float(box.conf[0]),
+            'class_id': int(box.cls[0])
+        })
+    return detections
+
+
+# 推理进程每隔 HEARTBEAT_INTERVAL 秒更新一次心跳，客户端超过 HEARTBEAT_TIMEOUT 秒未见更新即认为推理进程已退出
+HEARTBEAT_INTERVAL = 0.5
+HEARTBEAT_TIMEOUT = 5.0
+
+
+def load_yolo(model_path: Optional[str]):
+    from ultralytics import YOLO
+
+    return YOLO(model_path or 'yolov8n.pt')
+
+
+def _serve(model_path: Optional[str], confidence_threshold: float, slot_names: List[List[str]],
+           request_queue, response_queues, max_batch_size: int, batch_timeout: float, ready,
+           heartbeat, model_factory: Callable = load_yolo):
+    """推理进程主循环"""
+    stopped = threading.Event()
+
+    def beat():
+        # 单独的线程更新心跳，推理耗时较长时心跳也不会中断
+        while not stopped.is_set():
+            heartbeat.value = time.time()
+            stopped.wait(HEARTBEAT_INTERVAL)
+
+    threading.Thread(target=beat, daemon=True).start()
+    slots = []
+    try:
+        model = model_factory(model_path)
+        slots = [[attach_shared_memory(name) for name in names] for names in slot_names]
+        ready.set()
+        serve_batches(model, slots, request_queue, response_queues, max_batch_size, batch_timeout,
+                      confidence_threshold)
+    finally:
+        stopped.set()
+        heartbeat.value = 0.0
+        for client_slots in slots:
+            for shm in client_slots:
+                shm.close()
+
+
+def serve_batches(model, slots, request_queue, response_queues, max_batch_size: int, batch_timeout: float,
+                  confidence_threshold: float):
+    """合并请求、批量推理并把结果发回各客户端，收到 None 时返回"""
+    running = True
+    while running:
+        item = request_queue.get()
+        if item is None:
+            break
+        batch = [item]
+
+        # 在时间窗口内继续收集其他分析进程的请求
+        while len(batch) < max_batch_size:
+            try:
+                item = request_queue.get(timeout=batch_timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                running = False
+                break
+            batch.append(item)
+
+        images = []
+        try:
+            # 直接在共享内存上构造图像视图，分析进程在收到结果前不会改写该槽位
+            images = [np.ndarray(shape, dtype=np.uint8, buffer=slots[client_id][slot].buf)
+                      for client_id, _, slot, shape, _ in batch]
+            results = model(images, conf=confidence_threshold, verbose=False)
+            replies = [(request_id, parse_boxes(result, scale), None)
+                       for (_, request_id, _, _, scale), result in zip(batch, results)]
+        except Exception as e:
+            replies = [(request_id, None, str(e)) for _, request_id, _, _, _ in batch]
+        del images
+
+        for (client_id, _, _, _, _), reply in zip(batch, replies):
+            response_queues[client_id].put(reply)
+
+
+class YOLOInferenceClient:
+    """分析进程一侧的推理客户端，接口与 QRCodeAnalyzerYOLOv8.detect_qr_with_yolo_batch 一致"""
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, client_id: int, slot_names: List[str], imgsz: int, request_queue, response_queue,
+                 heartbeat=None, timeout: float = 60.0):
+        """
+        Args:
+            heartbeat: 推理进程的心跳时间戳（共享的 mp.Value），用于发现推理进程已退出
+            timeout: 等待一轮结果的最长时间（秒）
+        """
+        self.client_id = client_id
+        self.slot_names = slot_names
+        self.imgsz = imgsz
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.next_request_id = 0
+        self._slots = None
+
+    def server_alive(self) -> bool:
+        if self.heartbeat is None:
+            return True
+        return time.time() - self.heartbeat.value < HEARTBEAT_TIMEOUT
+
+    def _receive(self, deadline: float):
+        """等待一条结果；推理进程已退出或超过 deadline 时抛出 RuntimeError，不会无限阻塞"""
+        while True:
+            try:
+                return self.response_queue.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            if not self.server_alive():
+                raise RuntimeError("YOLO推理进程已退出")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"等待YOLO推理结果超时（{self.timeout:g}s）")
+
+    def __getstate__(self):
+        # 传给子进程时不携带已连接的共享内存，在子进程中首次使用时再连接
+        state = self.__dict__.copy()
+        state['_slots'] = None
+        return state
+
+    def _prepare(self, image: np.ndarray):
+        """把图像缩放到推理尺寸以内（YOLO内部也会缩放），返回缩放后的图像和比例"""
+        h, w = image.shape[:2]
+        scale = min(1.0, self.imgsz / max(h, w))
+        if scale < 1.0:
+            image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return np.ascontiguousarray(image), scale
+
+    def detect_batch(self, images: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """
+        发送多张图像到推理进程并等待检测结果
+
+        Args:
+            images: 输入图像列表（BGR格式）
+
+        Returns:
+            与输入顺序一致的检测结果列表
+        """
+        if self._slots is None:
+            self._slots = [attach_shared_memory(name) for name in self.slot_names]
+
+        outputs: List[Optional[List[Dict[str, Any]]]] = [None] * len(images)
+        # 每次最多占用全部槽位，收齐这一轮的结果后槽位才能复用
+        for start in range(0, len(images), len(self._slots)):
+            pending = {}
+            for slot, index in enumerate(range(start, min(start + len(self._slots), len(images)))):
+                image, scale = self._prepare(images[index])
+                view = np.ndarray(image.shape, dtype=np.uint8, buffer=self._slots[slot].buf)
+                view[:] = image
+                request_id = self.next_request_id
+                self.next_request_id += 1
+                pending[request_id] = index
+                self.request_queue.put((self.client_id, request_id, slot, image.shape, scale))
+
+            deadline = time.monotonic() + self.timeout
+            while pending:
+                request_id, detections, error = self._receive(deadline)
+                if request_id not in pending:
+                    continue
+                if error is not None:
+                    raise RuntimeError(f"推理进程出错: {error}")
+                outputs[pending.pop(request_id)] = detections
+
+        return outputs
+
+    def detect(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        return self.detect_batch([image])[0]
+
+
+class YOLOInferenceServer:
+    """持有YOLO模型的推理进程，为多个分析进程提供动态批量推理"""
+
+    def __init__(self, model_path: Optional[str] = None, confidence_threshold: float = 0.5,
+                 num_clients: int = 4, slots_per_client: int = 4, imgsz: int = 640,
+                 max_batch_size: int = 16, batch_timeout_ms: float = 5.0, request_timeout: float = 60.0,
+                 model_factory: Callable = load_yolo):
+        """
+        Args:
+            model_path: YOLOv8模型路径，为None时使用预训练模型
+            confidence_threshold: 检测置信度阈值
+            num_clients: 分析进程数，每个进程对应一个客户端
+            slots_per_client: 每个客户端的共享内存槽位数，即一次最多提交的图像数
+            imgsz: 推理尺寸，图像在客户端缩放到该尺寸以内再写入共享内存
+            max_batch_size: 单次推理的最大批大小
+            batch_timeout_ms: 收集批次的等待时间
+            request_timeout: 客户端等待一轮结果的最长时间（秒），超时抛出 RuntimeError
+            model_factory: 按 model_path 创建模型的函数（需可在子进程中导入），默认加载 YOLOv8
+        """
+        self.model_path = model_path
+        self.confidence_threshold = confidence_threshold
+        self.imgsz = imgsz
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout_ms / 1000
+        self.request_timeout = request_timeout
+        self.model_factory = model_factory
+
+        slot_bytes = imgsz * imgsz * 3
+        self._shared = [[shared_memory.SharedMemory(create=True, size=slot_bytes)
+                         for _ in range(slots_per_client)] for _ in range(num_clients)]
+        self.request_queue = mp.Queue()
+        self.response_queues = [mp.Queue() for _ in range(num_clients)]
+        self.heartbeat = mp.Value('d', 0.0, lock=False)
+        self.process = None
+
+    @property
+    def slot_names(self) -> List[List[str]]:
+        return [[shm.name for shm in client_slots] for client_slots in self._shared]
+
+    def start(self, timeout: float = 300):
+        """启动推理进程并等待模型加载完成"""
+        ready = mp.Event()
+        self.process = mp.Process(
+            target=_serve,
+            args=(self.model_path, self.confidence_threshold, self.slot_names, self.request_queue,
+                  self.response_queues, self.max_batch_size, self.batch_timeout, ready, self.heartbeat,
+                  self.model_factory),
+            daemon=True,
+        )
+        self.process.start()
+        deadline = time.monotonic() + timeout
+        while not ready.wait(0.5):
+            if not self.process.is_alive() or time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError("YOLO推理进程启动失败或超时")
+
+    def client(self, client_id: int) -> YOLOInferenceClient:
+        """获取指定编号的客户端，每个分析进程使用一个不同的编号"""
+        return YOLOInferenceClient(client_id, self.slot_names[client_id], self.imgsz,
+                                   self.request_queue, self.response_queues[client_id],
+                                   self.heartbeat, self.request_timeout)
+
+    def clients(self) -> List[YOLOInferenceClient]:
+        return [self.client(i) for i in range(len(self._shared))]
+
+    def stop(self):
+        """停止推理进程并释放共享内存"""
+        if self.process is not None:
+            self.request_queue.put(None)
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        for client_slots in self._shared:
+            for shm in client_slots:
+                shm.close()
+                shm.unlink()
+        self._shared = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -17,6 +17,15 @@ from pyzbar import pyzbar
 from typing import List, Dict, Any, Optional, Tuple
 import os
 
+try:
+    from qr_metrics import NULL_METRICS
+    from qr_prefilter import order_corners, scan_finder_runs, snap_module_count
+except ImportError:
+    # 在方案目录下直接运行时，项目根目录不在 sys.path 中
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from qr_metrics import NULL_METRICS
+    from qr_prefilter import order_corners, scan_finder_runs, snap_module_count
+
 
 class QRCodeAnalyzerEnsemble:
     """基于多模型集成的二维码分析器"""
@@ -26,7 +35,11 @@ class QRCodeAnalyzerEnsemble:
                  use_opencv_detector: bool = True,
                  use_wechat_detector: bool = True,
                  fusion_strategy: str = 'voting',
-                 min_votes: int = 2):
+                 min_votes: int = 2,
+                 contour_max_side: Optional[int] = 1024,
+                 use_canonical_patch: bool = True,
+                 canonical_module_px: int = 4,
+                 metrics=None):
         """
         初始化集成分析器
 
@@ -36,6 +49,10 @@ class QRCodeAnalyzerEnsemble:
             use_wechat_detector: 使用WeChat QRCode检测器
             fusion_strategy: 融合策略 ('voting', 'weighted', 'union', 'intersection')
             min_votes: 最小投票数（voting策略）
+            contour_max_side: 轮廓检测时图像缩放到的最长边，为None时使用原图
+            use_canonical_patch: 有角点时把二维码透视校正为标准图块，在图块上计算清晰度和对比度
+            canonical_module_px: 标准图块中每个模块的像素数
+            metrics: 分阶段计时与计数（见 qr_metrics.py），默认不记录
         """
         # 清晰度阈值
         self.clarity_thresholds = {
@@ -44,6 +61,13 @@ class QRCodeAnalyzerEnsemble:
             'medium_blur': 50
         }
 
+        # 标准图块上的清晰度阈值（按每模块4像素标定）：模糊半径约为0.2/0.3/0.5个模块时分别越过各级阈值
+        self.canonical_clarity_thresholds = {
+            'clear': 3000,
+            'slight_blur': 1000,
+            'medium_blur': 300
+        }
+
         # 对比度阈值
         self.contrast_threshold = 50
 
@@ -56,6 +80,16 @@ class QRCodeAnalyzerEnsemble:
         self.fusion_strategy = fusion_strategy
         self.min_votes = min_votes
 
+        # 轮廓检测的缩放尺寸
+        self.contour_max_side = contour_max_side
+
+        # 标准图块：每个模块固定像素数，指标计算量与二维码在图中的大小无关
+        self.use_canonical_patch = use_canonical_patch
+        self.canonical_module_px = canonical_module_px
+
+        # 分阶段指标：各检测器、融合、标准图块、清晰度、对比度分别计时
+        self.metrics = metrics or NULL_METRICS
+
         # 初始化检测器
         self.detectors = {}
 
@@ -98,13 +132,16 @@ class QRCodeAnalyzerEnsemble:
             detections = []
             for qr in qr_codes:
                 x, y, w, h = qr.rect
-                detections.append({
+                detection = {
                     'bbox': {'x': x, 'y': y, 'width': w, 'height': h},
                     'data': qr.data.decode('utf-8', errors='ignore'),
                     'type': qr.type,
                     'detector': 'pyzbar',
                     'confidence': 1.0
-                })
+                }
+                if len(qr.polygon) == 4:
+                    detection['points'] = [[p.x, p.y] for p in qr.polygon]
+                detections.append(detection)
 
             return detections
         except Exception as e:
@@ -179,6 +216,16 @@ class QRCodeAnalyzerEnsemble:
         try:
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
 
+            # 在缩小的图像上查找轮廓，检测框再按比例还原到原图
+            # 每次缩小一半：INTER_AREA 在整数倍缩放时有快速实现，任意比例缩放反而比后续步骤更慢
+            h, w = gray.shape[:2]
+            scale = 1.0
+            if self.contour_max_side:
+                while max(gray.shape[:2]) > self.contour_max_side:
+                    gray = self._halve(gray)
+                    scale /= 2
+            sx = sy = scale
+
             # 二值化
             _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
@@ -189,48 +236,63 @@ class QRCodeAnalyzerEnsemble:
             # 查找轮廓
             contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-            detections = []
+            # 先按面积（阈值按原图面积计）和长宽比筛选候选区域
+            candidates = []
             for contour in contours:
-                area = cv2.contourArea(contour)
-
-                # 过滤小面积
-                if area < 1000:
+                if cv2.contourArea(contour) < 1000 * sx * sy:
                     continue
+                x, y, bw, bh = cv2.boundingRect(contour)
+                if 0.7 < float(bw) / bh < 1.3:  # 近似正方形
+                    candidates.append((x, y, bw, bh))
+            if not candidates:
+                return []
+
+            # 在覆盖所有候选区域的范围内只做一次边缘检测，边缘图和二值图的积分图
+            # 使每个候选区域的验证都是常数时间，重叠或相邻的候选不会重复处理同一批像素
+            ux0 = min(x for x, _, _, _ in candidates)
+            uy0 = min(y for _, y, _, _ in candidates)
+            ux1 = max(x + bw for x, _, bw, _ in candidates)
+            uy1 = max(y + bh for _, y, _, bh in candidates)
+            edges = cv2.Canny(gray[uy0:uy1, ux0:ux1], 50, 150)
+            edge_integral = cv2.integral((edges > 0).astype(np.uint8))
+            black_integral = cv2.integral((binary[uy0:uy1, ux0:ux1] == 0).astype(np.uint8))
 
-                # 计算边界框
-                x, y, w, h = cv2.boundingRect(contour)
-
-                # 检查是否接近正方形（二维码特征）
-                aspect_ratio = float(w) / h
-                if 0.7 < aspect_ratio < 1.3:  # 近似正方形
-                    # 验证是否真的是二维码
-                    roi = gray[y:y+h, x:x+w]
-                    if self._validate_qr_region(roi):
-                        detections.append({
-                            'bbox': {'x': x, 'y': y, 'width': w, 'height': h},
-                            'data': '',
-                            'type': 'QRCODE',
-                            'detector': 'contour',
-                            'confidence': 0.7
-                        })
+            detections = []
+            for x, y, bw, bh in candidates:
+                # 验证是否真的是二维码
+                if self._validate_qr_region(edge_integral, black_integral, x - ux0, y - uy0, bw, bh):
+                    x0, y0 = int(x / sx), int(y / sy)
+                    x1, y1 = min(w, int(round((x + bw) / sx))), min(h, int(round((y + bh) / sy)))
+                    detections.append({
+                        'bbox': {'x': x0, 'y': y0, 'width': x1 - x0, 'height': y1 - y0},
+                        'data': '',
+                        'type': 'QRCODE',
+                        'detector': 'contour',
+                        'confidence': 0.7
+                    })
 
             return detections
         except Exception as e:
             print(f"轮廓检测失败: {e}")
             return []
 
-    def _validate_qr_region(self, roi: np.ndarray) -> bool:
+    @staticmethod
+    def _region_sum(integral: np.ndarray, x: int, y: int, w: int, h: int) -> int:
+        """用积分图求矩形区域内的像素和"""
+        return int(integral[y + h, x + w] - integral[y, x + w] - integral[y + h, x] + integral[y, x])
+
+    def _validate_qr_region(self, edge_integral: np.ndarray, black_integral: np.ndarray,
+                            x: int, y: int, w: int, h: int) -> bool:
         """验证区域是否可能是二维码"""
-        if roi.size == 0:
+        area = w * h
+        if area == 0:
             return False
 
         # 检查边缘密度（二维码边缘丰富）
-        edges = cv2.Canny(roi, 50, 150)
-        edge_density = np.count_nonzero(edges) / edges.size
+        edge_density = self._region_sum(edge_integral, x, y, w, h) / area
 
         # 检查颜色分布（二维码黑白分布较均匀）
-        _, binary = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        black_ratio = np.count_nonzero(binary == 0) / binary.size
+        black_ratio = self._region_sum(black_integral, x, y, w, h) / area
 
         # 二维码特征：边缘密度高，黑白比例接近
         return edge_density > 0.1 and 0.3 < black_ratio < 0.7
@@ -282,16 +344,17 @@ class QRCodeAnalyzerEnsemble:
         if not flat_detections:
             return []
 
-        if self.fusion_strategy == 'voting':
-            return self._fuse_by_voting(flat_detections)
-        elif self.fusion_strategy == 'weighted':
-            return self._fuse_by_weighted(flat_detections)
-        elif self.fusion_strategy == 'union':
-            return self._fuse_by_union(flat_detections)
-        elif self.fusion_strategy == 'intersection':
-            return self._fuse_by_intersection(flat_detections)
-        else:
-            return flat_detections
+        with self.metrics.timer(f'fusion.{self.fusion_strategy}'):
+            if self.fusion_strategy == 'voting':
+                return self._fuse_by_voting(flat_detections)
+            elif self.fusion_strategy == 'weighted':
+                return self._fuse_by_weighted(flat_detections)
+            elif self.fusion_strategy == 'union':
+                return self._fuse_by_union(flat_detections)
+            elif self.fusion_strategy == 'intersection':
+                return self._fuse_by_intersection(flat_detections)
+            else:
+                return flat_detections
 
     def _fuse_by_voting(self, detections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """投票融合策略"""
@@ -332,7 +395,8 @@ class QRCodeAnalyzerEnsemble:
                     'detectors': [d['detector'] for d in cluster],
                     'num_votes': len(cluster),
                     'confidence': sum(d.get('confidence', 0) for d in cluster) / len(cluster),
-                    'fusion_method': 'voting'
+                    'fusion_method': 'voting',
+                    'points': self._best_points(cluster)
                 })
 
         return fused_results
@@ -388,7 +452,8 @@ class QRCodeAnalyzerEnsemble:
                 'type': best_detection['type'],
                 'detectors': [d['detector'] for d in cluster],
                 'confidence': sum(d.get('confidence', 0) * weights.get(d['detector'], 0.5) for d in cluster) / total_weight,
-                'fusion_method': 'weighted'
+                'fusion_method': 'weighted',
+                'points': self._best_points(cluster)
             })
 
         return fused_results
@@ -457,11 +522,19 @@ class QRCodeAnalyzerEnsemble:
                     'type': best_detection['type'],
                     'detectors': list(unique_detectors),
                     'confidence': sum(d.get('confidence', 0) for d in cluster) / len(cluster),
-                    'fusion_method': 'intersection'
+                    'fusion_method': 'intersection',
+                    'points': self._best_points(cluster)
                 })
 
         return fused_results
 
+    def _best_points(self, cluster: List[Dict[str, Any]]) -> Optional[List[List[int]]]:
+        """取簇中置信度最高且带有角点的检测结果的角点"""
+        with_points = [d for d in cluster if d.get('points')]
+        if not with_points:
+            return None
+        return max(with_points, key=lambda d: d.get('confidence', 0))['points']
+
     def _average_bbox(self, bboxes: List[Dict[str, int]]) -> Dict[str, int]:
         """计算边界框的平均值"""
         avg_x = int(sum(b['x'] for b in bboxes) / len(bboxes))
@@ -471,6 +544,83 @@ class QRCodeAnalyzerEnsemble:
 
         return {'x': avg_x, 'y': avg_y, 'width': avg_w, 'height': avg_h}
 
+    @staticmethod
+    def _halve(image: np.ndarray) -> np.ndarray:
+        """
+        把图像缩小一半
+
+        INTER_AREA 只在精确的整数倍缩放时走快速实现，任意比例（包括奇数边长的“一半”）
+        会慢一个数量级，所以先裁掉奇数边多出的一行/一列
+        """
+        h, w = image.shape[:2]
+        image = image[:h - h % 2, :w - w % 2]
+        return cv2.resize(image, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def estimate_module_count(gray: np.ndarray) -> Optional[int]:
+        """
+        从校正后的二维码图块估计每边的模块数
+
+        用 qr_prefilter.scan_finder_runs 在所有行上查找定位图案的 1:1:3:1:1 黑白游程，
+        取角上命中的模块大小的中位数，再把 图块边长/模块大小 取整到合法的版本尺寸（21 + 4k）
+        """
+        _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        height, width = binary.shape
+        rows, centers, modules = scan_finder_runs(binary, 0.5)
+        # 定位图案位于角上，只统计两端各四分之一范围内的命中，排除数据区的偶然匹配
+        near_edge = lambda v, size: (v < size / 4) | (v > size * 3 / 4)
+        modules = modules[near_edge(rows, height) & near_edge(centers, width)]
+
+        if len(modules) == 0:
+            return None
+        return snap_module_count(gray.shape[1] / float(np.median(modules)))
+
+    def canonical_patch(self, image: np.ndarray, points) -> Tuple[np.ndarray, Dict[str, int], int]:
+        """
+        按角点把二维码透视校正为标准图块
+
+        图块中每个模块固定为 canonical_module_px 像素，四周保留4个模块宽的静区，
+        指标的计算量只取决于模块数，不同尺寸、旋转角度的二维码指标可以直接比较
+
+        Returns:
+            (图块, 图块中二维码区域的bbox, 模块数)
+        """
+        # 角点排序保证透视变换的四边形不自交
+        quad = order_corners(points)
+        side = float(max(np.linalg.norm(quad - np.roll(quad, 1, axis=0), axis=1)))
+
+        # 只处理二维码及周围静区所在的区域（版本1的4模块静区约为边长的20%）
+        x, y, w, h = cv2.boundingRect(quad.astype(np.int32))
+        pad = int(side * 0.2) + 2
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(image.shape[1], x + w + pad), min(image.shape[0], y + h + pad)
+        region = image[y0:y1, x0:x1]
+        quad = quad - np.float32([x0, y0])
+        # 先每次缩小一半（与轮廓检测相同），避免大图直接透视采样产生混叠，
+        # 剩余不超过2倍的缩放交给透视变换的插值
+        scale = 1.0
+        while side * scale > 512:
+            region = self._halve(region)
+            scale /= 2
+        quad = quad * scale
+
+        def warp(size: int, margin: int) -> np.ndarray:
+            dst = np.float32([[margin, margin], [margin + size, margin],
+                              [margin + size, margin + size], [margin, margin + size]])
+            matrix = cv2.getPerspectiveTransform(quad, dst)
+            return cv2.warpPerspective(region, matrix, (size + 2 * margin, size + 2 * margin),
+                                       flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+        # 在不带静区的预览图块上估计模块数，失败时按版本1处理
+        preview = warp(max(1, int(side * scale)), 0)
+        preview_gray = cv2.cvtColor(preview, cv2.COLOR_BGR2GRAY) if preview.ndim == 3 else preview
+        modules = self.estimate_module_count(preview_gray) or 21
+
+        size = modules * self.canonical_module_px
+        margin = 4 * self.canonical_module_px
+        patch = warp(size, margin)
+        return patch, {'x': margin, 'y': margin, 'width': size, 'height': size}, modules
+
     def calculate_area_ratio(self, bbox: Dict[str, int], image_shape: tuple) -> Dict[str, Any]:
         """计算二维码面积占比"""
         image_height, image_width = image_shape[:2]
@@ -486,8 +636,9 @@ class QRCodeAnalyzerEnsemble:
             'area_larger_than_5_percent': ratio > 5.0
         }
 
-    def calculate_clarity(self, image: np.ndarray, bbox: Dict[str, int]) -> Dict[str, Any]:
-        """计算清晰度"""
+    def calculate_clarity(self, image: np.ndarray, bbox: Dict[str, int],
+                          thresholds: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """计算清晰度，thresholds 默认为 clarity_thresholds"""
         x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
 
         h_img, w_img = image.shape[:2]
@@ -512,13 +663,14 @@ class QRCodeAnalyzerEnsemble:
         laplacian_var = laplacian.var()
 
         # 分类
-        if laplacian_var > self.clarity_thresholds['clear']:
+        thresholds = thresholds or self.clarity_thresholds
+        if laplacian_var > thresholds['clear']:
             clarity_level = 0
             clarity_class = '清晰'
-        elif laplacian_var > self.clarity_thresholds['slight_blur']:
+        elif laplacian_var > thresholds['slight_blur']:
             clarity_level = 1
             clarity_class = '轻度模糊'
-        elif laplacian_var > self.clarity_thresholds['medium_blur']:
+        elif laplacian_var > thresholds['medium_blur']:
             clarity_level = 2
             clarity_class = '中度模糊'
         else:
@@ -577,35 +729,69 @@ class QRCodeAnalyzerEnsemble:
 
     def analyze_image(self, image_path: str) -> List[Dict[str, Any]]:
         """分析图像中的二维码"""
-        image = cv2.imread(image_path)
+        with self.metrics.timer('decode'):
+            image = cv2.imread(image_path)
 
         if image is None:
             print(f"错误: 无法读取图像 {image_path}")
             return []
 
+        return self.analyze_array(image, image_path)
+
+    def analyze_bytes(self, data, image_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """分析内存中的图片数据（bytes、bytearray 或 memoryview），不经过文件系统"""
+        # np.frombuffer 直接引用原缓冲区，不复制数据
+        buffer = np.frombuffer(memoryview(data), dtype=np.uint8)
+        with self.metrics.timer('decode'):
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+
+        if image is None:
+            print("错误: 无法解码图片数据")
+            return []
+
+        return self.analyze_array(image, image_path)
+
+    def analyze_array(self, image: np.ndarray, image_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """分析已解码的BGR图像，image_path 仅用于填充结果字段"""
+        with self.metrics.timer('analyze'):
+            results = self._analyze_array(image, image_path)
+        self.metrics.count('images')
+        self.metrics.count('qr_codes', len(results))
+        if not results:
+            self.metrics.count('images_without_qr')
+        return results
+
+    def _run_detector(self, name: str, detect, image: np.ndarray) -> List[Dict[str, Any]]:
+        """运行单个检测器并记录耗时和检出数"""
+        with self.metrics.timer(f'detect.{name}'):
+            detections = detect(image)
+        self.metrics.count(f'detections.{name}', len(detections))
+        return detections
+
+    def _analyze_array(self, image: np.ndarray, image_path: Optional[str]) -> List[Dict[str, Any]]:
         # 使用所有检测器检测
         all_detections = []
 
         if self.use_pyzbar:
-            detections = self.detect_with_pyzbar(image)
+            detections = self._run_detector('pyzbar', self.detect_with_pyzbar, image)
             if detections:
                 all_detections.append(detections)
                 print(f"  pyzbar检测到 {len(detections)} 个二维码")
 
         if self.use_opencv_detector:
-            detections = self.detect_with_opencv(image)
+            detections = self._run_detector('opencv', self.detect_with_opencv, image)
             if detections:
                 all_detections.append(detections)
                 print(f"  OpenCV检测到 {len(detections)} 个二维码")
 
         if self.use_wechat_detector:
-            detections = self.detect_with_wechat(image)
+            detections = self._run_detector('wechat', self.detect_with_wechat, image)
             if detections:
                 all_detections.append(detections)
                 print(f"  WeChat检测到 {len(detections)} 个二维码")
 
         # 添加轮廓检测作为补充
-        contour_detections = self.detect_with_contours(image)
+        contour_detections = self._run_detector('contours', self.detect_with_contours, image)
         if contour_detections:
             all_detections.append(contour_detections)
             print(f"  轮廓检测到 {len(contour_detections)} 个候选区域")
@@ -624,11 +810,20 @@ class QRCodeAnalyzerEnsemble:
             # 计算面积占比
             area_info = self.calculate_area_ratio(bbox, image.shape)
 
+            # 有角点时在透视校正后的标准图块上计算指标，否则在原图的bbox上计算
+            metric_image, metric_bbox, modules, thresholds = image, bbox, None, None
+            if self.use_canonical_patch and detection.get('points'):
+                with self.metrics.timer('canonical_patch'):
+                    metric_image, metric_bbox, modules = self.canonical_patch(image, detection['points'])
+                thresholds = self.canonical_clarity_thresholds
+
             # 计算清晰度
-            clarity_info = self.calculate_clarity(image, bbox)
+            with self.metrics.timer('clarity'):
+                clarity_info = self.calculate_clarity(metric_image, metric_bbox, thresholds)
 
             # 计算颜色对比度
-            contrast_info = self.calculate_color_contrast(image, bbox)
+            with self.metrics.timer('contrast'):
+                contrast_info = self.calculate_color_contrast(metric_image, metric_bbox)
 
             # 组合结果
             result = {
@@ -641,29 +836,93 @@ class QRCodeAnalyzerEnsemble:
                 'detectors_used': detection.get('detectors', []),
                 'num_votes': detection.get('num_votes', 1),
                 'fusion_method': detection.get('fusion_method', 'none'),
-                'detection_confidence': detection.get('confidence', 1.0)
+                'detection_confidence': detection.get('confidence', 1.0),
+                'metrics_source': 'canonical_patch' if modules else 'bbox',
+                'qr_modules': modules
             }
 
             results.append(result)
 
         return results
 
-    def batch_analyze(self, image_paths: List[str]) -> Dict[str, List[Dict[str, Any]]]:
-        """批量分析"""
+    def batch_analyze(self, image_paths: List[str], workers: int = 1,
+                      prefilter=None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        批量分析
+
+        Args:
+            image_paths: 图片路径列表
+            workers: 进程数，大于1时由主进程解码图片，经共享内存（shared_frames.py）交给子进程分析
+            prefilter: 预筛选器（见 qr_prefilter.py），判定不含二维码的图片不再经过各个检测器
+        """
+        if workers > 1:
+            return self._parallel_batch_analyze(image_paths, workers, prefilter)
+
         results = {}
 
         for i, image_path in enumerate(image_paths, 1):
             print(f"\n分析第 {i}/{len(image_paths)} 张图片: {image_path}")
 
             try:
-                result = self.analyze_image(image_path)
+                image = None
+                if prefilter is not None:
+                    with self.metrics.timer('decode'):
+                        image = cv2.imread(image_path)
+                if image is None:
+                    result = self.analyze_image(image_path)
+                else:
+                    with self.metrics.timer('prefilter'):
+                        passed = prefilter.contains_qr(image)
+                    if passed:
+                        result = self.analyze_array(image, image_path)
+                    else:
+                        print("预筛选未发现二维码，跳过")
+                        self.metrics.count('prefilter_skipped')
+                        result = []
                 results[image_path] = result
             except Exception as e:
                 print(f"分析失败: {e}")
+                self.metrics.count('errors')
                 results[image_path] = []
 
         return results
 
+    def _parallel_batch_analyze(self, image_paths: List[str], workers: int,
+                                prefilter=None) -> Dict[str, List[Dict[str, Any]]]:
+        from shared_frames import AnalyzerSpec, parallel_analyze, read_frames
+
+        # 检测器对象无法跨进程传递，子进程按相同配置重新创建分析器
+        spec = AnalyzerSpec(
+            type(self).__module__, type(self).__name__,
+            kwargs={
+                'use_pyzbar': self.use_pyzbar,
+                'use_opencv_detector': self.use_opencv_detector,
+                'use_wechat_detector': self.use_wechat_detector,
+                'fusion_strategy': self.fusion_strategy,
+                'min_votes': self.min_votes,
+                'contour_max_side': self.contour_max_side,
+                'use_canonical_patch': self.use_canonical_patch,
+                'canonical_module_px': self.canonical_module_px,
+            },
+            attrs={'clarity_thresholds': self.clarity_thresholds,
+                   'canonical_clarity_thresholds': self.canonical_clarity_thresholds,
+                   'contrast_threshold': self.contrast_threshold},
+            key_arg='image_path',
+            metrics=self.metrics.enabled,
+        )
+        outputs = parallel_analyze(spec, read_frames(image_paths, self.metrics), workers, prefilter=prefilter,
+                                   progress=lambda i, path: print(f"\n分析第 {i}/{len(image_paths)} 张图片: {path}"),
+                                   metrics=self.metrics)
+
+        results = {}
+        for image_path, result, error in outputs:
+            if error is not None:
+                print(f"分析失败: {error}")
+                self.metrics.count('errors')
+                result = []
+            results[image_path] = result
+        return results
+
 
 def main():
     """主函数 - 使用示例"""
@@ -0,0 +1,110 @@
+"""
+基准结果对比单元测试
+
+运行测试: pytest test_benchmark_analyzers.py -v
+"""
+
+import copy
+
+from benchmark_analyzers import compare_results, generate_dataset, run_analyzer
+
+
+def make_cell(p50_ms=10.0, mean_ms=10.0, throughput_ips=100.0, qr_codes=5, stages=None):
+    return {'p50_ms': p50_ms, 'mean_ms': mean_ms, 'throughput_ips': throughput_ips, 'qr_codes': qr_codes,
+            'stages': stages or {'decode': {'mean_ms': 4.0}, 'clarity': {'mean_ms': 2.0}}}
+
+
+def make_report(peak_rss_mb=200.0, **cell):
+    return {'results': {'basic': {'peak_rss_mb': peak_rss_mb, 'cells': {'clear@1': make_cell(**cell)}}}}
+
+
+def metrics(issues):
+    return sorted(issue['metric'] for issue in issues)
+
+
+def test_identical_reports():
+    report = make_report()
+    assert compare_results(report, copy.deepcopy(report)) == []
+
+
+def test_p50_regression():
+    """测试P50延迟增加超过阈值时报告退化"""
+    issues = compare_results(make_report(), make_report(p50_ms=12.0))
+    assert issues == [{'analyzer': 'basic', 'cell': 'clear@1', 'metric': 'p50_ms', 'baseline': 10.0,
+                       'current': 12.0, 'change': 0.2, 'kind': 'regression'}]
+    # 未超过阈值
+    assert compare_results(make_report(), make_report(p50_ms=10.9)) == []
+    assert compare_results(make_report(), make_report(p50_ms=12.0), threshold=0.25) == []
+
+
+def test_throughput_regression():
+    """测试吞吐量下降超过阈值时报告退化"""
+    issues = compare_results(make_report(), make_report(throughput_ips=80.0, mean_ms=12.5))
+    assert metrics(issues) == ['throughput_ips']
+    assert issues[0]['change'] == -0.2
+    assert compare_results(make_report(), make_report(throughput_ips=95.0, mean_ms=10.5)) == []
+
+
+def test_min_delta_suppresses_small_changes():
+    """测试延迟增加的绝对值小于 min_delta_ms 时忽略，即使比例超过阈值"""
+    baseline = make_report(p50_ms=0.5, mean_ms=0.5, throughput_ips=2000.0)
+    current = make_report(p50_ms=0.9, mean_ms=0.9, throughput_ips=1100.0)
+    assert compare_results(baseline, current) == []
+    assert metrics(compare_results(baseline, current, min_delta_ms=0.1)) == ['p50_ms', 'throughput_ips']
+
+
+def test_rss_threshold():
+    """测试峰值内存增加超过 rss_threshold 时报告退化，缺少内存数据时不比较"""
+    issues = compare_results(make_report(), make_report(peak_rss_mb=260.0))
+    assert issues == [{'analyzer': 'basic', 'cell': None, 'metric': 'peak_rss_mb', 'baseline': 200.0,
+                       'current': 260.0, 'change': 0.3, 'kind': 'regression'}]
+    assert compare_results(make_report(), make_report(peak_rss_mb=230.0)) == []
+    assert compare_results(make_report(), make_report(peak_rss_mb=260.0), rss_threshold=0.5) == []
+    assert compare_results(make_report(peak_rss_mb=None), make_report(peak_rss_mb=260.0)) == []
+
+
+def test_qr_codes_changed():
+    """测试检出数变化（增加或减少）都报告为 changed，而不是退化"""
+    for qr_codes in (4, 6):
+        issues = compare_results(make_report(), make_report(qr_codes=qr_codes))
+        assert [(issue['metric'], issue['kind'], issue['current']) for issue in issues] == \
+            [('qr_codes', 'changed', qr_codes)]
+
+
+def test_stage_threshold():
+    """测试只有设置 stage_threshold 时才检查分阶段耗时"""
+    current = make_report(stages={'decode': {'mean_ms': 6.0}, 'clarity': {'mean_ms': 2.1}})
+    assert compare_results(make_report(), current) == []
+    assert metrics(compare_results(make_report(), current, stage_threshold=0.1)) == ['stage.decode']
+
+
+def test_missing_analyzer_or_cell_is_skipped():
+    """测试当前结果中缺少的分析器或分组不参与比较"""
+    baseline = make_report()
+    baseline['results']['ensemble_voting'] = copy.deepcopy(baseline['results']['basic'])
+    baseline['results']['basic']['cells']['blurred@2'] = make_cell()
+    current = make_report(p50_ms=10.5)
+    assert compare_results(baseline, current) == []
+
+
+def test_run_analyzer_report_schema(tmp_path):
+    """用两张生成的图片运行 basic 分析器，报告结构与 compare_results 读取的字段一致"""
+    dataset = generate_dataset(str(tmp_path), ['clear'], per_category=2, seed=0)
+    assert dataset['clear']['images'] == 2
+
+    result = run_analyzer('basic', str(tmp_path), ['clear'], [1.0, 0.5], repeat=1, warmup=0)
+
+    assert sorted(result['cells']) == ['clear@0.5', 'clear@1']
+    assert result['peak_rss_mb'] is None or result['peak_rss_mb'] > 0
+    for cell in result['cells'].values():
+        assert cell['images'] == cell['runs'] == 2
+        assert cell['p50_ms'] > 0 and cell['mean_ms'] > 0 and cell['throughput_ips'] > 0
+        assert isinstance(cell['qr_codes'], int)
+        assert all('mean_ms' in stage for stage in cell['stages'].values())
+
+    report = {'results': {'basic': result}}
+    assert compare_results(report, copy.deepcopy(report)) == []
+    slower = copy.deepcopy(report)
+    slower['results']['basic']['cells']['clear@1']['p50_ms'] += 1000
+    assert [(issue['cell'], issue['metric']) for issue in compare_results(report, slower)] == \
+        [('clear@1', 'p50_ms')]
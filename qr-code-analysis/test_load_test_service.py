@@ -0,0 +1,51 @@
+"""
+分析服务压测脚本单元测试
+
+运行测试: pytest test_load_test_service.py -v
+"""
+
+import asyncio
+
+from aiohttp import web
+
+from load_test_service import print_report, run_load
+
+
+def run_against(handler, rps, duration, timeout_s):
+    async def main():
+        app = web.Application()
+        app.router.add_post('/api/v1/analyze/qr', handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            return await run_load(f"http://127.0.0.1:{port}/api/v1/analyze/qr", [('a.png', b'x')],
+                                  rps, duration, 8, timeout_s)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_timeouts_are_recorded():
+    """测试请求超时记为 timeout，而不是中断整个压测"""
+    async def slow(request):
+        await request.read()
+        await asyncio.sleep(1)
+        return web.json_response({})
+
+    results, elapsed = run_against(slow, rps=20, duration=0.2, timeout_s=0.1)
+    assert [status for status, _ in results] == ['timeout'] * 4
+    assert print_report(results, elapsed, target_p99_ms=0) is False
+
+
+def test_report_without_requests():
+    """测试 rps × duration 小于 1 时不发请求，报告不除以零"""
+    async def ok(request):
+        return web.json_response({})
+
+    results, elapsed = run_against(ok, rps=0.5, duration=1, timeout_s=1)
+    assert results == []
+    assert print_report(results, elapsed, target_p99_ms=100) is False
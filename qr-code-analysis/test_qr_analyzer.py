@@ -155,6 +155,67 @@ class TestQRCodeAnalyzer:
         # 注意：这取决于具体阈值设置
         assert result['contrast_score'] >= 0
 
+    def test_assess_module_contrast(self):
+        """测试按模块网格采样的符号对比度"""
+        import qrcode
+
+        code = qrcode.QRCode(border=4, box_size=8)
+        code.add_data("https://example.com/module-contrast")
+        code.make()
+        modules = 17 + 4 * code.version
+
+        # 深色模块灰度60、浅色模块200，放在深色背景上并旋转30度
+        image = np.array(code.make_image().convert('L'), dtype=np.uint8)
+        image = np.where(image < 128, 60, 200).astype(np.uint8)
+        image = cv2.copyMakeBorder(image, 100, 100, 100, 100, cv2.BORDER_CONSTANT, value=30)
+        h, w = image.shape
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), 30, 1)
+        gray = cv2.GaussianBlur(cv2.warpAffine(image, matrix, (w, h), borderValue=30), (0, 0), 1.5)
+
+        start, end = 100 + 32, 100 + 32 + 8 * modules
+        corners = np.float32([[start, start], [end, start], [end, end], [start, end]])
+        polygon = [tuple(p) for p in cv2.transform(corners[None], matrix)[0]]
+
+        from pyzbar.pyzbar import Rect
+        x, y, bw, bh = cv2.boundingRect(np.array(polygon, dtype=np.int32))
+        mock_qr = type('obj', (object,), {
+            'rect': Rect(left=x, top=y, width=bw, height=bh),
+            'polygon': polygon
+        })
+
+        result = QRCodeAnalyzer(contrast_mode='modules')._assess_module_contrast(gray, mock_qr)
+
+        assert result['contrast_mode'] == 'modules'
+        assert result['qr_modules'] == modules
+        assert abs(result['dark_module_mean'] - 60) < 10
+        assert abs(result['light_module_mean'] - 200) < 10
+        assert result['quiet_zone_ok']
+        assert result['has_good_contrast']
+        # 静区只采样二维码外的第2、3圈（仍在4模块宽的浅色边框内），(200 - 60) / 255 ≈ 55%
+        assert result['symbol_contrast_grade'] == 'C'
+
+    def test_module_contrast_fallback(self):
+        """测试没有四个角点时模块模式退回区域模式"""
+        image = np.ones((200, 200, 3), dtype=np.uint8) * 255
+        image[50:150, 50:150] = [0, 0, 0]
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        from pyzbar.pyzbar import Rect
+        mock_qr = type('obj', (object,), {
+            'rect': Rect(left=50, top=50, width=100, height=100),
+            'polygon': [(50, 50), (150, 50), (150, 150)],
+            'data': b'test',
+            'type': 'QRCODE'
+        })
+
+        analyzer = QRCodeAnalyzer(contrast_mode='modules')
+        assert analyzer._assess_module_contrast(gray, mock_qr) is None
+        result = analyzer._analyze_single_qr(image, gray, mock_qr)
+        assert result['contrast_mode'] == 'region'
+
+        with pytest.raises(ValueError):
+            QRCodeAnalyzer(contrast_mode='histogram')
+
     def test_batch_analyze_empty_list(self, analyzer):
         """测试空列表的批量分析"""
         results = analyzer.batch_analyze([])
@@ -244,6 +305,26 @@ class TestQRCodeAnalyzer:
         with pytest.raises(ValueError):
             analyzer.analyze_image("nonexistent_image.jpg")
 
+    def test_analyze_bytes_matches_analyze_image(self, analyzer, sample_image, temp_image_path):
+        """测试内存数据与文件路径的分析结果一致"""
+        with open(temp_image_path, 'rb') as f:
+            data = f.read()
+
+        assert analyzer.analyze_bytes(data) == analyzer.analyze_image(temp_image_path)
+        assert analyzer.analyze_bytes(memoryview(data)) == analyzer.analyze_image(temp_image_path)
+
+    def test_analyze_array(self, analyzer, sample_image):
+        """测试直接分析图像数组"""
+        results = analyzer.analyze_array(sample_image)
+        assert isinstance(results, list)
+
+    def test_analyze_bytes_invalid_data(self, analyzer):
+        """测试无法解码的图片数据"""
+        with pytest.raises(ValueError):
+            analyzer.analyze_bytes(b"not an image")
+        with pytest.raises(ValueError):
+            analyzer.analyze_bytes(b"")
+
     def test_clarity_level_mapping(self, analyzer):
         """测试清晰度等级映射"""
         # 创建不同清晰度的测试图像
@@ -0,0 +1,141 @@
+"""
+二维码智能分析系统 - 方案8集成分析器测试
+
+运行测试: pytest test_qr_analyzer_ensemble.py -v
+"""
+
+import cv2
+import numpy as np
+import pytest
+import qrcode
+
+from solution_8_ensemble.qr_analyzer_ensemble import QRCodeAnalyzerEnsemble
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return QRCodeAnalyzerEnsemble(use_pyzbar=False, use_opencv_detector=False, use_wechat_detector=False)
+
+
+def make_qr(version: int, module_px: int, angle: float = 0.0):
+    """
+    生成指定版本的二维码图像
+
+    Returns:
+        (BGR图像, 二维码四个角点, 每边模块数)
+    """
+    qr = qrcode.QRCode(version=version, box_size=module_px, border=4)
+    qr.add_data(f'QR{version}')
+    qr.make(fit=False)
+    image = np.array(qr.make_image().convert('L'), dtype=np.uint8)
+
+    modules = qr.modules_count
+    quiet = 4 * module_px
+    side = modules * module_px
+    points = np.float32([[quiet, quiet], [quiet + side, quiet],
+                         [quiet + side, quiet + side], [quiet, quiet + side]])
+
+    # 四周留白，旋转后二维码不会超出图像
+    pad = image.shape[0] // 2
+    image = cv2.copyMakeBorder(image, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255)
+    points += pad
+    matrix = cv2.getRotationMatrix2D((image.shape[1] / 2, image.shape[0] / 2), angle, 1.0)
+    image = cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]), flags=cv2.INTER_LINEAR,
+                           borderValue=255)
+    points = cv2.transform(points[None], matrix)[0]
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR), points, modules
+
+
+@pytest.mark.parametrize('version', [1, 5, 10])
+@pytest.mark.parametrize('module_px', [1, 3, 8])
+@pytest.mark.parametrize('angle', [0, 25])
+def test_canonical_patch_module_count(analyzer, version, module_px, angle):
+    """不同尺寸、旋转角度下，标准图块的模块数与二维码版本一致，图块大小只取决于模块数"""
+    image, points, expected = make_qr(version, module_px, angle)
+    # 角点顺序打乱后仍能得到同一个图块
+    points = points[[2, 0, 3, 1]]
+
+    patch, bbox, modules = analyzer.canonical_patch(image, points)
+
+    assert modules == expected == 17 + 4 * version
+    size = modules * analyzer.canonical_module_px
+    margin = 4 * analyzer.canonical_module_px
+    assert bbox == {'x': margin, 'y': margin, 'width': size, 'height': size}
+    assert patch.shape[:2] == (size + 2 * margin, size + 2 * margin)
+
+
+def test_estimate_module_count_without_finder_patterns(analyzer):
+    """没有定位图案的图块无法估计模块数"""
+    assert analyzer.estimate_module_count(np.full((84, 84), 255, dtype=np.uint8)) is None
+
+
+@pytest.mark.parametrize('version', [1, 5, 10])
+@pytest.mark.parametrize('module_px', [3, 8])
+@pytest.mark.parametrize('angle', [0, 25])
+@pytest.mark.parametrize('blur_modules, expected', [(0, '清晰'), (0.6, '重度模糊')])
+def test_canonical_clarity_is_stable(analyzer, version, module_px, angle, blur_modules, expected):
+    """标准图块上的清晰度分类只取决于以模块计的模糊程度，与二维码大小和旋转角度无关"""
+    image, points, _ = make_qr(version, module_px, angle)
+    if blur_modules:
+        image = cv2.GaussianBlur(image, (0, 0), blur_modules * module_px)
+
+    patch, bbox, _ = analyzer.canonical_patch(image, points)
+    clarity = analyzer.calculate_clarity(patch, bbox, analyzer.canonical_clarity_thresholds)
+
+    assert clarity['clarity_class'] == expected
+
+
+def make_cluttered_scene(factor: int):
+    """
+    深色背景上放一个带静区的二维码和几种干扰物，factor 为整体放大倍数
+
+    Returns:
+        (BGR图像, 二维码含静区的bbox)
+    """
+    image = np.full((600 * factor, 800 * factor, 3), 90, dtype=np.uint8)
+    qr = qrcode.QRCode(version=3, box_size=4 * factor, border=4)
+    qr.add_data('clutter')
+    qr.make(fit=False)
+    qr_image = np.array(qr.make_image().convert('L'), dtype=np.uint8)
+    side = qr_image.shape[0]
+    x, y = 80 * factor, 60 * factor
+    image[y:y + side, x:x + side] = qr_image[:, :, None]
+
+    # 白色实心方块
+    image[300 * factor:450 * factor, 100 * factor:250 * factor] = 255
+    # 浅色长条
+    image[80 * factor:140 * factor, 400 * factor:750 * factor] = 240
+    # 大格棋盘
+    cell = 40 * factor
+    x0, y0 = 400 * factor, 300 * factor
+    image[y0:y0 + 4 * cell, x0:x0 + 4 * cell] = 255
+    for i in range(4):
+        for j in range(4):
+            if (i + j) % 2:
+                image[y0 + i * cell:y0 + (i + 1) * cell, x0 + j * cell:x0 + (j + 1) * cell] = 20
+    # 文字
+    cv2.putText(image, 'SALE 50%', (100 * factor, 560 * factor), cv2.FONT_HERSHEY_SIMPLEX,
+                1.5 * factor, (255, 255, 255), 3 * factor)
+    return image, {'x': x, 'y': y, 'width': side, 'height': side}
+
+
+@pytest.mark.parametrize('factor', [1, 2, 3, 4])
+def test_contour_detection_in_clutter(analyzer, monkeypatch, factor):
+    """轮廓检测在原尺寸和放大2-4倍的图像上都只接受二维码，近似正方形的干扰物被验证步骤排除"""
+    image, qr_bbox = make_cluttered_scene(factor)
+
+    validated = []
+    validate = analyzer._validate_qr_region
+
+    def record(*args):
+        accepted = validate(*args)
+        validated.append(accepted)
+        return accepted
+
+    monkeypatch.setattr(analyzer, '_validate_qr_region', record)
+    detections = analyzer.detect_with_contours(image)
+
+    assert len(detections) == 1
+    assert analyzer.calculate_iou(detections[0]['bbox'], qr_bbox) > 0.9
+    # 白色方块和棋盘也进入了验证步骤，并被拒绝
+    assert sorted(validated) == [False, False, True]
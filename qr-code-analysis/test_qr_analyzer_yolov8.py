@@ -0,0 +1,114 @@
+"""
+二维码智能分析系统 - 方案2批量清晰度计算测试
+
+运行测试: pytest test_qr_analyzer_yolov8.py -v
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from solution_2_yolov8.qr_analyzer_yolov8 import QRCodeAnalyzerYOLOv8
+
+
+class NoDetectionClient:
+    """代替共享推理进程的客户端，测试中不加载YOLO模型"""
+
+    def detect_batch(self, images):
+        return [[] for _ in images]
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    return QRCodeAnalyzerYOLOv8(inference_client=NoDetectionClient())
+
+
+def reference_features(gray: np.ndarray, row_col_centre: bool = False):
+    """
+    逐个区域计算清晰度特征（批量实现之前的算法）
+
+    Args:
+        row_col_centre: 按旧实现把 (行, 列) 当作 cv2.circle 的 (x, y) 圆心，
+            非正方形区域的低频圆会偏离频谱中心
+
+    Returns:
+        (Laplacian方差, Sobel梯度均值, 高频能量占比)
+    """
+    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    sobel_mean = np.sqrt(cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3) ** 2 +
+                         cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3) ** 2).mean()
+
+    magnitude_spectrum = np.abs(np.fft.fftshift(np.fft.fft2(gray)))
+    rows, cols = gray.shape
+    mask = np.ones((rows, cols), dtype=np.uint8)
+    centre = (rows // 2, cols // 2) if row_col_centre else (cols // 2, rows // 2)
+    cv2.circle(mask, centre, min(rows, cols) // 4, 0, -1)
+    high_freq_ratio = np.sum(magnitude_spectrum * mask) / (np.sum(magnitude_spectrum) + 1e-6)
+    return laplacian_var, sobel_mean, high_freq_ratio
+
+
+def blurred_texture(rows: int, cols: int, sigma: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return cv2.GaussianBlur(rng.integers(0, 256, (rows, cols)).astype(np.uint8), (0, 0), sigma)
+
+
+def test_batch_matches_single_roi_for_square_regions(analyzer):
+    """正方形区域的批量结果与逐个调用 calculate_clarity 一致，也与逐区域的原算法一致"""
+    image = np.full((400, 600, 3), 255, dtype=np.uint8)
+    image[20:84, 20:84] = blurred_texture(64, 64, 0.5, seed=1)[:, :, None]
+    image[100:220, 300:420] = blurred_texture(120, 120, 2.0, seed=2)[:, :, None]
+    other = blurred_texture(150, 150, 4.0, seed=3)
+    regions = [
+        (image, {'x': 20, 'y': 20, 'width': 64, 'height': 64}),
+        (image, {'x': 300, 'y': 100, 'width': 120, 'height': 120}),
+        (other, {'x': 0, 'y': 0, 'width': 150, 'height': 150}),
+        (image, {'x': 560, 'y': 360, 'width': 64, 'height': 64}),   # 超出图像，裁剪为 40x40
+        (image, {'x': 700, 'y': 0, 'width': 10, 'height': 10}),     # 完全在图像外
+    ]
+
+    batch = analyzer.calculate_clarity_batch(regions)
+    single = [analyzer.calculate_clarity(image, bbox) for image, bbox in regions]
+
+    assert batch[-1]['method'] == 'invalid_region'
+    for b, s in zip(batch, single):
+        assert b['clarity_class'] == s['clarity_class']
+        assert b['clarity_score'] == pytest.approx(s['clarity_score'], rel=1e-5)
+
+    # 64、120、150 都是 DFT 的最优尺寸，频域特征无需补齐，与原算法相同
+    for (image, bbox), result in zip(regions[:3], batch):
+        x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+        gray = image[y:y + h, x:x + w]
+        gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY) if gray.ndim == 3 else gray
+        laplacian_var, sobel_mean, high_freq_ratio = reference_features(gray)
+        assert result['laplacian_variance'] == pytest.approx(laplacian_var, rel=1e-4)
+        assert result['sobel_mean'] == pytest.approx(sobel_mean, rel=1e-4)
+        assert result['high_freq_ratio'] == pytest.approx(high_freq_ratio, rel=1e-4)
+
+
+def test_padding_bias_is_small(analyzer):
+    """非最优 DFT 尺寸的正方形区域补齐后，高频能量占比与原算法只差几个百分点"""
+    gray = blurred_texture(97, 97, 1.0)
+    result = analyzer.calculate_clarity_batch([(gray, {'x': 0, 'y': 0, 'width': 97, 'height': 97})])[0]
+    _, _, high_freq_ratio = reference_features(gray)
+    assert result['high_freq_ratio'] == pytest.approx(high_freq_ratio, abs=0.03)
+
+
+@pytest.mark.parametrize('rows, cols', [(40, 200), (200, 40)])
+def test_non_square_mask_centre(analyzer, rows, cols):
+    """
+    非正方形区域的低频圆以频谱中心为圆心
+
+    旧实现把圆心 (行, 列) 传给按 (x, y) 解释的 cv2.circle，狭长区域的低频圆落在频谱之外，
+    高频占比恒为1，模糊的区域也被评为清晰；修正后按实际的高频占比分类
+    """
+    gray = blurred_texture(rows, cols, 4.0)
+    result = analyzer.calculate_clarity_batch([(gray, {'x': 0, 'y': 0, 'width': cols, 'height': rows})])[0]
+
+    laplacian_var, sobel_mean, high_freq_ratio = reference_features(gray)
+    assert result['high_freq_ratio'] == pytest.approx(high_freq_ratio, abs=0.03)
+    assert result['clarity_class'] == analyzer._classify_clarity(laplacian_var, sobel_mean,
+                                                                 high_freq_ratio)['clarity_class'] == '中度模糊'
+
+    _, _, old_ratio = reference_features(gray, row_col_centre=True)
+    assert old_ratio == pytest.approx(1.0)
+    assert analyzer._classify_clarity(laplacian_var, sobel_mean, old_ratio)['clarity_class'] == '清晰'
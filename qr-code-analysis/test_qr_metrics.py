@@ -0,0 +1,99 @@
+"""
+分阶段计时与指标导出单元测试
+
+运行测试: pytest test_qr_metrics.py -v
+"""
+
+import json
+
+import pytest
+
+from qr_metrics import NULL_METRICS, Histogram, Metrics
+
+
+def test_timer_and_counters():
+    """测试计时器记录到对应阶段的直方图，计数器累加"""
+    metrics = Metrics()
+    for _ in range(3):
+        with metrics.timer('detect.pyzbar'):
+            pass
+    metrics.observe('clarity', 0.02)
+    metrics.count('images')
+    metrics.count('qr_codes', 2)
+
+    assert metrics.histograms['detect.pyzbar'].count == 3
+    assert metrics.histograms['clarity'].sum == pytest.approx(0.02)
+    assert metrics.counters == {'images': 1, 'qr_codes': 2}
+
+
+def test_timer_records_on_exception():
+    """测试阶段抛出异常时仍记录耗时，且不吞掉异常"""
+    metrics = Metrics()
+    with pytest.raises(ValueError):
+        with metrics.timer('decode'):
+            raise ValueError("坏图片")
+    assert metrics.histograms['decode'].count == 1
+
+
+def test_histogram_quantile():
+    """测试分位数取所在分桶的上界，且不超过最大值"""
+    histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+    for value in [0.0005] * 90 + [0.05] * 10:
+        histogram.observe(value)
+    assert histogram.counts == [90, 0, 10, 0]
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.95) == 0.05
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_disabled_metrics_is_noop():
+    """测试关闭时不记录任何数据"""
+    with NULL_METRICS.timer('analyze'):
+        pass
+    NULL_METRICS.count('images')
+    NULL_METRICS.observe('decode', 1.0)
+    NULL_METRICS.merge({'counters': {'images': 1}, 'histograms': {}})
+    assert NULL_METRICS.histograms == {} and NULL_METRICS.counters == {}
+    assert NULL_METRICS.timer('a') is NULL_METRICS.timer('b')
+
+
+def test_snapshot_and_merge():
+    """测试快照可序列化，合并后与在同一个对象中记录相同"""
+    worker, combined, parent = Metrics(), Metrics(), Metrics()
+    for value in (0.002, 0.2, 3.0):
+        worker.observe('analyze', value)
+        combined.observe('analyze', value)
+    worker.count('images', 3)
+    combined.count('images', 3)
+
+    snapshot = json.loads(json.dumps(worker.snapshot(reset=True)))
+    assert worker.histograms == {} and worker.counters == {}
+
+    parent.merge(snapshot)
+    assert parent.summary() == combined.summary()
+
+    with pytest.raises(ValueError):
+        Metrics(buckets=(1.0,)).merge(snapshot)
+
+
+def test_summary_and_prometheus():
+    """测试 JSON 摘要和 Prometheus 文本格式"""
+    metrics = Metrics(buckets=(0.01, 0.1))
+    metrics.observe('fusion.voting', 0.005)
+    metrics.observe('fusion.voting', 0.05)
+    metrics.count('prefilter_skipped', 4)
+
+    summary = metrics.summary()
+    assert summary['counters'] == {'prefilter_skipped': 4}
+    stage = summary['stages']['fusion.voting']
+    assert stage['count'] == 2
+    assert stage['total_ms'] == pytest.approx(55.0)
+    assert stage['max_ms'] == pytest.approx(50.0)
+
+    text = metrics.to_prometheus()
+    assert '# TYPE qr_stage_duration_seconds histogram' in text
+    assert 'qr_stage_duration_seconds_bucket{stage="fusion.voting",le="0.01"} 1' in text
+    assert 'qr_stage_duration_seconds_bucket{stage="fusion.voting",le="0.1"} 2' in text
+    assert 'qr_stage_duration_seconds_bucket{stage="fusion.voting",le="+Inf"} 2' in text
+    assert 'qr_stage_duration_seconds_count{stage="fusion.voting"} 2' in text
+    assert 'qr_prefilter_skipped_total 4' in text
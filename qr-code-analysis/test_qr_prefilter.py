@@ -0,0 +1,75 @@
+"""
+二维码预筛选单元测试
+
+运行测试: pytest test_qr_prefilter.py -v
+"""
+
+import cv2
+import numpy as np
+import qrcode
+
+from qr_prefilter import QRPreFilter, match_finder_runs, order_corners, scan_finder_runs, snap_module_count
+
+
+def make_qr_image(size=240, canvas=(600, 800)):
+    """在浅灰背景上放置一个二维码"""
+    qr = qrcode.QRCode(border=4)
+    qr.add_data("https://example.com/prefilter")
+    qr.make(fit=True)
+    modules = np.array(qr.get_matrix(), dtype=np.uint8)
+    qr_image = cv2.resize((1 - modules) * 255, (size, size), interpolation=cv2.INTER_NEAREST)
+    image = np.full(canvas + (3,), 230, dtype=np.uint8)
+    image[100:100 + size, 200:200 + size] = qr_image[:, :, None]
+    return image
+
+
+def test_scan_finder_runs():
+    """测试 1:1:3:1:1 游程的定位与模块大小估计"""
+    line = np.array([0, 0] + [1, 1, 0, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1] + [0, 0], dtype=np.uint8)
+    rows, centers, modules = scan_finder_runs(np.stack([line, 1 - line]), tolerance=0.5)
+    assert list(rows) == [0]
+    assert list(centers) == [9]
+    assert modules[0] == 2.0
+
+
+def test_module_helpers():
+    """测试游程比例匹配、角点排序和模块数取整"""
+    matched, modules = match_finder_runs([[2, 2, 6, 2, 2], [2, 2, 2, 2, 2]], tolerance=0.5)
+    assert list(matched) == [True, False]
+    assert modules[0] == 2.0
+
+    corners = order_corners([[100, 10], [0, 0], [110, 100], [10, 110]])
+    assert corners.tolist() == [[0, 0], [100, 10], [110, 100], [10, 110]]
+
+    assert snap_module_count(22.4) == 21
+    assert snap_module_count(36) == 37
+    assert snap_module_count(5) == 21
+    assert snap_module_count(500) == 177
+
+
+def test_contains_qr():
+    prefilter = QRPreFilter()
+    assert prefilter.contains_qr(make_qr_image())
+    assert prefilter.count_finders(make_qr_image()) == 3
+
+
+def test_skips_images_without_qr():
+    """测试纯色、渐变和噪声图片被跳过"""
+    rng = np.random.default_rng(0)
+    blank = np.full((600, 800, 3), 240, dtype=np.uint8)
+    gradient = np.tile(np.linspace(200, 255, 800, dtype=np.uint8)[None, :, None], (600, 1, 3))
+    noise = rng.integers(100, 200, (600, 800, 3), dtype=np.uint8)
+
+    prefilter = QRPreFilter()
+    assert not any(prefilter.contains_qr(image) for image in (blank, gradient, noise))
+    assert prefilter.stats == {'checked': 3, 'skipped': 3}
+    # 无法判断时交给后续分析
+    assert prefilter.contains_qr(None)
+
+
+def test_recall_tuning():
+    """测试 min_finders 调高后跳过只露出部分定位图案的图片"""
+    image = make_qr_image()
+    image[100:340, 320:440] = 230   # 遮住右半部分，只剩左侧两个定位图案
+    assert QRPreFilter(min_finders=1).contains_qr(image)
+    assert not QRPreFilter(min_finders=3).contains_qr(image)
@@ -0,0 +1,177 @@
+"""
+二维码分析服务单元测试
+
+运行测试: pytest test_qr_service.py -v
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import cv2
+import numpy as np
+from aiohttp import web
+
+from qr_metrics import Metrics
+from qr_service import BatchingAnalyzer, ServiceConfig, build_response, create_app, measure_colors
+
+
+def make_image():
+    """白色背景上的黑色方块"""
+    image = np.full((200, 200, 3), 255, dtype=np.uint8)
+    image[50:150, 50:150] = 0
+    image[90:110, 90:110] = 255
+    return image
+
+
+def encode(image):
+    ok, buffer = cv2.imencode('.png', image)
+    assert ok
+    return buffer.tobytes()
+
+
+def test_build_response_schema():
+    """测试响应结构与接口文档一致"""
+    image = make_image()
+    results = [
+        {'bbox': {'x': 0, 'y': 0, 'width': 10, 'height': 10}, 'clarity_class': '重度模糊',
+         'clarity_score': 1.0, 'has_good_contrast': False},
+        {'bbox': {'x': 50, 'y': 50, 'width': 100, 'height': 100}, 'clarity_class': '中度模糊',
+         'clarity_score': 150.5, 'has_good_contrast': True, 'qr_data': 'hello'},
+    ]
+
+    body = build_response(image, results)
+
+    assert body['status'] == 'success'
+    assert body['meta'] == {'image_width': 200, 'image_height': 200, 'image_area': 40000}
+    assert body['data']['count'] == 2
+    primary = body['data']['primary_qr']
+    assert primary['content'] == 'hello'
+    assert primary['location']['polygon'] == [[50, 50], [150, 50], [150, 150], [50, 150]]
+    assert primary['location']['area_ratio'] == 0.25
+    assert primary['location']['area_check']['passed'] is True
+    assert primary['clarity'] == {'score': 150.5, 'class': 'Moderately Blurred', 'level_code': 3}
+    assert primary['color']['is_similar_to_bg'] is False
+    assert primary['color']['class'] == 'High Contrast'
+
+
+def test_build_response_not_detected():
+    body = build_response(make_image(), [])
+    assert body['status'] == 'success'
+    assert body['data'] == {'detected': False, 'message': 'No QR code detected in the image.'}
+
+
+def test_measure_colors():
+    """测试前景/背景主色与色差"""
+    colors = measure_colors(make_image(), {'x': 50, 'y': 50, 'width': 100, 'height': 100})
+    assert colors['dominant_color_fg'] == [0, 0, 0]
+    assert colors['dominant_color_bg'] == [255, 255, 255]
+    assert colors['contrast_delta_e'] > 90
+
+
+def fake_batch(items):
+    """按图片大小返回结果，并记录每批的大小"""
+    fake_batch.sizes.append(len(items))
+    time.sleep(0.05)
+    return [{'status': 200, 'body': {'status': 'success', 'size': len(data)}} for data in items]
+
+
+def fake_batch_with_metrics(items):
+    """同 fake_batch，额外返回模拟分析进程记录的指标快照"""
+    metrics = Metrics()
+    metrics.observe('analyze', 0.01)
+    metrics.count('images', len(items))
+    return fake_batch(items), metrics.snapshot()
+
+
+def run_with_service(config, scenario, batch_fn=fake_batch):
+    fake_batch.sizes = []
+
+    async def main():
+        batcher = BatchingAnalyzer(config, executor=ThreadPoolExecutor(config.workers), batch_fn=batch_fn)
+        runner = web.AppRunner(create_app(config, batcher))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            return await scenario(f"http://127.0.0.1:{port}")
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+async def post_image(session, base_url, data):
+    form = aiohttp.FormData()
+    form.add_field('file', data, filename='qr.png')
+    async with session.post(base_url + '/api/v1/analyze/qr', data=form) as resp:
+        return resp.status, await resp.json()
+
+
+def test_requests_are_batched():
+    """测试并发请求在时间窗口内合并成批"""
+    config = ServiceConfig(workers=1, batch_window_ms=50, max_batch_size=8, max_queue=32)
+    data = encode(make_image())
+
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            return await asyncio.gather(*[post_image(session, base_url, data) for _ in range(8)])
+
+    responses = run_with_service(config, scenario)
+    assert all(status == 200 for status, _ in responses)
+    assert all(body['size'] == len(data) for _, body in responses)
+    assert max(fake_batch.sizes) > 1
+    assert sum(fake_batch.sizes) == 8
+
+
+def test_queue_full_returns_429():
+    """测试队列满时返回 429"""
+    config = ServiceConfig(workers=1, batch_window_ms=1, max_batch_size=1, max_queue=2)
+    data = encode(make_image())
+
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            responses = await asyncio.gather(*[post_image(session, base_url, data) for _ in range(10)])
+            async with session.post(base_url + '/api/v1/analyze/qr', data=b'x') as resp:
+                bad_request = resp.status
+        return responses, bad_request
+
+    responses, bad_request = run_with_service(config, scenario)
+    statuses = [status for status, _ in responses]
+    assert statuses.count(429) > 0
+    assert statuses.count(200) >= config.max_queue
+    assert bad_request == 400
+
+
+def test_metrics_endpoints():
+    """测试分析进程的指标合并到服务中，并经 /metrics 和 /metrics.json 导出"""
+    config = ServiceConfig(workers=1, batch_window_ms=20, max_batch_size=4, metrics=True)
+    data = encode(make_image())
+
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*[post_image(session, base_url, data) for _ in range(5)])
+            async with session.get(base_url + '/metrics') as resp:
+                text = resp.status, resp.headers['Content-Type'], await resp.text()
+            async with session.get(base_url + '/metrics.json') as resp:
+                summary = await resp.json()
+        return text, summary
+
+    (status, content_type, text), summary = run_with_service(config, scenario, fake_batch_with_metrics)
+    assert status == 200 and content_type.startswith('text/plain')
+    assert 'qr_images_total 5' in text
+    assert summary['counters']['images'] == 5
+    assert summary['stages']['queue_wait']['count'] == 5
+    assert summary['stages']['analyze']['count'] == len(fake_batch.sizes)
+
+
+def test_metrics_disabled():
+    """测试未启用指标时 /metrics 返回 404"""
+    async def scenario(base_url):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(base_url + '/metrics') as resp:
+                return resp.status
+
+    assert run_with_service(ServiceConfig(workers=1), scenario) == 404
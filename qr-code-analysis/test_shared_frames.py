@@ -0,0 +1,90 @@
+"""
+共享内存图像传递单元测试
+
+运行测试: pytest test_shared_frames.py -v
+"""
+
+import numpy as np
+
+from qr_metrics import NULL_METRICS, Metrics
+from shared_frames import AnalyzerSpec, SharedFrameReader, SharedFrameRing, parallel_analyze
+
+
+class SumAnalyzer:
+    """按像素和返回结果，用于验证子进程看到的图像与主进程一致"""
+
+    def __init__(self, offset=0, metrics=None):
+        self.offset = offset
+        self.scale = 1
+        self.metrics = metrics or NULL_METRICS
+
+    def analyze_array(self, image, source=None):
+        if image.shape[0] == 1:
+            raise ValueError("图像太小")
+        self.metrics.count('images')
+        with self.metrics.timer('analyze'):
+            pass
+        return [{'source': source, 'shape': image.shape,
+                 'sum': int(image.sum()) * self.scale + self.offset}]
+
+
+def test_ring_roundtrip_and_grow():
+    """测试写入槽位后可以读出相同的图像，容量不足时槽位自动扩容"""
+    ring = SharedFrameRing(2, slot_bytes=64)
+    reader = SharedFrameReader()
+    try:
+        small = np.arange(48, dtype=np.uint8).reshape(4, 4, 3)
+        handle = ring.write(0, small)
+        assert np.array_equal(reader.view(handle), small)
+
+        large = np.random.default_rng(0).integers(0, 255, (32, 32, 3), dtype=np.uint8)
+        grown = ring.write(0, large)
+        assert grown.name != handle.name
+        assert np.array_equal(reader.view(grown), large)
+
+        gray = np.ones((5, 5), dtype=np.float32)
+        assert np.array_equal(reader.view(ring.write(1, gray)), gray)
+    finally:
+        for block in reader.attached.values():
+            block.close()
+        ring.close()
+
+
+def test_parallel_analyze_keeps_order():
+    """测试并行结果按输入顺序返回，错误按图像单独记录"""
+    rng = np.random.default_rng(1)
+    images = [rng.integers(0, 255, (20 + i, 30, 3), dtype=np.uint8) for i in range(12)]
+    frames = [(f"img_{i}", image) for i, image in enumerate(images)]
+    frames.insert(3, ("broken", ValueError("无法读取图像")))
+    frames.insert(5, ("tiny", np.zeros((1, 4, 3), dtype=np.uint8)))
+
+    spec = AnalyzerSpec(SumAnalyzer.__module__, 'SumAnalyzer', kwargs={'offset': 1},
+                        attrs={'scale': 2}, key_arg='source')
+    progress = []
+    outputs = parallel_analyze(spec, frames, workers=2, slots=3, slot_bytes=256,
+                               progress=lambda i, key: progress.append(i))
+
+    assert [key for key, _, _ in outputs] == [key for key, _ in frames]
+    assert progress == list(range(1, len(frames) + 1))
+    for (key, image), (_, results, error) in zip(frames, outputs):
+        if key in ("broken", "tiny"):
+            assert results is None and isinstance(error, ValueError)
+        else:
+            assert error is None
+            assert results == [{'source': key, 'shape': image.shape, 'sum': int(image.sum()) * 2 + 1}]
+
+
+def test_parallel_analyze_merges_metrics():
+    """测试子进程中记录的指标随结果传回并合并到主进程"""
+    images = [np.full((10 + i, 10, 3), i, dtype=np.uint8) for i in range(6)]
+    frames = [(f"img_{i}", image) for i, image in enumerate(images)]
+    frames.append(("tiny", np.zeros((1, 4, 3), dtype=np.uint8)))
+
+    spec = AnalyzerSpec(SumAnalyzer.__module__, 'SumAnalyzer', key_arg='source', metrics=True)
+    metrics = Metrics()
+    outputs = parallel_analyze(spec, frames, workers=2, slots=2, slot_bytes=256, metrics=metrics)
+
+    assert [results[0]['sum'] for _, results, error in outputs if error is None] == \
+        [int(image.sum()) for image in images]
+    assert metrics.counters['images'] == len(images)
+    assert metrics.histograms['analyze'].count == len(images)
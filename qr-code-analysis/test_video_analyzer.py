@@ -0,0 +1,77 @@
+"""
+视频分析单元测试
+
+运行测试: pytest test_video_analyzer.py -v
+"""
+
+import cv2
+import numpy as np
+
+from video_analyzer import QRVideoAnalyzer, bbox_iou
+
+
+def make_pattern(size=60, seed=0):
+    """类似二维码的随机黑白方块图案"""
+    modules = np.random.default_rng(seed).integers(0, 2, (12, 12), dtype=np.uint8) * 255
+    return cv2.resize(modules, (size, size), interpolation=cv2.INTER_NEAREST)
+
+
+def make_frames(count=20, step=3):
+    pattern = cv2.cvtColor(make_pattern(), cv2.COLOR_GRAY2BGR)
+    frames, positions = [], []
+    for i in range(count):
+        frame = np.full((240, 320, 3), 200, dtype=np.uint8)
+        x, y = 40 + i * step, 80 + i
+        frame[y:y + 60, x:x + 60] = pattern
+        frames.append(frame)
+        positions.append((x, y))
+    return frames, positions
+
+
+class FakeAnalyzer:
+    """按已知位置返回检测结果，只在第一次调用时“解码”出内容"""
+
+    def __init__(self, frames, positions):
+        self.frame_positions = {id(frame): pos for frame, pos in zip(frames, positions)}
+        self.calls = []
+
+    def analyze_array(self, image):
+        index = len(self.calls)
+        self.calls.append(index)
+        x, y = self.frame_positions[id(image)]
+        return [{'bbox': {'x': x, 'y': y, 'width': 60, 'height': 60},
+                 'qr_data': 'hello' if index == 0 else '', 'clarity_score': 100.0}]
+
+
+def test_tracking_between_keyframes():
+    """测试关键帧之间的检测框跟随目标移动，内容在关键帧之间复用"""
+    frames, positions = make_frames()
+    analyzer = FakeAnalyzer(frames, positions)
+    video = QRVideoAnalyzer(analyzer, keyframe_interval=10)
+
+    outputs = list(video.analyze_stream(frames))
+
+    assert [o['frame_index'] for o in outputs if o['keyframe']] == [0, 10]
+    assert len(analyzer.calls) == 2
+    for output, (x, y) in zip(outputs, positions):
+        qr = output['qr_codes'][0]
+        assert qr['track_id'] == 0
+        assert qr['qr_data'] == 'hello'
+        assert qr['tracked'] == (not output['keyframe'])
+        assert bbox_iou(qr['bbox'], {'x': x, 'y': y, 'width': 60, 'height': 60}) > 0.8
+
+    summary = video.summary()
+    assert summary['frames'] == 20 and summary['keyframes'] == 2 and summary['tracks'] == 1
+
+
+def test_lost_track_triggers_keyframe():
+    """测试目标消失导致跟踪置信度下降时立即做完整分析"""
+    frames, positions = make_frames(count=6)
+    frames[3] = np.full_like(frames[3], 200)
+    analyzer = FakeAnalyzer(frames, positions)
+    video = QRVideoAnalyzer(analyzer, keyframe_interval=100)
+
+    outputs = list(video.analyze_stream(frames))
+
+    assert outputs[3]['keyframe'] is True
+    assert not any(o['keyframe'] for o in outputs[1:3])
@@ -0,0 +1,128 @@
+"""
+共享YOLO推理进程 - 客户端/服务端协议测试（用假模型代替 ultralytics）
+
+运行测试: pytest test_yolo_inference_server.py -v
+"""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from solution_2_yolov8.yolo_inference_server import YOLOInferenceClient, YOLOInferenceServer
+
+
+class _Tensor:
+    """模拟 torch 张量的 .cpu().numpy()"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.value
+
+
+class _Box:
+    def __init__(self, xyxy):
+        self.xyxy = [_Tensor(np.array(xyxy, dtype=np.float32))]
+        self.conf = [0.9]
+        self.cls = [0]
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class DarkRegionModel:
+    """把图像中暗像素的外接矩形当作检测框"""
+
+    def __call__(self, images, conf, verbose):
+        results = []
+        for image in images:
+            ys, xs = np.nonzero(image[:, :, 0] < 128)
+            boxes = [_Box([xs.min(), ys.min(), xs.max() + 1, ys.max() + 1])] if len(xs) else []
+            results.append(_Result(boxes))
+        return results
+
+
+class FailingModel:
+    def __call__(self, images, conf, verbose):
+        raise ValueError("bad batch")
+
+
+class CrashingModel:
+    def __call__(self, images, conf, verbose):
+        os._exit(1)
+
+
+def fake_model_factory(model_path):
+    return {'dark': DarkRegionModel, 'fail': FailingModel, 'crash': CrashingModel}[model_path]()
+
+
+def make_image(h, w, box):
+    image = np.full((h, w, 3), 255, dtype=np.uint8)
+    x, y, bw, bh = box
+    image[y:y + bh, x:x + bw] = 0
+    return image
+
+
+def test_round_trip_restores_original_coordinates():
+    """图像经共享内存送到推理进程，检测框按缩放比例还原到原图坐标，顺序与输入一致"""
+    with YOLOInferenceServer(model_path='dark', num_clients=2, slots_per_client=2, imgsz=64,
+                             model_factory=fake_model_factory) as server:
+        client = server.client(1)
+        boxes = [(8, 8, 16, 16), (40, 20, 64, 32), (0, 0, 10, 10)]
+        images = [make_image(64, 64, boxes[0]), make_image(128, 256, boxes[1]), make_image(32, 32, boxes[2])]
+
+        # 3 张图像超过 2 个槽位，需要分两轮提交
+        outputs = client.detect_batch(images)
+
+    assert len(outputs) == 3
+    for detections, (x, y, w, h) in zip(outputs, boxes):
+        assert len(detections) == 1
+        bbox = detections[0]['bbox']
+        assert abs(bbox['x'] - x) <= 1 and abs(bbox['y'] - y) <= 1
+        assert abs(bbox['width'] - w) <= 2 and abs(bbox['height'] - h) <= 2
+        assert detections[0]['confidence'] == pytest.approx(0.9)
+
+
+def test_model_error_is_raised_in_client():
+    """模型推理出错时客户端抛出 RuntimeError，推理进程继续服务"""
+    with YOLOInferenceServer(model_path='fail', num_clients=1, imgsz=32,
+                             model_factory=fake_model_factory) as server:
+        client = server.client(0)
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match="bad batch"):
+                client.detect(make_image(32, 32, (4, 4, 8, 8)))
+
+
+def test_dead_server_raises_instead_of_blocking():
+    """推理进程崩溃后客户端在心跳超时内抛出 RuntimeError，而不是一直等待"""
+    with YOLOInferenceServer(model_path='crash', num_clients=1, imgsz=32, request_timeout=60,
+                             model_factory=fake_model_factory) as server:
+        client = server.client(0)
+        started = time.monotonic()
+        with pytest.raises(RuntimeError, match="已退出"):
+            client.detect(make_image(32, 32, (4, 4, 8, 8)))
+        assert time.monotonic() - started < 30
+
+
+def test_request_timeout_without_reply():
+    """推理进程存活但迟迟不回复时，超过 timeout 抛出 RuntimeError"""
+    import multiprocessing as mp
+
+    server = YOLOInferenceServer(num_clients=1, imgsz=32, request_timeout=0.2)
+    try:
+        # 不启动推理进程，手动维持心跳模拟一个卡住的推理进程
+        server.heartbeat.value = time.time() + 60
+        client = YOLOInferenceClient(0, server.slot_names[0], 32, mp.Queue(), mp.Queue(),
+                                     server.heartbeat, timeout=0.2)
+        with pytest.raises(RuntimeError, match="超时"):
+            client.detect(make_image(32, 32, (4, 4, 8, 8)))
+    finally:
+        server.stop()
@@ -0,0 +1,335 @@
+"""
+二维码智能分析系统 - 视频/摄像头流分析
+
+逐帧做完整检测在 CPU 上达不到实时，这里只在关键帧上调用分析器：
+- 每隔 keyframe_interval 帧，或任一跟踪目标的置信度低于阈值时，做一次完整分析
+- 关键帧之间用光流（特征点不足时退回模板匹配）把上一帧的检测框传播到当前帧
+- 每个跟踪目标复用关键帧上解码出的内容和各项指标，不重复解码
+
+用法:
+    python video_analyzer.py store_camera.mp4 --analyzer basic --output results.jsonl
+    python video_analyzer.py 0 --keyframe-interval 15   # 摄像头编号
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+
+def bbox_iou(a: Dict[str, int], b: Dict[str, int]) -> float:
+    """两个检测框的交并比"""
+    x1, y1 = max(a['x'], b['x']), max(a['y'], b['y'])
+    x2 = min(a['x'] + a['width'], b['x'] + b['width'])
+    y2 = min(a['y'] + a['height'], b['y'] + b['height'])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a['width'] * a['height'] + b['width'] * b['height'] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def clip_bbox(x: float, y: float, w: float, h: float, shape) -> Dict[str, int]:
+    height, width = shape[:2]
+    x = int(round(min(max(x, 0), width - 1)))
+    y = int(round(min(max(y, 0), height - 1)))
+    return {'x': x, 'y': y,
+            'width': int(round(max(1, min(w, width - x)))),
+            'height': int(round(max(1, min(h, height - y))))}
+
+
+class QRTrack:
+    """一个被跟踪的二维码：最近一次完整分析的结果加上当前位置"""
+
+    def __init__(self, track_id: int, result: Dict[str, Any], frame_index: int):
+        self.track_id = track_id
+        self.result = result
+        self.bbox = dict(result['bbox'])
+        self.confidence = 1.0
+        self.keyframe_index = frame_index
+
+    def update(self, result: Dict[str, Any], frame_index: int):
+        """关键帧上重新匹配到该目标；新结果没有解码出内容时沿用之前的内容"""
+        if not result.get('qr_data') and self.result.get('qr_data'):
+            result = {**result, 'qr_data': self.result['qr_data']}
+        self.result = result
+        self.bbox = dict(result['bbox'])
+        self.confidence = 1.0
+        self.keyframe_index = frame_index
+
+    def output(self, tracked: bool) -> Dict[str, Any]:
+        return {
+            **self.result,
+            'bbox': dict(self.bbox),
+            'track_id': self.track_id,
+            'tracked': tracked,
+            'tracking_confidence': round(self.confidence, 3),
+            'keyframe_index': self.keyframe_index,
+        }
+
+
+class QRVideoAnalyzer:
+    """在任一分析器（需提供 analyze_array）之上实现视频流分析"""
+
+    def __init__(self, analyzer, keyframe_interval: int = 30, min_track_confidence: float = 0.5,
+                 match_iou: float = 0.3, max_features: int = 50):
+        """
+        Args:
+            analyzer: QRCodeAnalyzer / QRCodeAnalyzerEnsemble / QRCodeAnalyzerYOLOv8 等分析器
+            keyframe_interval: 关键帧间隔（帧）
+            min_track_confidence: 跟踪置信度低于该值时立即做完整分析
+            match_iou: 关键帧检测结果与已有跟踪目标关联的最小交并比
+            max_features: 每个目标用于光流跟踪的最大特征点数
+        """
+        self.analyzer = analyzer
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.min_track_confidence = min_track_confidence
+        self.match_iou = match_iou
+        self.max_features = max_features
+        self.reset()
+
+    def reset(self):
+        self.tracks: List[QRTrack] = []
+        self.next_track_id = 0
+        self.prev_gray = None
+        self.frames_since_keyframe = 0
+        self.stats = {'frames': 0, 'keyframes': 0, 'tracks': 0, 'analysis_time': 0.0, 'tracking_time': 0.0}
+
+    # ---------- 关键帧 ----------
+
+    def _analyze_keyframe(self, frame: np.ndarray, frame_index: int):
+        start = time.perf_counter()
+        results = self.analyzer.analyze_array(frame)
+        self.stats['analysis_time'] += time.perf_counter() - start
+        self.stats['keyframes'] += 1
+
+        # 按交并比把检测结果关联到已有目标，保持 track_id 和已解码的内容
+        tracks = []
+        unmatched = list(self.tracks)
+        for result in results:
+            best = max(unmatched, key=lambda t: bbox_iou(t.bbox, result['bbox']), default=None)
+            if best is not None and bbox_iou(best.bbox, result['bbox']) >= self.match_iou:
+                unmatched.remove(best)
+                best.update(result, frame_index)
+                tracks.append(best)
+            else:
+                tracks.append(QRTrack(self.next_track_id, result, frame_index))
+                self.next_track_id += 1
+                self.stats['tracks'] += 1
+        self.tracks = tracks
+        self.frames_since_keyframe = 0
+
+    # ---------- 关键帧之间的跟踪 ----------
+
+    def _track_flow(self, track: QRTrack, gray: np.ndarray) -> Optional[Tuple[float, float, float, float]]:
+        """光流跟踪：取目标区域内的角点，前后向校验后用位移中位数和尺度中位数更新检测框"""
+        b = track.bbox
+        mask = np.zeros_like(self.prev_gray)
+        mask[b['y']:b['y'] + b['height'], b['x']:b['x'] + b['width']] = 255
+        points = cv2.goodFeaturesToTrack(self.prev_gray, self.max_features, 0.01, 3, mask=mask)
+        if points is None or len(points) < 4:
+            return None
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None, **LK_PARAMS)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, moved, None, **LK_PARAMS)
+        error = np.linalg.norm((points - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < 1.0)
+        if good.sum() < 4:
+            return None
+
+        src, dst = points.reshape(-1, 2)[good], moved.reshape(-1, 2)[good]
+        dx, dy = np.median(dst - src, axis=0)
+        # 尺度：点到中心距离之比的中位数
+        src_d = np.linalg.norm(src - src.mean(axis=0), axis=1)
+        dst_d = np.linalg.norm(dst - dst.mean(axis=0), axis=1)
+        valid = src_d > 1e-3
+        scale = float(np.median(dst_d[valid] / src_d[valid])) if valid.any() else 1.0
+
+        cx = b['x'] + b['width'] / 2 + dx
+        cy = b['y'] + b['height'] / 2 + dy
+        w, h = b['width'] * scale, b['height'] * scale
+        confidence = float(good.sum()) / len(points)
+        return cx - w / 2, cy - h / 2, w, confidence
+
+    def _track_template(self, track: QRTrack, gray: np.ndarray) -> Tuple[Dict[str, int], float]:
+        """模板匹配：在上一位置附近搜索上一帧的目标区域"""
+        b = track.bbox
+        template = self.prev_gray[b['y']:b['y'] + b['height'], b['x']:b['x'] + b['width']]
+        margin_x, margin_y = b['width'] // 2, b['height'] // 2
+        x0, y0 = max(0, b['x'] - margin_x), max(0, b['y'] - margin_y)
+        x1 = min(gray.shape[1], b['x'] + b['width'] + margin_x)
+        y1 = min(gray.shape[0], b['y'] + b['height'] + margin_y)
+        window = gray[y0:y1, x0:x1]
+        if template.size == 0 or window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+            return b, 0.0
+
+        scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (mx, my) = cv2.minMaxLoc(scores)
+        bbox = clip_bbox(x0 + mx, y0 + my, b['width'], b['height'], gray.shape)
+        return bbox, max(0.0, float(score))
+
+    def _track(self, gray: np.ndarray):
+        start = time.perf_counter()
+        for track in self.tracks:
+            flow = self._track_flow(track, gray)
+            if flow is not None:
+                x, y, w, confidence = flow
+                h = w * track.bbox['height'] / max(1, track.bbox['width'])
+                track.bbox = clip_bbox(x, y, w, h, gray.shape)
+            else:
+                track.bbox, confidence = self._track_template(track, gray)
+            # 取自上次关键帧以来的最低值，任何一帧跟踪不可靠都会触发完整分析
+            track.confidence = min(track.confidence, confidence)
+        self.stats['tracking_time'] += time.perf_counter() - start
+
+    # ---------- 对外接口 ----------
+
+    def process_frame(self, frame: np.ndarray, frame_index: Optional[int] = None) -> Dict[str, Any]:
+        """
+        处理一帧
+
+        Returns:
+            {'frame_index', 'keyframe', 'qr_codes'}，qr_codes 中每项为分析结果加上
+            track_id、tracked（是否为跟踪得到的位置）、tracking_confidence、keyframe_index
+        """
+        if frame_index is None:
+            frame_index = self.stats['frames']
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        is_keyframe = (self.prev_gray is None
+                       or self.frames_since_keyframe + 1 >= self.keyframe_interval
+                       or self.prev_gray.shape != gray.shape)
+        if not is_keyframe:
+            self._track(gray)
+            self.frames_since_keyframe += 1
+            is_keyframe = any(t.confidence < self.min_track_confidence for t in self.tracks)
+        if is_keyframe:
+            self._analyze_keyframe(frame, frame_index)
+
+        self.prev_gray = gray
+        self.stats['frames'] += 1
+        return {
+            'frame_index': frame_index,
+            'keyframe': is_keyframe,
+            'qr_codes': [track.output(tracked=not is_keyframe) for track in self.tracks],
+        }
+
+    def analyze_stream(self, frames: Iterable[np.ndarray]) -> Iterator[Dict[str, Any]]:
+        """分析任意帧序列（例如已解码的视频帧列表），逐帧产出结果"""
+        self.reset()
+        for frame_index, frame in enumerate(frames):
+            yield self.process_frame(frame, frame_index)
+
+    def analyze_video(self, source: Union[str, int], frame_step: int = 1,
+                      max_frames: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        分析视频文件、视频流地址或摄像头
+
+        Args:
+            source: 视频路径、RTSP/HTTP 地址或摄像头编号
+            frame_step: 每隔多少帧处理一帧（跳过的帧只做 grab，不解码）
+            max_frames: 最多处理的帧数
+
+        Returns:
+            逐帧结果的生成器，每项额外包含 timestamp_ms
+        """
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"无法打开视频: {source}")
+
+        self.reset()
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        frame_index = 0
+        processed = 0
+        try:
+            while max_frames is None or processed < max_frames:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                timestamp = capture.get(cv2.CAP_PROP_POS_MSEC)
+                if not timestamp and fps > 0:
+                    timestamp = frame_index / fps * 1000
+
+                output = self.process_frame(frame, frame_index)
+                output['timestamp_ms'] = round(timestamp, 1)
+                yield output
+                processed += 1
+
+                for _ in range(frame_step - 1):
+                    if not capture.grab():
+                        break
+                frame_index += frame_step
+        finally:
+            capture.release()
+
+    def summary(self) -> Dict[str, Any]:
+        frames = self.stats['frames']
+        total = self.stats['analysis_time'] + self.stats['tracking_time']
+        return {
+            'frames': frames,
+            'keyframes': self.stats['keyframes'],
+            'keyframe_ratio': round(self.stats['keyframes'] / frames, 3) if frames else 0.0,
+            'tracks': self.stats['tracks'],
+            'analysis_time_s': round(self.stats['analysis_time'], 3),
+            'tracking_time_s': round(self.stats['tracking_time'], 3),
+            'fps': round(frames / total, 1) if total > 0 else 0.0,
+        }
+
+
+def create_analyzer(name: str):
+    """按名称创建分析器，只导入对应依赖"""
+    if name == 'basic':
+        from qr_analyzer_basic import QRCodeAnalyzer
+        return QRCodeAnalyzer()
+    if name == 'ensemble':
+        from solution_8_ensemble.qr_analyzer_ensemble import QRCodeAnalyzerEnsemble
+        return QRCodeAnalyzerEnsemble(use_wechat_detector=False)
+    if name == 'yolo':
+        from solution_2_yolov8.qr_analyzer_yolov8 import QRCodeAnalyzerYOLOv8
+        return QRCodeAnalyzerYOLOv8()
+    raise ValueError(f"未知的分析器: {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='二维码视频/摄像头流分析')
+    parser.add_argument('source', help='视频路径、流地址或摄像头编号')
+    parser.add_argument('--analyzer', choices=['basic', 'ensemble', 'yolo'], default='basic')
+    parser.add_argument('--keyframe-interval', type=int, default=30, help='关键帧间隔（帧）')
+    parser.add_argument('--min-track-confidence', type=float, default=0.5,
+                        help='跟踪置信度低于该值时立即做完整分析')
+    parser.add_argument('--frame-step', type=int, default=1, help='每隔多少帧处理一帧')
+    parser.add_argument('--max-frames', type=int, default=None, help='最多处理的帧数')
+    parser.add_argument('--output', help='逐帧结果输出路径（JSON Lines）')
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    video = QRVideoAnalyzer(create_analyzer(args.analyzer), keyframe_interval=args.keyframe_interval,
+                            min_track_confidence=args.min_track_confidence)
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        for output in video.analyze_video(source, frame_step=args.frame_step, max_frames=args.max_frames):
+            if out:
+                out.write(json.dumps(output, ensure_ascii=False) + '\n')
+            if output['keyframe']:
+                contents = [qr.get('qr_data', '') for qr in output['qr_codes']]
+                print(f"帧 {output['frame_index']} (关键帧): {len(contents)} 个二维码 {contents}")
+    finally:
+        if out:
+            out.close()
+
+    summary = video.summary()
+    print("\n" + "=" * 60)
+    print(f"处理帧数: {summary['frames']}，关键帧: {summary['keyframes']} ({summary['keyframe_ratio'] * 100:.1f}%)")
+    print(f"跟踪目标数: {summary['tracks']}")
+    print(f"完整分析耗时: {summary['analysis_time_s']}s，跟踪耗时: {summary['tracking_time_s']}s")
+    print(f"处理速度: {summary['fps']} 帧/秒（不含视频解码）")
+
+
+if __name__ == '__main__':
+    main()